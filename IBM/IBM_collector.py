@@ -4,7 +4,9 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 import os
+import sys
 import time
 import json
 import logger as lg
@@ -13,11 +15,62 @@ from tqdm import tqdm
 import threading
 import queue
 
+# the shared modules live in the root of the repository, appended so that the local logger is still used
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import nvd_feed
+import pack_store
+import metrics
+import work_queue
+import collection_state
 
+
+YEARS = ["2024", "2023", "2022", "2021", "2020"]
+# size of the browser worker pool
 THREATS_NUMBER = 2
+# a driver is replaced by a fresh one after this many pages, and after any error
+PAGES_PER_DRIVER = 200
+# a URL whose page failed to load is put back in the queue at most this many times
+MAX_URL_RETRIES = 3
+# the pool checks for dead workers every SUPERVISOR_INTERVAL seconds and stops after MAX_WORKER_RESTARTS restarts
+SUPERVISOR_INTERVAL = 5
+MAX_WORKER_RESTARTS = 50
+
+# append the pages to <year>.pack (see pack_store.py) instead of writing one <year>/<CVE>.html file per page
+PACK_OUTPUT = False
+# the page load latencies and the saved pages, rate limits, errors and restarts are written to
+# <directory>/IBM_collector.json and .prom, every SUPERVISOR_INTERVAL seconds while the pool runs
+METRICS_DIRECTORY = "metrics"
+# collectors on several hosts share the CVEs through this work queue (see work_queue.py), put it on a volume
+# they all mount together with the output folder. None keeps the work in this process
+WORK_QUEUE_FILE = None
+# status, attempts and content of every collected page (see collection_state.py), the work list is built from it
+# and the pages saved without a description are collected again first. None looks at the saved files instead.
+# With a shared work queue it has to be shared as well, or the CVEs other hosts collected would be queued again
+COLLECTION_STATE_FILE = collection_state.COLLECTION_STATE_FILE
+
+DESCRIPTION_SELECTOR = "p.description:not([class*=' '])"
+REMEDY_SELECTOR = "p[class~='detailsline'][class~='description']"
+# seconds to wait for the description to render, and then for the remedy once the description is there
+PAGE_LOAD_TIMEOUT = 15
+REMEDY_TIMEOUT = 2
+
+# pause between two requests of all the workers together, it grows when IBM rate limits us and shrinks back after
+THROTTLE_MIN_DELAY = 0.5
+THROTTLE_MAX_DELAY = 30
+THROTTLE_BACKOFF_FACTOR = 2
+THROTTLE_RECOVERY_FACTOR = 0.9
+# every worker stops for this long after an access denied page, doubled for every consecutive one
+RATE_LIMIT_PAUSE = 60
+RATE_LIMIT_MAX_PAUSE = 30 * 60
 
 
 logger = lg.generate_logger("IBM", "IBM.log")
+run_metrics = metrics.Metrics("IBM_collector")
+
+
+def write_metrics():
+    if METRICS_DIRECTORY is not None:
+        run_metrics.write(METRICS_DIRECTORY)
 
 
 # Define a custom exception
@@ -27,30 +80,181 @@ class RateLimitReached(Exception):
         self.message = message
 
 
-def if_file_exists(directory, filename):
-    files_in_directory = os.listdir(directory)
-
-    # Loop through each file and check if the specific file exists
-    for file in files_in_directory:
-        if file == filename:
-            return True
-    return False
+class PageLoadFailed(Exception):
+    def __init__(self, message=""):
+        super().__init__(message)
+        self.message = message
 
 
-def generate_url_queue(urls, output_directory):
-    q = queue.Queue()
-    
+class AdaptiveThrottle:
+    """Paces the requests of every worker thread, slowing all of them down after a rate limit."""
+
+    def __init__(self, min_delay=THROTTLE_MIN_DELAY, max_delay=THROTTLE_MAX_DELAY, pause=RATE_LIMIT_PAUSE,
+                 max_pause=RATE_LIMIT_MAX_PAUSE):
+        self.lock = threading.Lock()
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min_delay
+        self.base_pause = pause
+        self.max_pause = max_pause
+        self.pause = pause
+        self.next_request_at = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            request_at = max(now, self.next_request_at)
+            self.next_request_at = request_at + self.delay
+        if request_at > now:
+            run_metrics.add_time("ibm.throttle_wait", request_at - now)
+            time.sleep(request_at - now)
+
+    def rate_limited(self):
+        run_metrics.count("ibm.rate_limited")
+        with self.lock:
+            self.delay = min(max(self.delay, 1) * THROTTLE_BACKOFF_FACTOR, self.max_delay)
+            resume_at = time.monotonic() + self.pause
+            # a worker that was already waiting for a later slot keeps it
+            self.next_request_at = max(self.next_request_at, resume_at)
+            logger.warning(f"Rate limited, pausing for {self.pause}s and spacing requests by {self.delay:.1f}s")
+            self.pause = min(self.pause * 2, self.max_pause)
+
+    def succeeded(self):
+        with self.lock:
+            self.delay = max(self.delay * THROTTLE_RECOVERY_FACTOR, self.min_delay)
+            self.pause = self.base_pause
+
+
+def pending_urls(urls, output_directory, pack_writer=None):
     existing_file_set = set(os.listdir(output_directory))
-    for cve_id, url in urls.items():
-        if f"{cve_id}.html" in existing_file_set:
-            continue
-        else:
-            q.put((cve_id, url))
-    
-    return q
+    return {
+        cve_id: url for cve_id, url in urls.items()
+        if f"{cve_id}.html" not in existing_file_set and (pack_writer is None or cve_id not in pack_writer)
+    }
+
+
+def saved_page_content(cve_ids, output_directory, pack_writer=None):
+    """{CVE ID: (has description, has remedy, size)} of the saved pages of cve_ids, read from the files or the pack."""
+    import html_pages
+    pack_reader = pack_store.PackReader(pack_writer.pack_filepath) if pack_writer is not None else None
+    content = {}
+    try:
+        for cve_id in cve_ids:
+            if pack_reader is not None and cve_id in pack_reader:
+                html_content = pack_reader.get(cve_id)
+            else:
+                with open(os.path.join(output_directory, cve_id + ".html"), "r", encoding="utf-8") as file:
+                    html_content = file.read()
+            has_description, has_remedy = html_pages.ibm_page_content(html_content)
+            content[cve_id] = (has_description, has_remedy, len(html_content.encode("utf-8")))
+    finally:
+        if pack_reader is not None:
+            pack_reader.close()
+    return content
+
+
+def collection_work_list(state, year, urls, output_directory, pack_writer=None):
+    """The {CVE ID: URL} left to collect according to the collection state, the incomplete pages first."""
+    known = state.statuses(year)
+    unknown = [cve_id for cve_id in urls if cve_id not in known]
+    if unknown:
+        # the pages saved before the state was kept are parsed once to know which ones lack their description
+        pending = pending_urls({cve_id: urls[cve_id] for cve_id in unknown}, output_directory, pack_writer)
+        saved = [cve_id for cve_id in unknown if cve_id not in pending]
+        state.register(year, unknown, saved_pages=saved_page_content(saved, output_directory, pack_writer))
+    return state.work_list(year, urls)
+
+
+class LocalUrlQueue:
+    """The CVEs collected by this process alone, BrowserWorkerPool takes its work from it or from a SharedUrlQueue."""
+
+    def __init__(self, urls):
+        self.queue = queue.Queue()
+        for item in urls.items():
+            self.queue.put(item)
+        self.lock = threading.Lock()
+        self.remaining = len(urls)
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def get(self, timeout):
+        """The next (CVE ID, URL), raises queue.Empty after timeout seconds without one."""
+        return self.queue.get(timeout=timeout)
+
+    def put_back(self, cve_id, url):
+        self.queue.put((cve_id, url))
+
+    def finish(self, cve_id, given_up=False):
+        with self.lock:
+            self.remaining -= 1
+
+    def unfinished(self):
+        with self.lock:
+            return self.remaining
+
+    def heartbeat(self):
+        pass
+
+
+class SharedUrlQueue:
+    """The CVEs of a year in a work_queue.WorkQueue shared with the collectors of other processes and hosts.
+
+    get leases one CVE of the shard at a time, the leases are renewed by heartbeat, which the pool calls
+    every SUPERVISOR_INTERVAL seconds, and the work is finished once no collector of the shard has any left.
+    """
+
+    def __init__(self, shared_queue, year, shard=None):
+        self.shared_queue = shared_queue
+        self.year = year
+        self.shard = shard
+        # the CVEs leased by this process that a worker is on, only their leases are renewed
+        self.lock = threading.Lock()
+        self.leased = set()
+
+    def qsize(self):
+        return self.unfinished()
+
+    def get(self, timeout):
+        items = self.shared_queue.lease(self.year, 1, self.shard)
+        if not items:
+            # the rest is leased by other collectors, wait for them to finish or for their leases to expire
+            time.sleep(timeout)
+            raise queue.Empty
+        with self.lock:
+            self.leased.add(items[0][0])
+        return items[0]
+
+    def forget(self, cve_id):
+        # even when the queue could not be updated, the lease then expires instead of being renewed forever
+        with self.lock:
+            self.leased.discard(cve_id)
+
+    def put_back(self, cve_id, url):
+        try:
+            self.shared_queue.release(cve_id)
+        finally:
+            self.forget(cve_id)
+
+    def finish(self, cve_id, given_up=False):
+        try:
+            if given_up:
+                self.shared_queue.fail(cve_id)
+            else:
+                self.shared_queue.complete(cve_id)
+        finally:
+            self.forget(cve_id)
 
+    def unfinished(self):
+        return self.shared_queue.unfinished(self.year, self.shard)
 
-def collect_info(url_queue, output_dir, progress_bar):
+    def heartbeat(self):
+        with self.lock:
+            cve_ids = list(self.leased)
+        self.shared_queue.heartbeat(cve_ids)
+
+
+def create_driver():
     # Set up Chrome options
     chrome_options = Options()
     chrome_options.add_argument("--headless")  # Run in headless mode (no browser UI)
@@ -59,33 +263,214 @@ def collect_info(url_queue, output_dir, progress_bar):
     # Set up Chrome driver
     service = Service("chromedriver-linux64/chromedriver")  # Replace with the path to your ChromeDriver
     driver = webdriver.Chrome(service=service, options=chrome_options)
+    return driver
 
-    # input("Please login to IBM")
 
-    # for cve_id, url in list(urls.items())[start_index:end_index]:
-    while not url_queue.empty():
-        cve_id, url = url_queue.get(timeout=1)
-        
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        # the browser is usually already gone when this fails
+        logger.error(f"Could not quit the driver: {e}")
+
+
+class BrowserWorkerPool:
+    """Browser worker threads that share a URL queue and are replaced when they die.
+
+    Every worker recycles its driver after pages_per_driver pages or after an error, and a URL
+    whose page failed is put back in the queue until it has failed max_retries times.
+    url_queue is a LocalUrlQueue, or a SharedUrlQueue to share the work with collectors on other hosts.
+    Every attempt is recorded in collection_state when it is given.
+    """
+
+    def __init__(self, url_queue, output_dir, progress_bar, throttle, size=THREATS_NUMBER,
+                 pages_per_driver=PAGES_PER_DRIVER, max_retries=MAX_URL_RETRIES, pack_writer=None,
+                 collection_state=None, year=None):
+        self.url_queue = url_queue
+        self.output_dir = output_dir
+        self.collection_state = collection_state
+        self.year = year or os.path.basename(os.path.normpath(output_dir))
+        self.pack_writer = pack_writer
+        self.progress_bar = progress_bar
+        self.throttle = throttle
+        self.size = size
+        self.pages_per_driver = pages_per_driver
+        self.max_retries = max_retries
+
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.given_up = []
+        self.stopped = False
+        # {worker name: (CVE ID, URL)} of the URL every worker is on, handed back when the worker dies
+        self.current = {}
+
+    def is_finished(self):
+        with self.lock:
+            if self.stopped:
+                return True
+        # URLs that are neither saved nor given up on, the workers stop when there are none left
+        return self.url_queue.unfinished() == 0
+
+    def finish_url(self, cve_id, given_up=False):
+        self.url_queue.finish(cve_id, given_up)
+
+    def retry_url(self, cve_id, url):
+        with self.lock:
+            self.failures[cve_id] = self.failures.get(cve_id, 0) + 1
+            failures = self.failures[cve_id]
+        if failures > self.max_retries:
+            logger.error(f"Giving up on {cve_id} after {failures} failed attempts")
+            self.given_up.append(cve_id)
+            run_metrics.count("ibm.given_up")
+            self.progress_bar.update(1)
+            self.finish_url(cve_id, given_up=True)
+        else:
+            self.url_queue.put_back(cve_id, url)
+
+    def release_current(self, worker_name):
+        """Hand back the URL a dead worker was on, if handing it back failed when the worker died."""
+        with self.lock:
+            item = self.current.pop(worker_name, None)
+        if item is None:
+            return
+        try:
+            self.url_queue.put_back(*item)
+        except Exception as e:
+            # a shared lease still expires, a local URL cannot fail to be put back
+            logger.error(f"Could not hand {item[0]} back: {e}")
+
+    def work(self):
+        driver = None
+        pages = 0
         try:
-            has_description, has_remedy = save_html(driver, cve_id, url, output_dir)
-            if not has_description:
-                logger.error(f"HTML file for {cve_id} doesn't have description")
-            progress_bar.update(1)
-            logger.debug(f"{url_queue.qsize()} CVEs remaining!")
-        except RateLimitReached as e:
-            logger.error("Closed the Driver!")
-            print("Closed the Driver!")
-            driver.quit()
-            break
-        
-
-
-def save_html(driver, cve_id, url, output_dir):
-    """Fetch and save the rendered HTML content of a URL to a file."""
+            while not self.is_finished():
+                try:
+                    cve_id, url = self.url_queue.get(1)
+                except queue.Empty:
+                    # another worker may still hand a failed URL back
+                    continue
+                with self.lock:
+                    self.current[threading.current_thread().name] = (cve_id, url)
+
+                # set once the URL is finished or handed back, until then any error hands it back in the finally
+                handled = False
+                try:
+                    if driver is None:
+                        try:
+                            driver = create_driver()
+                        except Exception:
+                            self.url_queue.put_back(cve_id, url)
+                            handled = True
+                            raise
+                        pages = 0
+
+                    self.throttle.wait()
+                    try:
+                        has_description, has_remedy, size = save_html(driver, cve_id, url, self.output_dir, self.pack_writer)
+                    except RateLimitReached:
+                        # slow every worker down and try this CVE again later, it was not the page's fault
+                        self.throttle.rate_limited()
+                        self.url_queue.put_back(cve_id, url)
+                        handled = True
+                        continue
+                    except Exception as e:
+                        logger.error(f"Recycling the driver after failing on {cve_id}: {e}")
+                        run_metrics.count("ibm.errors")
+                        run_metrics.count("ibm.driver_recycles")
+                        quit_driver(driver)
+                        driver = None
+                        if self.collection_state is not None:
+                            self.collection_state.record_failed(cve_id, self.year)
+                        self.retry_url(cve_id, url)
+                        handled = True
+                        continue
+
+                    self.throttle.succeeded()
+                    if self.collection_state is not None:
+                        self.collection_state.record_saved(cve_id, self.year, has_description, has_remedy, size)
+                    if not has_description:
+                        logger.error(f"HTML file for {cve_id} doesn't have description")
+                        run_metrics.count("ibm.missing_description")
+                    if not has_remedy:
+                        run_metrics.count("ibm.missing_remedy")
+                    self.finish_url(cve_id)
+                    handled = True
+                    self.progress_bar.update(1)
+                    logger.debug(f"{self.url_queue.qsize()} CVEs remaining!")
+                finally:
+                    if not handled:
+                        # e.g. the collection state was locked, the worker dies but the URL is not lost with it
+                        logger.error(f"Handing {cve_id} back after an error outside of its page")
+                        run_metrics.count("ibm.errors")
+                        self.retry_url(cve_id, url)
+                    with self.lock:
+                        self.current.pop(threading.current_thread().name, None)
+
+                pages += 1
+                if pages >= self.pages_per_driver:
+                    logger.info(f"Recycling the driver after {pages} pages")
+                    run_metrics.count("ibm.driver_recycles")
+                    quit_driver(driver)
+                    driver = None
+        finally:
+            if driver is not None:
+                quit_driver(driver)
+
+    def start_worker(self, index):
+        thread = threading.Thread(target=self.work, name=f"browser-worker-{index}", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        workers = [self.start_worker(i) for i in range(self.size)]
+        restarts = 0
+        while not self.is_finished():
+            time.sleep(SUPERVISOR_INTERVAL)
+            write_metrics()
+            self.url_queue.heartbeat()
+            for i, worker in enumerate(workers):
+                if worker.is_alive() or self.is_finished():
+                    continue
+                restarts += 1
+                if restarts > MAX_WORKER_RESTARTS:
+                    logger.error(f"Stopping the collection after {restarts - 1} worker restarts")
+                    print(f"Stopping the collection after {restarts - 1} worker restarts")
+                    with self.lock:
+                        self.stopped = True
+                    break
+                logger.error(f"{worker.name} died, restarting it")
+                run_metrics.count("ibm.worker_restarts")
+                self.release_current(worker.name)
+                workers[i] = self.start_worker(i)
+
+        for worker in workers:
+            worker.join()
+        return self.given_up
+
+
+def wait_for_content(driver, css_selector, timeout):
+    """Wait until exactly one element matches css_selector and has text, returns False on timeout."""
+    def has_content(driver):
+        elements = driver.find_elements(By.CSS_SELECTOR, css_selector)
+        return len(elements) == 1 and elements[0].text.strip() != ""
+
+    if has_content(driver):
+        return True
+    if timeout <= 0:
+        return False
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=0.25).until(has_content)
+    except TimeoutException:
+        return False
+
+
+def save_html(driver, cve_id, url, output_dir, pack_writer=None):
+    """Fetch and save the rendered HTML content of a URL to a file, or to the pack of pack_writer."""
     
     try:
         # Load the page and wait for it to render
         logger.info(f"Requesting HTML content for {cve_id}")
+        start = time.perf_counter()
         driver.get(url)
 
         title = driver.title
@@ -94,42 +479,31 @@ def save_html(driver, cve_id, url, output_dir):
             print("Had to close the driver because it went in access denied mode!")
             raise RateLimitReached()
 
-        time.sleep(5)  # Wait for JavaScript to finish (adjust as necessary)
-
-        # elements = driver.find_elements(By.CSS_SELECTOR, "p.description:not([class*=' '])")
-        # wait = WebDriverWait(driver, 15)
-        # has_description = wait.until(
-        #     lambda driver: 
-        #         len(driver.find_elements(By.CSS_SELECTOR, "p.description:not([class*=' '])")) == 1 and  
-        #         driver.find_element(By.CSS_SELECTOR, "p.description:not([class*=' '])").text.strip() != ""
-        # )
-        # has_remedy = wait.until(
-        #     lambda driver: 
-        #         len(driver.find_elements(By.CSS_SELECTOR, "p[class~='detailsline'][class~='description']")) == 1 and  
-        #         driver.find_element(By.CSS_SELECTOR, "p[class~='detailsline'][class~='description']").text.strip() != ""
-        # )
-
-        description = driver.find_elements(By.CSS_SELECTOR, "p.description:not([class*=' '])")
-        has_description = len(description) == 1 and description[0].text.strip() != ""
-        # print(has_description, description.text)
-
-        remedy = driver.find_elements(By.CSS_SELECTOR, "p[class~='detailsline'][class~='description']")
-        has_remedy = len(remedy) == 1 and remedy[0].text.strip() != ""
-        # print(has_remedy, remedy.text)
+        has_description = wait_for_content(driver, DESCRIPTION_SELECTOR, PAGE_LOAD_TIMEOUT)
+        # the remedy is rendered with the description, so it only gets a short grace period
+        has_remedy = wait_for_content(driver, REMEDY_SELECTOR, REMEDY_TIMEOUT if has_description else 0)
 
         # Get the rendered HTML content
         html_content = driver.page_source
+        run_metrics.observe("ibm.page_load", time.perf_counter() - start)
 
-        # Generate a valid filename from the URL
-        filename = cve_id + ".html"
-        filepath = os.path.join(output_dir, filename)
+        if pack_writer is not None:
+            pack_writer.add(cve_id, html_content)
+            filepath = f"{pack_writer.pack_filepath}:{cve_id}"
+        else:
+            # Generate a valid filename from the URL
+            filename = cve_id + ".html"
+            filepath = os.path.join(output_dir, filename)
 
-        # Save the HTML content to the file
-        with open(filepath, "w", encoding="utf-8") as file:
-            file.write(html_content)
+            # Save the HTML content to the file
+            with open(filepath, "w", encoding="utf-8") as file:
+                file.write(html_content)
 
         logger.info(f"Rendered HTML content saved to {filepath}")
-        return has_description, has_remedy
+        size = len(html_content.encode("utf-8"))
+        run_metrics.count("ibm.pages_saved")
+        run_metrics.count("ibm.bytes_written", size)
+        return has_description, has_remedy, size
 
     except RateLimitReached as e:
         logger.error("Rate Limit Reached")
@@ -138,29 +512,31 @@ def save_html(driver, cve_id, url, output_dir):
     except Exception as e:
         logger.error(f"Error fetching URL {url}: {e}")
         print(f"Error loading URL {url}: {e}")
-        return False, False
+        raise PageLoadFailed(str(e)) from e
 
     # finally:
     #     driver.quit()
 
 
-def read_nvd_data_feed(filename):
-    with open(filename, 'r') as file:
-        data = json.load(file)
-    return data
-
-
 def write_json(dict_input, filepath):
     with open(filepath, 'w') as file:
         json.dump(dict_input, file, indent=4)
 
 
-def main():
-    """Main function to demonstrate the usage of save_html."""
+def main(years=YEARS, shard=None):
+    """Collect the IBM X-Force pages of the CVEs of every year, see cli.py for the options.
 
-    # years = ["2024", "2023", "2022", "2021", "2020"]
-    years = ["2023"]
-    # remeber to fix the url array so that it starts from the beggining
+    With a shared work queue every host can take a shard, (index, count), of the CVEs.
+    """
+    shared_queue = None
+    if WORK_QUEUE_FILE is not None:
+        if PACK_OUTPUT:
+            raise ValueError("a pack has a single writer, collect to files when the work queue is shared")
+        if COLLECTION_STATE_FILE == collection_state.COLLECTION_STATE_FILE:
+            raise ValueError("the collection state of this host would requeue the CVEs collected by the other hosts, "
+                             "set COLLECTION_STATE_FILE to a file shared with them, e.g. next to the work queue, or to None")
+        shared_queue = work_queue.WorkQueue(WORK_QUEUE_FILE)
+    state = collection_state.CollectionState("ibm", COLLECTION_STATE_FILE) if COLLECTION_STATE_FILE is not None else None
 
     for year in years:
         # Directory to save HTML files
@@ -170,11 +546,21 @@ def main():
         logger.info(f"Staring collecting the information of CVEs for {year}")
         print(f"Staring collecting the information of CVEs for {year}")
 
-        cve_list = read_nvd_data_feed(f'../nvdcve-1.1-{year}.json')
-        cve_list = cve_list['CVE_Items']
-        ids = [cve_list[i]['cve']['CVE_data_meta']['ID'] for i in range(len(cve_list))]
+        ids = list(nvd_feed.iter_cve_ids(f'../nvdcve-1.1-{year}.json'))
         urls = {cve_id: f"https://exchange.xforce.ibmcloud.com/vulnerabilities/{cve_id}/" for cve_id in ids}
-        url_queue = generate_url_queue(urls, output_dir)
+        pack_writer = pack_store.PackWriter(pack_store.pack_path(".", year)) if PACK_OUTPUT else None
+        if state is not None:
+            work = collection_work_list(state, year, urls, output_dir, pack_writer)
+        else:
+            work = pending_urls(urls, output_dir, pack_writer)
+        if shared_queue is not None:
+            # every collector adds the CVEs it finds left to collect, including the ones another collector
+            # saved incomplete, only the ones leased right now keep their state
+            added = shared_queue.add(year, work, requeue=True)
+            logger.info(f"Added {added} CVEs of {year} to the shared work queue")
+            url_queue = SharedUrlQueue(shared_queue, year, shard)
+        else:
+            url_queue = LocalUrlQueue(work)
         queue_length = url_queue.qsize()
 
         print(f"url size is {len(urls)} but only {queue_length} of them are in the queue!")
@@ -185,27 +571,28 @@ def main():
 
         # print(f"Chunck size: {chunk_size}, extras: {extra}")
 
+        throttle = AdaptiveThrottle()
         with tqdm(total=queue_length, desc="Urls", unit="number") as progress_bar:
-            threads = []
-            # start_idx = 0
-            for i in range(THREATS_NUMBER):
-                # end_idx = start_idx + chunk_size + (1 if i < extra else 0)  # Distribute the remainder
-                thread = threading.Thread(target=collect_info, args=(url_queue, output_dir, progress_bar))
-                threads.append(thread)
-                thread.start()
-                # print(f"Threat {i+1} started with index {start_idx} to {end_idx}")
-                # start_idx = end_idx
-
-            # Wait for all threads to complete
-            for thread in threads:
-                thread.join()
+            pool = BrowserWorkerPool(url_queue, output_dir, progress_bar, throttle, size=THREATS_NUMBER,
+                                     pack_writer=pack_writer, collection_state=state, year=year)
+            given_up = pool.run()
+        if pack_writer is not None:
+            pack_writer.close()
+        write_metrics()
 
+        if given_up:
+            print(f"Gave up on {len(given_up)} CVEs, they will be retried on the next runs "
+                  f"until they failed {collection_state.MAX_FAILED_ATTEMPTS} times")
 
         # write_json(status, f"status{year}.json")
         logger.info(f"Finished collecting the information of CVEs for {year}")
 
-        break
+    if shared_queue is not None:
+        shared_queue.close()
+    if state is not None:
+        state.close()
 
 
 if __name__ == "__main__":
-    main()
+    # python IBM_collector.py [shard index] [shard count]
+    main(shard=(int(sys.argv[1]), int(sys.argv[2])) if len(sys.argv) == 3 else None)
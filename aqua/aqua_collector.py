@@ -1,14 +1,19 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
 import os
+import sys
 import time
 import json
 import logger as lg
 import requests
 from tqdm import tqdm
 
+# the shared modules live in the root of the repository, appended so that the local logger is still used
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import nvd_feed
+import pack_store
+import metrics
+import http_cache
+import aqua_pages
+
 # def save_html(url, output_dir):
 #     """Fetch and save the rendered HTML content of a URL to a file."""
 #     # Set up Chrome options
@@ -50,43 +55,60 @@ from tqdm import tqdm
 
 logger = lg.generate_logger("aqua", "aqua.log")
 
-
-def save_html(cve_id, url, output_dir):
-    """Fetch and save the HTML content of a URL to a file."""
+YEARS = ["2024", "2023", "2022", "2021", "2020"]
+# fetch the pages concurrently with async_fetcher (needs aiohttp) instead of one blocking request at a time
+ASYNC_COLLECTION = False
+# append the pages to <year>.pack (see pack_store.py) instead of writing one <year>/<CVE>.html file per page
+PACK_OUTPUT = False
+# the fetch latencies and the saved pages, bytes and errors are written to <directory>/aqua_collector.json and .prom
+METRICS_DIRECTORY = "metrics"
+# request the pages that are already saved again, to pick up the ones that changed. Off by default, a refresh
+# sends a request for every saved page to aquasec.com
+REFRESH_PAGES = False
+# ETag, Last-Modified and hash of every saved page (see http_cache.py), refreshes use conditional requests and
+# only write the pages that changed. None disables it and every refreshed page is downloaded and written again
+HTTP_CACHE_FILE = http_cache.HTTP_CACHE_FILE
+# the new and changed pages of every refresh are listed in <directory>/<year>.json
+CHANGE_REPORT_DIRECTORY = "changes"
+
+run_metrics = metrics.Metrics("aqua_collector")
+
+
+def save_html(cve_id, url, output_dir, pack_writer=None, cache=None, refresh=False):
+    """Fetch and save the HTML content of a URL to a file, or to the pack of pack_writer, see aqua_pages.save_page."""
     try:
         # Fetch the HTML content
-        response = requests.get(url)
+        headers = aqua_pages.request_headers(url, cache, refresh)
+        start = time.perf_counter()
+        try:
+            response = requests.get(url, headers=headers, timeout=aqua_pages.REQUEST_TIMEOUT)
+        finally:
+            run_metrics.observe("aqua.fetch", time.perf_counter() - start)
         response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
 
-        # Generate a valid filename from the URL
-        filename = cve_id + ".html"
-        filepath = os.path.join(output_dir, filename)
-
-        # Save the HTML content to the file
-        with open(filepath, "w", encoding="utf-8") as file:
-            file.write(response.text)
-
-        logger.info(f"HTML content saved to {filepath}")
-        # print(f"HTML content saved to {filepath}")
-        return filepath
+        html_content = None if response.status_code == 304 else response.text
+        return aqua_pages.save_page(cve_id, url, output_dir, html_content, response.headers, pack_writer, cache,
+                                    refresh, run_metrics)
 
     except requests.RequestException as e:
+        run_metrics.count("aqua.errors")
         logger.error(f"Error fetching URL {url}: {e}")
         print(f"Error fetching URL {url}: {e}")
         return None
 
 
-
-def read_nvd_data_feed(filename):
-    with open(filename, 'r') as file:
-        data = json.load(file)
-    return data
+def write_change_report(year, report):
+    os.makedirs(CHANGE_REPORT_DIRECTORY, exist_ok=True)
+    with open(os.path.join(CHANGE_REPORT_DIRECTORY, f"{year}.json"), "w") as file:
+        json.dump(report, file, indent=4)
+    logger.info(f"{len(report['new'])} new, {len(report['changed'])} changed, {report['unchanged']} unchanged and "
+                f"{report['not_modified']} not modified pages for {year}")
 
 
-def main():
-    """Main function to demonstrate the usage of save_html."""
+def main(years=YEARS):
+    """Collect the Aqua pages of the CVEs of every year, see cli.py for the options."""
 
-    years = ["2024", "2023", "2022", "2021", "2020"]
+    cache = http_cache.HttpCache(HTTP_CACHE_FILE) if HTTP_CACHE_FILE is not None else None
 
     for year in years:
         # Directory to save HTML files
@@ -96,16 +118,41 @@ def main():
         logger.info(f"Staring collecting the information of CVEs for {year}")
         print(f"Staring collecting the information of CVEs for {year}")
 
-        cve_list = read_nvd_data_feed(f'../nvdcve-1.1-{year}.json')
-        cve_list = cve_list['CVE_Items']
-        ids = [cve_list[i]['cve']['CVE_data_meta']['ID'] for i in range(len(cve_list))]
+        ids = list(nvd_feed.iter_cve_ids(f'../nvdcve-1.1-{year}.json'))
         urls = {cve_id: f"https://avd.aquasec.com/nvd/{year}/{cve_id.lower()}/" for cve_id in ids}
 
-        for cve_id, url in tqdm(urls.items()):
-            save_html(cve_id, url, output_dir)
+        pack_writer = pack_store.PackWriter(pack_store.pack_path(".", year)) if PACK_OUTPUT else None
+        try:
+            if ASYNC_COLLECTION:
+                import async_fetcher
+                with tqdm(total=len(urls)) as progress_bar:
+                    summary = async_fetcher.collect(urls, output_dir, progress_bar, pack_writer=pack_writer,
+                                                    run_metrics=run_metrics, cache=cache, refresh=REFRESH_PAGES)
+                logger.info(f"Saved {summary['saved']}, skipped {summary['skipped']} and failed {summary['failed']} pages for {year}")
+            else:
+                for cve_id, url in tqdm(urls.items()):
+                    if pack_writer is not None:
+                        saved = cve_id in pack_writer
+                    else:
+                        saved = os.path.exists(os.path.join(output_dir, cve_id + ".html"))
+                    if saved and not REFRESH_PAGES:
+                        continue
+                    save_html(cve_id, url, output_dir, pack_writer, cache, refresh=saved)
+        finally:
+            if pack_writer is not None:
+                pack_writer.close()
+            if cache is not None:
+                cache.commit()
+                write_change_report(year, cache.report({url: cve_id for cve_id, url in urls.items()}))
+            if METRICS_DIRECTORY is not None:
+                # rewritten after every year, so the counters of a long collection can be followed
+                run_metrics.write(METRICS_DIRECTORY)
 
         logger.info(f"Finished collecting the information of CVEs for {year}")
 
+    if cache is not None:
+        cache.close()
+
 
 if __name__ == "__main__":
     main()
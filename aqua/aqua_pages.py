@@ -0,0 +1,66 @@
+import os
+import sys
+import logging
+
+# the shared modules live in the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import http_cache
+
+
+# seconds a request of aqua_collector or async_fetcher may take
+REQUEST_TIMEOUT = 30
+
+# the collector creates the handlers, generating the logger again would duplicate them
+logger = logging.getLogger("aqua")
+
+
+def page_filepath(cve_id, output_dir, pack_writer=None):
+    """Where the page of a CVE is saved, <output_dir>/<CVE>.html or <pack>:<CVE>."""
+    if pack_writer is not None:
+        return f"{pack_writer.pack_filepath}:{cve_id}"
+    return os.path.join(output_dir, cve_id + ".html")
+
+
+def request_headers(url, cache=None, refresh=False):
+    # only a page that is already saved can be requested conditionally
+    return cache.request_headers(url) if cache is not None and refresh else {}
+
+
+def save_page(cve_id, url, output_dir, html_content, response_headers, pack_writer=None, cache=None, refresh=False,
+              run_metrics=None):
+    """Save a fetched page to <output_dir>/<CVE>.html, or to the pack of pack_writer, and return where it is.
+
+    html_content is None for a 304. With a cache, refresh=True means the page is already saved: it is
+    only written again when its content changed. The bytes and pages are counted in run_metrics when it is given.
+    """
+    filepath = page_filepath(cve_id, output_dir, pack_writer)
+    if html_content is None:
+        cache.not_modified(url)
+        if run_metrics is not None:
+            run_metrics.count("aqua.not_modified")
+        return filepath
+    size = len(html_content.encode("utf-8"))
+    if run_metrics is not None:
+        run_metrics.count("aqua.bytes_downloaded", size)
+    if cache is not None:
+        sha256 = http_cache.content_hash(html_content)
+        status = cache.compare(url, sha256)
+        if status == http_cache.UNCHANGED and refresh:
+            cache.store(url, response_headers, sha256, size, status)
+            if run_metrics is not None:
+                run_metrics.count("aqua.unchanged")
+            return filepath
+
+    if pack_writer is not None:
+        pack_writer.add(cve_id, html_content)
+    else:
+        with open(filepath, "w", encoding="utf-8") as file:
+            file.write(html_content)
+    if cache is not None:
+        # only once the page is saved, so that a crash in between does not make it look current
+        cache.store(url, response_headers, sha256, size, status)
+    logger.info(f"HTML content saved to {filepath}")
+    if run_metrics is not None:
+        run_metrics.count("aqua.pages_saved")
+        run_metrics.count("aqua.bytes_written", size)
+    return filepath
@@ -0,0 +1,164 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from urllib.parse import urlsplit
+
+import aiohttp
+
+import aqua_pages
+
+
+# maximum number of requests in flight at the same time
+CONCURRENCY = 16
+# maximum number of requests started per second for each host, None disables the limit
+REQUESTS_PER_SECOND = 8
+REQUEST_TIMEOUT = aqua_pages.REQUEST_TIMEOUT
+MAX_RETRIES = 5
+BACKOFF_BASE = 1
+BACKOFF_MAX = 120
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+# the collector creates the handlers, generating the logger again would duplicate them
+logger = logging.getLogger("aqua")
+
+
+class RetryableStatus(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class HostRateLimiter:
+    """Spaces the start of the requests to each host so that at most `rate` start per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_slots = {}
+        self.lock = asyncio.Lock()
+
+    async def wait(self, host):
+        if not self.interval:
+            return
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            now = loop.time()
+            slot = max(now, self.next_slots.get(host, now))
+            self.next_slots[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def backoff_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            # Retry-After can also be a date, fall back to the exponential delay
+            pass
+    delay = min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX)
+    # jitter so that the workers that failed together do not retry together
+    return delay * random.uniform(0.5, 1)
+
+
+async def fetch_and_save(session, semaphore, rate_limiter, cve_id, url, output_dir, max_retries=MAX_RETRIES,
+                         pack_writer=None, run_metrics=None, cache=None, refresh=False):
+    """Fetch a page and save it as <output_dir>/<cve_id>.html, retrying on 429/5xx and connection errors.
+
+    With a pack_writer the page is appended to its pack instead. With a cache, refresh=True means the
+    page is already saved: it is requested conditionally and only written again when it changed.
+    The latency of every attempt and the saved pages, bytes, retries and errors are recorded in
+    run_metrics when it is given.
+    """
+    host = urlsplit(url).netloc
+    headers = aqua_pages.request_headers(url, cache, refresh)
+    for attempt in range(max_retries + 1):
+        retry_after = None
+        try:
+            await rate_limiter.wait(host)
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with session.get(url, headers=headers) as response:
+                        if response.status in RETRY_STATUSES:
+                            raise RetryableStatus(response.status, response.headers.get("Retry-After"))
+                        response.raise_for_status()
+                        response_headers = response.headers
+                        html_content = None if response.status == 304 else await response.text()
+                finally:
+                    if run_metrics is not None:
+                        run_metrics.observe("aqua.fetch", time.perf_counter() - start)
+            return aqua_pages.save_page(cve_id, url, output_dir, html_content, response_headers, pack_writer, cache,
+                                        refresh, run_metrics)
+
+        except aiohttp.ClientResponseError as e:
+            # any other 4xx will not get better by asking again
+            logger.error(f"Error fetching URL {url}: {e}")
+            if run_metrics is not None:
+                run_metrics.count("aqua.errors")
+            return None
+        except RetryableStatus as e:
+            retry_after = e.retry_after
+            error = e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+
+        if attempt < max_retries:
+            delay = backoff_delay(attempt, retry_after)
+            logger.warning(f"Attempt {attempt + 1} for {url} failed ({error!r}), retrying in {delay:.1f}s")
+            if run_metrics is not None:
+                run_metrics.count("aqua.retries")
+            await asyncio.sleep(delay)
+
+    logger.error(f"Error fetching URL {url}: gave up after {max_retries + 1} attempts ({error!r})")
+    if run_metrics is not None:
+        run_metrics.count("aqua.errors")
+    return None
+
+
+async def fetch_all(urls, output_dir, concurrency=CONCURRENCY, requests_per_second=REQUESTS_PER_SECOND,
+                    timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES, progress_bar=None, pack_writer=None,
+                    run_metrics=None, cache=None, saved_ids=()):
+    semaphore = asyncio.Semaphore(concurrency)
+    rate_limiter = HostRateLimiter(requests_per_second)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def fetch(session, cve_id, url):
+        filepath = await fetch_and_save(session, semaphore, rate_limiter, cve_id, url, output_dir, max_retries,
+                                        pack_writer, run_metrics, cache, cve_id in saved_ids)
+        if progress_bar is not None:
+            progress_bar.update(1)
+        return filepath
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        tasks = [fetch(session, cve_id, url) for cve_id, url in urls.items()]
+        return await asyncio.gather(*tasks)
+
+
+def collect(urls, output_dir, progress_bar=None, pack_writer=None, run_metrics=None, cache=None, refresh=False,
+            **options):
+    """Save the page of every CVE in urls that does not have a <CVE>.html in output_dir, or a page in the pack, yet.
+
+    With refresh the saved pages are fetched again too, conditionally when a cache is given.
+    Returns the number of saved, skipped and failed pages, a refreshed page that did not change counts as saved.
+    """
+    existing_file_set = set(os.listdir(output_dir))
+    pending_urls = {}
+    saved_ids = set()
+    for cve_id, url in urls.items():
+        if f"{cve_id}.html" in existing_file_set or (pack_writer is not None and cve_id in pack_writer):
+            if not refresh:
+                continue
+            saved_ids.add(cve_id)
+        pending_urls[cve_id] = url
+    if progress_bar is not None:
+        progress_bar.update(len(urls) - len(pending_urls))
+
+    results = asyncio.run(fetch_all(pending_urls, output_dir, progress_bar=progress_bar, pack_writer=pack_writer,
+                                    run_metrics=run_metrics, cache=cache, saved_ids=saved_ids, **options))
+    saved = sum(1 for filepath in results if filepath is not None)
+    return {"saved": saved, "skipped": len(urls) - len(pending_urls), "failed": len(pending_urls) - saved}
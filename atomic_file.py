@@ -0,0 +1,9 @@
+import os
+
+
+def write_atomically(filepath, content):
+    """Write content next to filepath and rename it over the old file, so a killed run never leaves half of it behind."""
+    tmp_filepath = filepath + ".tmp"
+    with open(tmp_filepath, 'w') as file:
+        file.write(content)
+    os.replace(tmp_filepath, filepath)
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import random
+import argparse
+
+
+YEARS = ["2024", "2023", "2022", "2021", "2020"]
+
+WORDS = (
+    "buffer overflow heap stack use after free null pointer dereference improper input validation "
+    "remote attacker authenticated local privilege escalation denial of service crafted request "
+    "memory corruption integer underflow race condition cross site scripting sql injection kernel "
+    "driver component library function parameter allows could lead arbitrary code execution via "
+    "vulnerability affected versions before fixed in certificate validation bypass information disclosure "
+    # real descriptions contain some non-ASCII text that clean_string has to strip
+    "naïve vendor’s résumé"
+).split()
+SEVERITIES = ["LOW", "MEDIUM", "HIGH", "CRITICAL"]
+UBUNTU_PRIORITIES = ["negligible", "low", "medium", "high", "critical"]
+REDHAT_SEVERITIES = ["Low", "Moderate", "Important", "Critical"]
+CWES = ["CWE-79", "CWE-787", "CWE-20", "CWE-125", "CWE-416", "CWE-22", "CWE-89", "CWE-476", "CWE-190"]
+AQUA_SECTIONS = ["Impact", "Mitigation", "Affected Packages", "References"]
+
+
+def sentence(rng, minimum=8, maximum=30):
+    words = rng.choices(WORDS, k=rng.randint(minimum, maximum))
+    return " ".join(words).capitalize() + "."
+
+
+def paragraph(rng, sentences=3):
+    return " ".join(sentence(rng) for _ in range(rng.randint(1, sentences)))
+
+
+def nvd_item(rng, cve_id):
+    score = round(rng.uniform(1, 10), 1)
+    severity = SEVERITIES[min(int(score // 2.5), 3)]
+    return {
+        "cve": {
+            "data_type": "CVE",
+            "data_format": "MITRE",
+            "data_version": "4.0",
+            "CVE_data_meta": {"ID": cve_id, "ASSIGNER": "cve@mitre.org"},
+            "problemtype": {"problemtype_data": [{"description": [{"lang": "en", "value": rng.choice(CWES)}]}]},
+            "references": {"reference_data": [
+                {"url": f"https://example.com/advisories/{cve_id.lower()}/{i}", "name": f"ref-{i}",
+                 "refsource": "MISC", "tags": ["Third Party Advisory"]}
+                for i in range(rng.randint(1, 6))
+            ]},
+            "description": {"description_data": [{"lang": "en", "value": paragraph(rng)}]},
+        },
+        "configurations": {"CVE_data_version": "4.0", "nodes": [
+            {"operator": "OR", "children": [], "cpe_match": [
+                {"vulnerable": True, "cpe23Uri": f"cpe:2.3:a:vendor{rng.randint(1, 500)}:product:{i}.0:*:*:*:*:*:*:*",
+                 "cpe_name": []}
+                for i in range(rng.randint(1, 8))
+            ]}
+        ]},
+        "impact": {
+            "baseMetricV3": {
+                "cvssV3": {"version": "3.1", "vectorString": "CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:U/C:H/I:H/A:H",
+                           "attackVector": "NETWORK", "attackComplexity": "LOW", "baseScore": score,
+                           "baseSeverity": severity},
+                "exploitabilityScore": round(rng.uniform(0, 4), 1), "impactScore": round(rng.uniform(0, 6), 1)
+            },
+            "baseMetricV2": {
+                "cvssV2": {"version": "2.0", "vectorString": "AV:N/AC:L/Au:N/C:P/I:P/A:P", "baseScore": score},
+                "severity": severity.replace("CRITICAL", "HIGH"), "exploitabilityScore": 10.0, "impactScore": 6.4
+            }
+        } if rng.random() < 0.9 else {},
+        "publishedDate": f"{cve_id.split('-')[1]}-01-01T00:00Z",
+        "lastModifiedDate": f"{cve_id.split('-')[1]}-02-01T00:00Z",
+    }
+
+
+def aqua_page(rng, cve_id, description=None):
+    # the boilerplate around the two divs the aggregator reads is what makes parsing slow on real pages
+    navigation = "".join(f'<li class="nav_item"><a href="/nav/{i}">{rng.choice(WORDS)}</a></li>' for i in range(60))
+    scripts = "".join(f"<script>var config{i} = {{\"key\": \"{rng.choice(WORDS)}\"}};</script>" for i in range(20))
+    subtitle = f'<h2 class="subtitle page_subtitle fadeInUp animationDelay_2">{sentence(rng, 3, 8)}</h2>' if rng.random() < 0.8 else ""
+    # drawn even when the description is given, so that the rest of the corpus stays the same
+    sections = f"<p>{paragraph(rng) if description is None else description}</p>\n"
+    for title in rng.sample(AQUA_SECTIONS, rng.randint(1, len(AQUA_SECTIONS))):
+        sections += f"<h3>{title}</h3>\n<p>{paragraph(rng)}</p>\n<ul>" + "".join(
+            f"<li>{sentence(rng, 2, 6)}</li>" for _ in range(rng.randint(0, 4))) + "</ul>\n"
+    return f"""<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>{cve_id} - Vulnerability Database</title>{scripts}</head>
+<body><header><ul class="nav">{navigation}</ul></header>
+<div class="page_header"><div class="header_title_wrap"><h1 class="title page_title">{cve_id}</h1>{subtitle}</div></div>
+<main><div class="container"><div class="content vulnerability_content">
+{sections}</div>
+<div class="content sidebar_content"><p>{paragraph(rng)}</p></div></div></main>
+<footer><ul>{navigation}</ul></footer></body></html>
+"""
+
+
+def ibm_page(rng, cve_id):
+    # rendered by a browser, so the page is mostly the markup of the X-Force application
+    navigation = "".join(f'<li class="menuitem"><a href="/menu/{i}">{rng.choice(WORDS)}</a></li>' for i in range(80))
+    details = "".join(f'<div class="detailsline"><span class="label">{rng.choice(WORDS)}</span>'
+                      f'<span class="value">{sentence(rng, 1, 4)}</span></div>' for _ in range(rng.randint(4, 10)))
+    score = round(rng.uniform(1, 10), 1)
+    remedy = f'<p class="detailsline description">{paragraph(rng)}</p>' if rng.random() < 0.7 else ""
+    return f"""<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>{cve_id} - IBM X-Force Exchange</title></head>
+<body><nav><ul class="menu">{navigation}</ul></nav>
+<div class="reportpage"><h1 class="title">{sentence(rng, 3, 8)}</h1>
+<div class="scorebox"><span class="scorenumber">{score}</span><span class="severity">{SEVERITIES[min(int(score // 2.5), 3)].title()}</span></div>
+<p class="description">{paragraph(rng)}</p>
+{details}
+{remedy}
+</div><footer><ul>{navigation}</ul></footer></body></html>
+"""
+
+
+def ubuntu_record(rng, cve_id, description=None):
+    generated_description = paragraph(rng)
+    return {
+        "Candidate": cve_id,
+        "PublicDate": f"{cve_id.split('-')[1]}-01-01",
+        "References": [f"https://ubuntu.com/security/{cve_id}"],
+        "Description": generated_description if description is None else description,
+        "UbuntuDescription": paragraph(rng) if rng.random() < 0.3 else "",
+        "Notes": [],
+        "Priority": rng.choice(UBUNTU_PRIORITIES),
+        "Patches": {f"package{i}": [] for i in range(rng.randint(0, 3))},
+    }
+
+
+def redhat_record(rng, cve_id, description=None):
+    record = {
+        "threat_severity": rng.choice(REDHAT_SEVERITIES),
+        "public_date": f"{cve_id.split('-')[1]}-01-01T00:00:00Z",
+        "bugzilla": {"description": f"{cve_id} {sentence(rng, 4, 10)}", "id": str(rng.randint(10 ** 6, 10 ** 7)),
+                     "url": "https://bugzilla.redhat.com/show_bug.cgi?id=1"},
+        "cvss3": {"cvss3_base_score": f"{rng.uniform(1, 10):.1f}", "cvss3_scoring_vector": "CVSS:3.1/AV:N/AC:L/PR:N/UI:N/S:U/C:H/I:H/A:H",
+                  "status": "verified"},
+        "cvss": {"cvss_base_score": f"{rng.uniform(1, 10):.1f}", "status": "verified"} if rng.random() < 0.3 else None,
+        "cwe": rng.choice(CWES),
+        "details": [paragraph(rng) for _ in range(rng.randint(1, 2))],
+        "statement": paragraph(rng) if rng.random() < 0.5 else "",
+        "affected_release": [{"product_name": f"Red Hat Enterprise Linux {i}", "package": "package"} for i in range(rng.randint(0, 4))],
+        "package_state": [{"product_name": "Red Hat Enterprise Linux 9", "fix_state": "Not affected"}],
+        "name": cve_id,
+    }
+    if description is not None:
+        record["details"][0] = description
+    if rng.random() < 0.4:
+        record["mitigation"] = {"value": paragraph(rng), "lang": "en:us"}
+    return record
+
+
+def generate_corpus(root, records_per_year=1000, years=YEARS, aqua_ratio=0.8, ubuntu_ratio=0.6, redhat_ratio=0.5, seed=0,
+                    ibm_ratio=0.5, shared_description_ratio=0.6):
+    """Write NVD feeds, Aqua and IBM pages, Ubuntu and Red Hat records laid out like the collected data under root.
+
+    Like in the real data, the Aqua, Ubuntu and Red Hat descriptions of a CVE are a copy of its NVD
+    description with probability shared_description_ratio.
+    """
+    rng = random.Random(seed)
+    # separate from rng, so that the ratio does not change the rest of the corpus
+    shared_rng = random.Random(seed + 1)
+    counts = {}
+    for year in years:
+        cve_ids = [f"CVE-{year}-{i:05d}" for i in range(1, records_per_year + 1)]
+        feed = {
+            "CVE_data_type": "CVE", "CVE_data_format": "MITRE", "CVE_data_version": "4.0",
+            "CVE_data_numberOfCVEs": str(len(cve_ids)), "CVE_data_timestamp": f"{year}-12-31T00:00Z",
+            "CVE_Items": [nvd_item(rng, cve_id) for cve_id in cve_ids],
+        }
+        nvd_descriptions = {item["cve"]["CVE_data_meta"]["ID"]: item["cve"]["description"]["description_data"][0]["value"]
+                            for item in feed["CVE_Items"]}
+        with open(os.path.join(root, f"nvdcve-1.1-{year}.json"), 'w') as file:
+            json.dump(feed, file, indent=2)
+
+        directories = {
+            "aqua": os.path.join(root, "aqua", year),
+            "ubuntu": os.path.join(root, "ubuntu", year),
+            "redhat": os.path.join(root, "redhat", "api", year),
+            "ibm": os.path.join(root, "IBM", year),
+        }
+        for directory in directories.values():
+            os.makedirs(directory, exist_ok=True)
+
+        year_counts = {"nvd": len(cve_ids), "aqua": 0, "ubuntu": 0, "redhat": 0, "ibm": 0}
+        for cve_id in cve_ids:
+            shared = {source: nvd_descriptions[cve_id] if shared_rng.random() < shared_description_ratio else None
+                      for source in ("aqua", "ubuntu", "redhat")}
+            if rng.random() < aqua_ratio:
+                with open(os.path.join(directories["aqua"], f"{cve_id}.html"), 'w', encoding='utf-8') as file:
+                    file.write(aqua_page(rng, cve_id, shared["aqua"]))
+                year_counts["aqua"] += 1
+            if rng.random() < ubuntu_ratio:
+                with open(os.path.join(directories["ubuntu"], f"{cve_id}.json"), 'w') as file:
+                    json.dump(ubuntu_record(rng, cve_id, shared["ubuntu"]), file, indent=2)
+                year_counts["ubuntu"] += 1
+            if rng.random() < redhat_ratio:
+                with open(os.path.join(directories["redhat"], f"{cve_id}.json"), 'w') as file:
+                    json.dump(redhat_record(rng, cve_id, shared["redhat"]), file)
+                year_counts["redhat"] += 1
+            # drawn after the other sources, so that a seed gives the same corpus as before plus the IBM pages
+            if rng.random() < ibm_ratio:
+                with open(os.path.join(directories["ibm"], f"{cve_id}.html"), 'w', encoding='utf-8') as file:
+                    file.write(ibm_page(rng, cve_id))
+                year_counts["ibm"] += 1
+        counts[year] = year_counts
+
+    corpus = {"records_per_year": records_per_year, "years": list(years), "aqua_ratio": aqua_ratio,
+              "ubuntu_ratio": ubuntu_ratio, "redhat_ratio": redhat_ratio, "ibm_ratio": ibm_ratio,
+              "shared_description_ratio": shared_description_ratio, "seed": seed, "counts": counts}
+    with open(os.path.join(root, "corpus.json"), 'w') as file:
+        json.dump(corpus, file, indent=4)
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic corpus for the aggregator benchmarks")
+    parser.add_argument("root", help="directory to write the corpus to")
+    parser.add_argument("--records", type=int, default=1000, help="CVEs per year")
+    parser.add_argument("--years", nargs="+", default=YEARS)
+    parser.add_argument("--aqua-ratio", type=float, default=0.8)
+    parser.add_argument("--ubuntu-ratio", type=float, default=0.6)
+    parser.add_argument("--redhat-ratio", type=float, default=0.5)
+    parser.add_argument("--ibm-ratio", type=float, default=0.5)
+    parser.add_argument("--shared-description-ratio", type=float, default=0.6,
+                        help="probability that another source copies the NVD description of a CVE")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.root, exist_ok=True)
+    corpus = generate_corpus(args.root, args.records, args.years, args.aqua_ratio, args.ubuntu_ratio,
+                             args.redhat_ratio, args.seed, args.ibm_ratio,
+                             args.shared_description_ratio)
+    json.dump(corpus["counts"], sys.stdout, indent=4)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIRECTORY = os.path.dirname(BENCHMARKS_DIRECTORY)
+RESULTS_DIRECTORY = os.path.join(BENCHMARKS_DIRECTORY, "results")
+
+# stage name: (aggregator function, keyword arguments, sources whose inputs it reads)
+STAGES = {
+    "nvd": ("aggregate_NVD", {}, ["nvd"]),
+    "aqua": ("aggregate_aqua", {"workers": None}, ["aqua"]),
+    "ubuntu": ("aggregate_ubuntu", {}, ["ubuntu"]),
+    "redhat": ("aggregate_redhat", {}, ["redhat"]),
+    "ibm": ("aggregate_ibm", {"workers": None}, ["ibm"]),
+    "all": ("aggregate_all", {"workers": None}, ["nvd", "aqua", "ubuntu", "redhat"]),
+    "all_incremental": ("aggregate_all", {"workers": None, "incremental": True}, ["nvd", "aqua", "ubuntu", "redhat"]),
+}
+# the output is removed before these stages so that they always start from nothing
+CLEAN_BEFORE = {"nvd", "all"}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux, the Aqua worker processes are reported as children
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def output_size_mb(corpus_root):
+    """Size of the aggregated output: the CVES folder and the CVES.* databases next to it."""
+    size = 0
+    for filename in os.listdir(corpus_root):
+        filepath = os.path.join(corpus_root, filename)
+        if filename == "CVES":
+            for directory, _, filenames in os.walk(filepath):
+                size += sum(os.path.getsize(os.path.join(directory, name)) for name in filenames)
+        elif filename.startswith("CVES.") and os.path.isfile(filepath):
+            size += os.path.getsize(filepath)
+    return size / 1e6
+
+
+def run_stage(corpus_root, stage, workers, backend, dedup=False):
+    """Run one stage in this process and return its measurements, called in a fresh process per stage."""
+    sys.path.append(REPOSITORY_DIRECTORY)
+    os.chdir(corpus_root)
+    import data_aggregator
+
+    with open("corpus.json", 'r') as file:
+        corpus = json.load(file)
+    data_aggregator.YEARS = corpus["years"]
+    data_aggregator.OUTPUT_BACKEND = backend
+    data_aggregator.OUTPUT_DEDUP_TEXTS = dedup
+
+    function_name, kwargs, sources = STAGES[stage]
+    kwargs = dict(kwargs)
+    if "workers" in kwargs:
+        kwargs["workers"] = workers
+    # corpora generated before a source was added have no inputs for it
+    records = sum(corpus["counts"][year].get(source, 0) for year in corpus["years"] for source in sources)
+
+    start = time.perf_counter()
+    getattr(data_aggregator, function_name)(**kwargs)
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": round(seconds, 3),
+        "records": records,
+        "records_per_second": round(records / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "output_mb": round(output_size_mb(corpus_root), 1),
+    }
+
+
+def clean_output(corpus_root):
+    shutil.rmtree(os.path.join(corpus_root, "CVES"), ignore_errors=True)
+    for filename in os.listdir(corpus_root):
+        filepath = os.path.join(corpus_root, filename)
+        if os.path.isdir(filepath) and filename.startswith("CVES."):
+            # e.g. the columnar export
+            shutil.rmtree(filepath)
+        # the journal of an interrupted benchmark would make the next run resume it
+        elif filename.startswith("CVES.") or filename.startswith("aggregation_journal.json"):
+            os.remove(filepath)
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPOSITORY_DIRECTORY,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_result(result):
+    """The latest saved result measured on the same corpus with the same settings."""
+    if not os.path.isdir(RESULTS_DIRECTORY):
+        return None
+    for filename in sorted(os.listdir(RESULTS_DIRECTORY), reverse=True):
+        with open(os.path.join(RESULTS_DIRECTORY, filename), 'r') as file:
+            previous = json.load(file)
+        # results saved before dedup was an option were measured without it
+        if all(previous.get(key) == result[key] for key in ("corpus", "workers", "backend")) and \
+                previous.get("dedup", False) == result["dedup"]:
+            return previous
+    return None
+
+
+def print_report(result, previous):
+    print(f"{'stage':<16}{'records':>10}{'seconds':>10}{'records/s':>12}{'peak RSS MB':>13}{'output MB':>11}{'vs previous':>13}")
+    for stage, measurements in result["stages"].items():
+        change = ""
+        if previous is not None and stage in previous["stages"] and previous["stages"][stage]["records_per_second"]:
+            ratio = measurements["records_per_second"] / previous["stages"][stage]["records_per_second"]
+            change = f"{(ratio - 1) * 100:+.1f}%"
+        print(f"{stage:<16}{measurements['records']:>10}{measurements['seconds']:>10.2f}"
+              f"{measurements['records_per_second']:>12.1f}{measurements['peak_rss_mb']:>13.1f}"
+              f"{measurements.get('output_mb', 0):>11.1f}{change:>13}")
+    if previous is not None:
+        print(f"compared with {previous['timestamp']} ({previous['commit']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every aggregation stage on a synthetic corpus")
+    parser.add_argument("corpus", help="corpus written by generate_corpus.py")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Aqua parse workers")
+    parser.add_argument("--backend", choices=["files", "sqlite"], default="files")
+    parser.add_argument("--dedup", action="store_true", help="store the texts of the output once, see output_store.DedupStore")
+    parser.add_argument("--no-save", action="store_true", help="do not write the result to benchmarks/results")
+    parser.add_argument("--stage", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    corpus_root = os.path.abspath(args.corpus)
+
+    if args.stage:
+        # child process of a benchmark run, see below
+        print(json.dumps(run_stage(corpus_root, args.stage, args.workers, args.backend, args.dedup)))
+        return
+
+    with open(os.path.join(corpus_root, "corpus.json"), 'r') as file:
+        corpus = json.load(file)
+    corpus.pop("counts")
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "corpus": corpus,
+        "workers": args.workers,
+        "backend": args.backend,
+        "dedup": args.dedup,
+        "stages": {},
+    }
+    for stage in args.stages:
+        if stage in CLEAN_BEFORE:
+            clean_output(corpus_root)
+        # a fresh process per stage so that the peak RSS belongs to that stage only
+        command = [sys.executable, os.path.abspath(__file__), corpus_root, "--stage", stage,
+                   "--workers", str(args.workers), "--backend", args.backend] + (["--dedup"] if args.dedup else [])
+        completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+        result["stages"][stage] = json.loads(completed.stdout.strip().splitlines()[-1])
+    clean_output(corpus_root)
+
+    previous = previous_result(result)
+    print_report(result, previous)
+    if not args.no_save:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        filepath = os.path.join(RESULTS_DIRECTORY, result["timestamp"].replace(":", "") + ".json")
+        with open(filepath, 'w') as file:
+            json.dump(result, file, indent=4)
+        print(f"saved to {filepath}")
+
+
+if __name__ == "__main__":
+    main()
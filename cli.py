@@ -0,0 +1,174 @@
+import os
+import sys
+import argparse
+import importlib
+
+
+# python cli.py <command> [options], `python cli.py <command> --help` lists the options of a command.
+# A command only imports the modules it runs: selenium, aiohttp and requests are only imported to collect,
+# BeautifulSoup only to aggregate the Aqua and IBM pages
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# the directory a collector runs in and saves its pages to, and its module
+COLLECTORS = {"aqua": ("aqua", "aqua_collector"), "ibm": ("IBM", "IBM_collector")}
+# the function of data_aggregator that aggregates a source, "all" merges nvd, aqua, ubuntu and redhat in one pass
+AGGREGATORS = {
+    "all": "aggregate_all",
+    "nvd": "aggregate_NVD",
+    "nvd_delta": "aggregate_NVD_delta",
+    "aqua": "aggregate_aqua",
+    "ubuntu": "aggregate_ubuntu",
+    "redhat": "aggregate_redhat",
+    "ibm": "aggregate_ibm",
+    "github": "aggregate_github_advisory",
+}
+# the aggregators that parse pages in worker processes, and the ones that can only look at the changed inputs
+WORKER_AGGREGATORS = {"all", "aqua", "ibm"}
+INCREMENTAL_AGGREGATORS = {"all", "github"}
+
+
+def import_collector(source):
+    directory, module_name = COLLECTORS[source]
+    directory = os.path.join(REPOSITORY_DIRECTORY, directory)
+    # the collectors read the feeds and save the pages relative to their directory, and import the logger.py
+    # next to them, which the logger.py of the repository would shadow otherwise
+    os.chdir(directory)
+    sys.path.insert(0, directory)
+    return importlib.import_module(module_name)
+
+
+def collect(args):
+    collector = import_collector(args.source)
+    if args.pack:
+        collector.PACK_OUTPUT = True
+    if args.source == "aqua":
+        if args.refresh:
+            collector.REFRESH_PAGES = True
+        if args.use_async:
+            collector.ASYNC_COLLECTION = True
+            if args.workers is not None:
+                import async_fetcher
+                async_fetcher.CONCURRENCY = args.workers
+        collector.main(args.years or collector.YEARS)
+    else:
+        if args.workers is not None:
+            collector.THREATS_NUMBER = args.workers
+        if args.work_queue is not None:
+            collector.WORK_QUEUE_FILE = args.work_queue
+            # the collection state is shared with the queue, next to it by default
+            collector.COLLECTION_STATE_FILE = args.collection_state or os.path.join(
+                os.path.dirname(os.path.abspath(args.work_queue)), collector.collection_state.COLLECTION_STATE_FILE)
+        elif args.collection_state is not None:
+            collector.COLLECTION_STATE_FILE = args.collection_state
+        collector.main(args.years or collector.YEARS, tuple(args.shard) if args.shard else None)
+
+
+def import_aggregator(args):
+    import data_aggregator
+    if getattr(args, "years", None):
+        data_aggregator.YEARS = args.years
+    data_aggregator.OUTPUT_BACKEND = args.backend
+    data_aggregator.OUTPUT_COMPACT = args.compact
+    data_aggregator.OUTPUT_FSYNC = args.fsync
+    data_aggregator.OUTPUT_DEDUP_TEXTS = args.dedup
+    data_aggregator.UPDATE_SEARCH_INDEX = args.search_index
+    os.makedirs(data_aggregator.AGGREGATED_CVES_FOLDER, exist_ok=True)
+    return data_aggregator
+
+
+def aggregate(args):
+    data_aggregator = import_aggregator(args)
+    for source in args.sources or ["all"]:
+        kwargs = {}
+        if args.workers is not None and source in WORKER_AGGREGATORS:
+            kwargs["workers"] = args.workers
+        if args.incremental and source in INCREMENTAL_AGGREGATORS:
+            kwargs["incremental"] = True
+        getattr(data_aggregator, AGGREGATORS[source])(**kwargs)
+
+
+def retry(args):
+    import_aggregator(args).retry_quarantined(args.sources)
+
+
+def build_index(args):
+    import_aggregator(args).build_search_index()
+
+
+def export(args):
+    import_aggregator(args).export_columns()
+
+
+def aggregator_source(source):
+    # not choices=, argparse checks the empty list of an optional positional against them too
+    if source not in AGGREGATORS:
+        raise argparse.ArgumentTypeError(f"unknown source {source}, it should be one of {', '.join(AGGREGATORS)}")
+    return source
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Collect the CVE information of every source and aggregate it")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    collect_parser = commands.add_parser("collect", help="download the pages of a source")
+    collect_parser.add_argument("source", choices=sorted(COLLECTORS))
+    collect_parser.add_argument("--years", nargs="+", help="the years to collect, all of them by default")
+    collect_parser.add_argument("--workers", type=int,
+                                help="browsers for ibm, requests in flight for aqua with --async")
+    collect_parser.add_argument("--pack", action="store_true", help="append the pages to <year>.pack")
+    collect_parser.add_argument("--async", dest="use_async", action="store_true",
+                                help="aqua: fetch the pages concurrently, needs aiohttp")
+    collect_parser.add_argument("--refresh", action="store_true",
+                                help="aqua: request the pages that are already saved again, to pick up the changed ones")
+    collect_parser.add_argument("--shard", nargs=2, type=int, metavar=("INDEX", "COUNT"),
+                                help="ibm: only collect this shard of the shared work queue")
+    collect_parser.add_argument("--work-queue", help="ibm: share the CVEs with the collectors of other hosts through this file")
+    collect_parser.add_argument("--collection-state",
+                                help="ibm: the collection state file, next to the work queue by default when it is shared")
+    collect_parser.set_defaults(run=collect)
+
+    # the output options of every command that reads or writes the aggregated records
+    output_options = argparse.ArgumentParser(add_help=False)
+    output_options.add_argument("--backend", choices=["files", "sqlite"], default="files")
+    output_options.add_argument("--compact", action="store_true", help="write the records without indentation")
+    output_options.add_argument("--fsync", action="store_true", help="flush every written batch to disk")
+    output_options.add_argument("--dedup", action="store_true", default=None,
+                                help="store every distinct text once, see output_store.DedupStore, "
+                                     "an output that is already deduplicated stays so without it")
+    output_options.add_argument("--search-index", action="store_true", help="keep the full-text search index up to date")
+
+    aggregate_parser = commands.add_parser("aggregate", parents=[output_options], help="aggregate sources into the CVE records")
+    aggregate_parser.add_argument("sources", nargs="*", type=aggregator_source, metavar="source",
+                                  help=f"run in the given order, all by default, one of {', '.join(AGGREGATORS)}")
+    aggregate_parser.add_argument("--years", nargs="+", help="the years to aggregate, all of them by default")
+    aggregate_parser.add_argument("--workers", type=int, help="processes parsing the aqua and ibm pages")
+    aggregate_parser.add_argument("--incremental", action="store_true",
+                                  help="all and github: only aggregate the inputs that changed since the last run")
+    aggregate_parser.set_defaults(run=aggregate)
+
+    retry_parser = commands.add_parser("retry", parents=[output_options], help="aggregate the quarantined inputs again")
+    retry_parser.add_argument("sources", nargs="*", metavar="source", help="every source with quarantined inputs by default")
+    retry_parser.set_defaults(run=retry)
+
+    index_parser = commands.add_parser("index", parents=[output_options], help="rebuild the full-text search index")
+    index_parser.set_defaults(run=build_index)
+
+    export_parser = commands.add_parser("export", parents=[output_options], help="export the records as columns")
+    export_parser.set_defaults(run=export)
+    return parser
+
+
+def main(argv=None):
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if args.command == "collect":
+        # the collectors would ignore these options without a word
+        if args.source == "aqua" and args.workers is not None and not args.use_async:
+            parser.error("--workers needs --async for aqua")
+        if args.shard is not None and args.work_queue is None:
+            parser.error("--shard needs --work-queue")
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
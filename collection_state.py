@@ -0,0 +1,145 @@
+import sys
+import time
+import sqlite3
+import threading
+
+
+COLLECTION_STATE_FILE = "collection_state.sqlite"
+# a page saved without its description is collected again at most this many times in total
+MAX_INCOMPLETE_ATTEMPTS = 3
+# a page that failed to load is given up after this many attempts in total, a collector makes several per run
+MAX_FAILED_ATTEMPTS = 12
+# seconds a collector waits for another one to release the database
+BUSY_TIMEOUT = 60
+
+# never attempted, saved with a description, saved without one, and failed to load
+PENDING = "pending"
+COMPLETE = "complete"
+INCOMPLETE = "incomplete"
+FAILED = "failed"
+
+
+class CollectionState:
+    """Collection status of every CVE of one source: attempts, last attempt, content flags and size of the saved page.
+
+    It replaces looking at the saved files to know what is left to collect. The status of all the
+    CVEs of a year is loaded with one query, so building a work list is a dict lookup per CVE, and a
+    page saved without its description is collected again first instead of counting as done.
+    It can be shared by the threads of a collector, and by several collectors like work_queue.py.
+    """
+
+    def __init__(self, source, filepath=COLLECTION_STATE_FILE):
+        self.source = source
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filepath, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages (source TEXT NOT NULL, cve_id TEXT NOT NULL, year TEXT NOT NULL,"
+            " status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, last_attempt REAL, has_description INTEGER,"
+            " has_remedy INTEGER, size INTEGER, PRIMARY KEY (source, cve_id))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pages_year ON pages (source, year, status)")
+        self.connection.commit()
+
+    def register(self, year, cve_ids, saved_pages=None):
+        """Add the CVEs of a year that are not known yet, as pending unless their page is in saved_pages.
+
+        saved_pages maps the CVEs whose page was saved before the state was kept to the (has description,
+        has remedy, size) of that page, a page without a description is registered incomplete to be collected again.
+        """
+        saved_pages = saved_pages or {}
+        rows = []
+        for cve_id in cve_ids:
+            if cve_id in saved_pages:
+                has_description, has_remedy, size = saved_pages[cve_id]
+                rows.append((self.source, cve_id, year, COMPLETE if has_description else INCOMPLETE,
+                             has_description, has_remedy, size))
+            else:
+                rows.append((self.source, cve_id, year, PENDING, None, None, None))
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO pages (source, cve_id, year, status, has_description, has_remedy, size)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self.connection.commit()
+
+    def statuses(self, year):
+        """{CVE ID: (status, attempts)} of a year."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT cve_id, status, attempts FROM pages WHERE source = ? AND year = ?", (self.source, year)
+            ).fetchall()
+        return {cve_id: (status, attempts) for cve_id, status, attempts in rows}
+
+    def work_list(self, year, urls):
+        """The {CVE ID: URL} of urls left to collect, the incomplete pages first, then the pending and failed ones.
+
+        The incomplete and failed pages are left out once they used up their attempts.
+        """
+        statuses = self.statuses(year)
+        incomplete = {}
+        remaining = {}
+        for cve_id, url in urls.items():
+            status, attempts = statuses.get(cve_id, (PENDING, 0))
+            if status == INCOMPLETE and attempts < MAX_INCOMPLETE_ATTEMPTS:
+                incomplete[cve_id] = url
+            elif status == PENDING or (status == FAILED and attempts < MAX_FAILED_ATTEMPTS):
+                remaining[cve_id] = url
+        return {**incomplete, **remaining}
+
+    def record_saved(self, cve_id, year, has_description, has_remedy, size):
+        status = COMPLETE if has_description else INCOMPLETE
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO pages (source, cve_id, year, status, attempts, last_attempt, has_description, has_remedy, size)"
+                " VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?) ON CONFLICT (source, cve_id) DO UPDATE SET status = excluded.status,"
+                " attempts = attempts + 1, last_attempt = excluded.last_attempt, has_description = excluded.has_description,"
+                " has_remedy = excluded.has_remedy, size = excluded.size",
+                (self.source, cve_id, year, status, time.time(), has_description, has_remedy, size)
+            )
+            self.connection.commit()
+
+    def record_failed(self, cve_id, year):
+        # a page that was saved before keeps its status, the failed attempt is still counted
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO pages (source, cve_id, year, status, attempts, last_attempt) VALUES (?, ?, ?, ?, 1, ?)"
+                " ON CONFLICT (source, cve_id) DO UPDATE SET attempts = attempts + 1, last_attempt = excluded.last_attempt,"
+                " status = CASE WHEN status IN (?, ?) THEN ? ELSE status END",
+                (self.source, cve_id, year, FAILED, time.time(), PENDING, FAILED, FAILED)
+            )
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def coverage(connection):
+    """{(source, year): {status: CVEs, "bytes": size of the saved pages, "with_remedy": pages with a remedy}}"""
+    summary = {}
+    rows = connection.execute(
+        "SELECT source, year, status, COUNT(*), SUM(size), SUM(has_remedy) FROM pages GROUP BY source, year, status"
+    )
+    for source, year, status, count, size, with_remedy in rows:
+        counts = summary.setdefault((source, year), {"bytes": 0, "with_remedy": 0})
+        counts[status] = count
+        counts["bytes"] += size or 0
+        counts["with_remedy"] += with_remedy or 0
+    return summary
+
+
+def main():
+    # python collection_state.py [state file], the coverage of every source and year
+    connection = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else COLLECTION_STATE_FILE)
+    print(f"{'source':<8}{'year':<6}{'total':>8}{'complete':>10}{'incomplete':>12}{'failed':>8}{'pending':>9}"
+          f"{'coverage':>10}{'remedies':>10}{'MB':>8}")
+    for (source, year), counts in sorted(coverage(connection).items()):
+        total = sum(counts.get(status, 0) for status in (PENDING, COMPLETE, INCOMPLETE, FAILED))
+        print(f"{source:<8}{year:<6}{total:>8}{counts.get(COMPLETE, 0):>10}{counts.get(INCOMPLETE, 0):>12}"
+              f"{counts.get(FAILED, 0):>8}{counts.get(PENDING, 0):>9}{counts.get(COMPLETE, 0) / total:>10.1%}"
+              f"{counts['with_remedy']:>10}{counts['bytes'] / 1e6:>8.1f}")
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
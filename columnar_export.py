@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import math
+import mmap
+import shutil
+import argparse
+from array import array
+from collections import Counter
+
+
+COLUMNS_DIRECTORY = "CVES.columns"
+METADATA_FILE = "columns.json"
+
+FLOAT = "float"
+CATEGORY = "category"
+TEXT = "text"
+# array typecode and the matching numpy dtype, so that np.memmap(path, dtype) can read a column without this module
+TYPECODES = {FLOAT: ("f", "float32"), CATEGORY: ("h", "int16"), "offsets": ("q", "int64")}
+# a missing value is NaN in a float column and -1 in a category column, a missing text is empty
+MISSING_CODE = -1
+
+# column name, type and path of the value in the aggregated record
+COLUMNS = [
+    ("nvd_cvss3_score", FLOAT, ("nvd", "impact", "baseMetricV3", "cvssV3", "baseScore")),
+    ("nvd_cvss3_severity", CATEGORY, ("nvd", "impact", "baseMetricV3", "cvssV3", "baseSeverity")),
+    ("nvd_cvss3_exploitability", FLOAT, ("nvd", "impact", "baseMetricV3", "exploitabilityScore")),
+    ("nvd_cvss3_impact", FLOAT, ("nvd", "impact", "baseMetricV3", "impactScore")),
+    ("nvd_cvss2_score", FLOAT, ("nvd", "impact", "baseMetricV2", "cvssV2", "baseScore")),
+    ("nvd_cvss2_severity", CATEGORY, ("nvd", "impact", "baseMetricV2", "severity")),
+    ("redhat_cvss3_score", FLOAT, ("redhat", "cvss3", "cvss3_base_score")),
+    ("redhat_cvss_score", FLOAT, ("redhat", "cvss", "cvss_base_score")),
+    ("redhat_severity", CATEGORY, ("redhat", "severity")),
+    ("redhat_cwe", CATEGORY, ("redhat", "cwe")),
+    ("ubuntu_priority", CATEGORY, ("ubuntu", "priority")),
+    ("ibm_score", FLOAT, ("ibm", "score")),
+    ("ibm_severity", CATEGORY, ("ibm", "severity")),
+    ("nvd_description", TEXT, ("nvd", "description")),
+    ("aqua_description", TEXT, ("aqua", "Basic Description")),
+    ("ubuntu_description", TEXT, ("ubuntu", "description")),
+    ("redhat_description", TEXT, ("redhat", "first_description")),
+    ("ibm_description", TEXT, ("ibm", "description")),
+]
+# the severity-like columns summarized by the CLI, per source
+SEVERITY_COLUMNS = ["nvd_cvss3_severity", "nvd_cvss2_severity", "redhat_severity", "ubuntu_priority", "ibm_severity"]
+
+
+def value_at(record, path):
+    for key in path:
+        if not isinstance(record, dict):
+            return None
+        record = record.get(key)
+    return record
+
+
+def to_float(value):
+    # Red Hat and IBM scores are strings
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class TextColumnWriter:
+    """Appends the UTF-8 texts to <name>.data, the offsets of row i are offsets[i]:offsets[i + 1]."""
+
+    def __init__(self, directory, name):
+        self.file = open(os.path.join(directory, f"{name}.data"), 'wb')
+        self.offsets = array(TYPECODES["offsets"][0], [0])
+
+    def append(self, text):
+        if text:
+            self.offsets.append(self.offsets[-1] + self.file.write(text.encode("utf-8")))
+        else:
+            self.offsets.append(self.offsets[-1])
+
+    def close(self, directory, name):
+        self.file.close()
+        with open(os.path.join(directory, f"{name}.offsets"), 'wb') as file:
+            self.offsets.tofile(file)
+
+
+def export_columns(records, directory=COLUMNS_DIRECTORY):
+    """Write the (year, CVE ID, record) of records as columns to directory and return the number of rows.
+
+    Numbers are float32 arrays, labels int16 codes into the categories listed in columns.json and texts
+    a data buffer with int64 offsets, all in native byte order and without any header, so every file
+    can be memory-mapped as it is. The export is written next to directory and replaces it at the end.
+    """
+    tmp_directory = directory + ".tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+
+    numbers = {name: array(TYPECODES[FLOAT][0]) for name, kind, _ in COLUMNS if kind == FLOAT}
+    codes = {name: array(TYPECODES[CATEGORY][0]) for name, kind, _ in COLUMNS if kind == CATEGORY}
+    categories = {name: {} for name in codes}
+    texts = {name: TextColumnWriter(tmp_directory, name) for name, kind, _ in COLUMNS if kind == TEXT}
+    texts["cve_id"] = TextColumnWriter(tmp_directory, "cve_id")
+    codes["year"] = array(TYPECODES[CATEGORY][0])
+    categories["year"] = {}
+
+    rows = 0
+    for year, cve_id, record in records:
+        texts["cve_id"].append(cve_id)
+        codes["year"].append(categories["year"].setdefault(year, len(categories["year"])))
+        for name, kind, path in COLUMNS:
+            value = value_at(record, path)
+            if kind == FLOAT:
+                numbers[name].append(to_float(value))
+            elif kind == CATEGORY:
+                if value is None or value == "":
+                    codes[name].append(MISSING_CODE)
+                else:
+                    value = str(value)
+                    codes[name].append(categories[name].setdefault(value, len(categories[name])))
+            else:
+                texts[name].append(value if isinstance(value, str) else "")
+        rows += 1
+
+    columns = {}
+    for name, values in numbers.items():
+        with open(os.path.join(tmp_directory, f"{name}.values"), 'wb') as file:
+            values.tofile(file)
+        columns[name] = {"type": FLOAT, "dtype": TYPECODES[FLOAT][1]}
+    for name, values in codes.items():
+        with open(os.path.join(tmp_directory, f"{name}.values"), 'wb') as file:
+            values.tofile(file)
+        columns[name] = {"type": CATEGORY, "dtype": TYPECODES[CATEGORY][1], "categories": list(categories[name])}
+    for name, writer in texts.items():
+        writer.close(tmp_directory, name)
+        columns[name] = {"type": TEXT, "dtype": TYPECODES["offsets"][1]}
+
+    with open(os.path.join(tmp_directory, METADATA_FILE), 'w') as file:
+        json.dump({"rows": rows, "byteorder": sys.byteorder, "columns": columns}, file, indent=4)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_directory, directory)
+    return rows
+
+
+def map_file(filepath):
+    with open(filepath, 'rb') as file:
+        # mmap cannot map an empty file
+        if os.fstat(file.fileno()).st_size == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class TextColumn:
+    """The texts of a column, read from the memory-mapped buffer when they are accessed."""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return bytes(self.data[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+    def lengths(self):
+        return [self.offsets[row + 1] - self.offsets[row] for row in range(len(self))]
+
+
+class ColumnarExport:
+    """Read access to an export, the columns are memory-mapped and only paged in when they are used."""
+
+    def __init__(self, directory=COLUMNS_DIRECTORY):
+        self.directory = directory
+        with open(os.path.join(directory, METADATA_FILE), 'r') as file:
+            self.metadata = json.load(file)
+        if self.metadata["byteorder"] != sys.byteorder:
+            raise ValueError(f"{directory} was exported on a {self.metadata['byteorder']} endian machine")
+        self.rows = self.metadata["rows"]
+        self.columns = self.metadata["columns"]
+
+    def column(self, name):
+        """A float32 or int16 memoryview for numbers and categories, a TextColumn for texts."""
+        column = self.columns[name]
+        if column["type"] == TEXT:
+            offsets = map_file(os.path.join(self.directory, f"{name}.offsets")).cast(TYPECODES["offsets"][0])
+            return TextColumn(offsets, map_file(os.path.join(self.directory, f"{name}.data")))
+        return map_file(os.path.join(self.directory, f"{name}.values")).cast(TYPECODES[column["type"]][0])
+
+    def categories(self, name):
+        return self.columns[name]["categories"]
+
+    def value_counts(self, name):
+        """{label: rows} of a category column, the rows without a value are not counted."""
+        labels = self.categories(name)
+        return {labels[code]: count for code, count in sorted(Counter(self.column(name)).items()) if code != MISSING_CODE}
+
+    def mean(self, name):
+        values = [value for value in self.column(name) if not math.isnan(value)]
+        return sum(values) / len(values) if values else math.nan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Severity distributions and mean scores of a columnar export")
+    parser.add_argument("directory", nargs="?", default=COLUMNS_DIRECTORY)
+    args = parser.parse_args()
+
+    export = ColumnarExport(args.directory)
+    print(f"{export.rows} CVEs")
+    for name in SEVERITY_COLUMNS:
+        counts = export.value_counts(name)
+        total = sum(counts.values()) or 1
+        print(f"{name}: " + ", ".join(f"{label} {count} ({count / total:.0%})" for label, count in counts.items()))
+    for name, kind, _ in COLUMNS:
+        if kind == FLOAT:
+            print(f"{name} mean {export.mean(name):.2f}")
+
+
+if __name__ == "__main__":
+    main()
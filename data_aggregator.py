@@ -1,274 +1,724 @@
 import os
+import sys
 import json
-from tqdm import tqdm
-from bs4 import BeautifulSoup
-from bs4 import Tag
-import re
-
-
-AGGREGATED_CVES_FOLDER = "CVES"
+import time
+import nvd_feed
+import manifest as mf
+import pack_store
+import output_store
+import search_index
+import metrics
+import pipeline
+import journal as jr
+import github_advisories
+import columnar_export
+from normalize import clean_string, clean_strings, clean_fields
+
+
+AGGREGATED_CVES_FOLDER = output_store.AGGREGATED_CVES_FOLDER
 YEARS = ["2024", "2023", "2022", "2021", "2020"]
 
-
-def clean_string(input_string):
-    new_string = input_string.encode("ascii", "ignore").decode("ascii")
-    new_string = re.sub(r'\s+', ' ', new_string).strip()
-    return new_string
+AQUA_INFO_DIRECTORY = "aqua"
+UBUNTU_INFO_DIRECTORY = "ubuntu"
+REDHAT_INFO_DIRECTORY = os.path.join("redhat", "api")
+# the feeds of the changes of the last days applied by aggregate_NVD_delta, in this order
+NVD_DELTA_FEEDS = ["modified", "recent"]
+# the advisories folder of a checkout of https://github.com/github/advisory-database
+GITHUB_ADVISORY_DIRECTORY = os.path.join("github", "advisory-database", "advisories")
+
+# "files" writes one CVES/<year>/<CVE>.json per record, "sqlite" writes every record to CVES.sqlite
+OUTPUT_BACKEND = "files"
+# hand the output batches to a background thread, so parsing the next batch overlaps with writing this one
+OUTPUT_WRITE_BEHIND = True
+# write the records without indentation and spaces, smaller and faster but harder to read by hand
+OUTPUT_COMPACT = False
+# flush every written batch to disk before it counts as written, slower but survives a power loss
+OUTPUT_FSYNC = False
+# store every distinct description and other long text once in CVES.texts.sqlite, the records refer to it by hash.
+# Records are only expanded when they are read through output_store, run `python output_store.py --dedup <backend>`
+# when turning it on for an existing output. None follows the output, deduplicated once CVES.texts.sqlite exists
+OUTPUT_DEDUP_TEXTS = None
+# keep the full-text search index (CVES.search.sqlite) up to date with every record the aggregators write
+UPDATE_SEARCH_INDEX = False
+# number of CVE records gathered in memory before they are written to the output store in one go
+MERGE_BATCH_SIZE = 1000
+
+# Aqua pages are parsed in a process pool, set the workers to 1 to parse them in the main process
+AQUA_PARSE_WORKERS = os.cpu_count() or 1
+# "lxml" can be used instead when it is installed, it is a lot faster than the builtin parser
+AQUA_HTML_PARSER = "html.parser"
+# the elements of the pages the parser builds and the selectors of the IBM details are in html_pages.py
+
+IBM_INFO_DIRECTORY = "IBM"
+IBM_PARSE_WORKERS = AQUA_PARSE_WORKERS
+IBM_HTML_PARSER = AQUA_HTML_PARSER
+
+# export_columns writes the scores, labels and descriptions of every record there as memory-mappable columns
+COLUMNS_DIRECTORY = columnar_export.COLUMNS_DIRECTORY
+
+# every aggregation run writes its stage timings and counters to <directory>/aggregator_<run>.json and .prom,
+# None disables writing them
+METRICS_DIRECTORY = "metrics"
+# progress of the aggregation runs, to resume them after a crash, and the inputs that failed, see journal.py
+RUN_JOURNAL_FILE = jr.RUN_JOURNAL_FILE
 
 
 def read_json(filepath):
+    # a missing file reads as an empty object, nothing is created for it
     try:
-        # Try reading the file
         with open(filepath, 'r') as file:
-            data = json.load(file)
+            return json.load(file)
     except FileNotFoundError:
-        # print(f"File '{filepath}' not found. Creating a new file...")
-        # If the file doesn't exist, create it with default content
-        with open(filepath, 'w') as file:
-            json.dump({}, file)  # Creates an empty JSON object
-        # Now try reading the file again
-        with open(filepath, 'r') as file:
-            data = json.load(file)
-    return data
+        return {}
+
+
+def discover_source_files(directory):
+    source_files = {}
+    if not os.path.isdir(directory):
+        print(f"{directory} does not exist, skipping it")
+        return source_files
+    for filename in os.listdir(directory):
+        filepath = os.path.join(directory, filename)  # Full path to the file
+        # Check if it is a file (not a subdirectory)
+        if (not os.path.isfile(filepath)):
+            continue
+        cve_id = filename.split(".")[0]
+        source_files[cve_id] = filepath
+    return source_files
+
+
+# measurements of the current aggregation run, see start_metrics
+run_metrics = metrics.Metrics("aggregator")
+
+
+def start_metrics(run):
+    global run_metrics
+    run_metrics = metrics.Metrics(f"aggregator_{run}")
+    return run_metrics
+
+
+def write_metrics():
+    if METRICS_DIRECTORY is None:
+        return
+    json_filepath, _ = run_metrics.write(METRICS_DIRECTORY)
+    print(f"metrics written to {json_filepath}")
+
+
+def open_output_store():
+    store = output_store.open_store(OUTPUT_BACKEND, compact=OUTPUT_COMPACT, fsync=OUTPUT_FSYNC, dedup=OUTPUT_DEDUP_TEXTS)
+    if UPDATE_SEARCH_INDEX:
+        store = search_index.IndexedStore(store, search_index.SearchIndex(normalize=clean_string))
+    if OUTPUT_WRITE_BEHIND:
+        # the bytes are counted by its background thread, in the metrics of the run that opened the store
+        store = output_store.WriteBehindStore(store, run_metrics=run_metrics)
+    return store
+
+
+def run_aggregation(plugin, workers=None):
+    """Aggregate one source for every year of YEARS, see pipeline.run_pipeline."""
+    start_metrics(plugin.name)
+    run_journal = jr.RunJournal(RUN_JOURNAL_FILE)
+    try:
+        pipeline.run_pipeline(plugin, open_output_store, YEARS, MERGE_BATCH_SIZE, workers, run_metrics, run_journal)
+        run_journal.finish(plugin.name)
+        report_quarantine(run_journal, plugin.name)
+    finally:
+        write_metrics()
+
+
+def report_quarantine(run_journal, source):
+    quarantined = len(run_journal.quarantined(source))
+    if quarantined:
+        print(f"{quarantined} {source} inputs are quarantined, see python journal.py {source} "
+              f"and python data_aggregator.py retry {source}")
+
 
+def extract_cve_id(complete_cve_record):
+    ID = complete_cve_record['cve']['CVE_data_meta']['ID']
+    return ID
 
-def write_json(dict_input, filepath):
-    with open(filepath, 'w') as file:
-        json.dump(dict_input, file, indent=4)
+
+def extract_cve_english_description(complete_cve_record):
+    ID = complete_cve_record['cve']['CVE_data_meta']['ID']
+    description_data = complete_cve_record['cve']['description']['description_data']
+    description = None
+    for desc in description_data:
+        if desc['lang'] == 'en':
+            description = desc['value']
+            break
+    if description is None:
+        print("no english description: ", ID)
+
+    return clean_string(description)
+
+
+def extract_cve_impact(complete_cve_record):
+    return complete_cve_record['impact']
+
+
+def extract_nvd_details(complete_cve_record):
+    nvd_cve_detail = {
+        "ID": extract_cve_id(complete_cve_record),
+        "description": extract_cve_english_description(complete_cve_record),
+        "impact": extract_cve_impact(complete_cve_record)
+    }
+    return nvd_cve_detail
+
+
+def iter_nvd_feed(year):
+    """The CVE items of a year's feed, the time spent reading and decoding it goes to the nvd.read stage."""
+    feed_filepath = f'nvdcve-1.1-{year}.json'
+    run_metrics.count("nvd.bytes_read", os.path.getsize(feed_filepath))
+    return run_metrics.timed_iter("nvd.read", nvd_feed.iter_cve_items(feed_filepath))
+
+
+class NVDPlugin(pipeline.SourcePlugin):
+    name = 'nvd'
+    # the reader thread already decodes the records, extracting them is cheaper than sending them to workers
+    workers = None
+
+    def discover(self, year):
+        return ((extract_cve_id(cve), cve) for cve in iter_nvd_feed(year))
+
+    def extract(self, cve_id, cve):
+        return extract_nvd_details(cve)
 
 
 def aggregate_NVD():
+    run_aggregation(NVDPlugin())
+
+
+class NVDDeltaPlugin(NVDPlugin):
+    def __init__(self, items_by_year):
+        self.items_by_year = items_by_year
+
+    def discover(self, year):
+        return self.items_by_year.get(year, {})
 
-    def extract_cve_id(complete_cve_record):
-        ID = complete_cve_record['cve']['CVE_data_meta']['ID']
-        return ID
-    
-    def extract_cve_english_description(complete_cve_record):
-        ID = complete_cve_record['cve']['CVE_data_meta']['ID']
-        description_data = complete_cve_record['cve']['description']['description_data']
-        description = None
-        for desc in description_data:
-            if desc['lang'] == 'en':
-                description = desc['value']
-                break
-        if description is None:
-            print("no english description: ", ID)
-
-        description = description.encode("ascii", "ignore").decode("ascii")
-        description = re.sub(r'\s+', ' ', description).strip()
-        return description
-    
-    def extract_cve_impact(complete_cve_record):
-        return complete_cve_record['impact']
-
-    for year in YEARS:
-        print(f"Starting NVD data aggregation for year {year}")
-
-        # create directory for the specific year in the result folder
-        year_directory = os.path.join(AGGREGATED_CVES_FOLDER, year)
-        os.makedirs(year_directory, exist_ok=True)
-        
-        nvd_feed = read_json(f'nvdcve-1.1-{year}.json')
-        cve_items = nvd_feed['CVE_Items']
-        for cve in tqdm(cve_items):
+
+def select_delta_items(feed, applied_timestamp):
+    """Group the records of a delta feed modified after applied_timestamp by the year of their CVE ID.
+
+    Also returns the oldest modification date of the feed.
+    """
+    items_by_year = {}
+    oldest = None
+    for cve in iter_nvd_feed(feed):
+        modified = cve['lastModifiedDate']
+        oldest = modified if oldest is None else min(oldest, modified)
+        if modified > applied_timestamp:
             cve_id = extract_cve_id(cve)
-            try:
-                cve_details_filename = os.path.join(year_directory, f"{cve_id}.json")
-                cve_details = read_json(cve_details_filename)
-                nvd_cve_detail = {
-                    "ID": cve_id,
-                    "description": extract_cve_english_description(cve),
-                    "impact": extract_cve_impact(cve)
-                }
-                cve_details['nvd'] = nvd_cve_detail
-                write_json(cve_details, cve_details_filename)
-            except Exception as e:
-                print(cve_id, e)
-                raise e
-
-
-def aggregate_aqua():
-    AQUA_INFO_DIRECTORY = "aqua"
-
-    def read_html_file_and_parse(filepath):
-        with open(filepath, 'r', encoding='utf-8') as file:
-            html_content = file.read()
-        # Parse the HTML content using BeautifulSoup
-        soup = BeautifulSoup(html_content, 'html.parser')
-        return soup
-    
-    def extract_subtitle(parsed_html):
-        headers = parsed_html.find_all("div", class_="header_title_wrap")
-        if len(headers) != 1:
-            print("There is a problem with finding the headers")
-            raise Exception
-        header = headers[0]
-        subtitles = header.find_all("h2", class_="subtitle page_subtitle fadeInUp animationDelay_2")
-        if len(subtitles) > 1:
-            print("There is a problem with finding the subtitle in headers")
-            raise Exception
-        elif len(subtitles) == 0:
-            return ""
-        subtitle_text = subtitles[0].text
-        return subtitle_text
-    
-    def extract_important_info(parsed_html):
-        vul_contents = parsed_html.find_all("div", class_="content vulnerability_content")
-        if len(vul_contents) != 1:
-            print("something wrong with finding vul_content")
-            raise Exception
-        vul_content_div = vul_contents[0]
-
-        important_info = {}
-        current_info = "Basic Description"
-        for child in vul_content_div.children:
-            if current_info not in important_info:
-                important_info[current_info] = []
-
-            if isinstance(child, Tag) and child.name == "h3":
-                current_info = child.text
+            items_by_year.setdefault(output_store.year_of(cve_id), {})[cve_id] = cve
+    return items_by_year, oldest
+
+
+def aggregate_NVD_delta():
+    """Update the nvd section of the CVEs changed in the modified and recent feeds of NVD.
+
+    The timestamp of every applied feed is kept in the manifest of the output store: a feed that was
+    already applied is skipped and only its records modified since the last applied one are written,
+    to the year of their CVE ID whether it is in YEARS or not.
+    """
+    start_metrics("nvd_delta")
+    manifest_filepath = output_store.manifest_path(OUTPUT_BACKEND)
+    manifest = mf.load_manifest(manifest_filepath)
+    applied_timestamps = manifest.setdefault('nvd_delta', {})
+    run_journal = jr.RunJournal(RUN_JOURNAL_FILE)
+    try:
+        for feed in NVD_DELTA_FEEDS:
+            feed_filepath = f'nvdcve-1.1-{feed}.json'
+            if not os.path.exists(feed_filepath):
+                print(f"{feed_filepath} does not exist, skipping it")
                 continue
-
-            important_info[current_info].append(child.get_text())
-        
-        for key in important_info:
-            important_info[key] = " ".join(important_info[key])
-            important_info[key] = important_info[key].encode("ascii", "ignore").decode("ascii")
-            important_info[key] = re.sub(r'\s+', ' ', important_info[key]).strip()
-        return important_info
-
-    for year in YEARS:
-        print(f"Starting Aqua data aggregation for year {year}")
-        
-        # create directory for the specific year in the result folder
-        year_directory = os.path.join(AGGREGATED_CVES_FOLDER, year)
-        os.makedirs(year_directory, exist_ok=True)
-
-        aqua_year_directory = os.path.join(AQUA_INFO_DIRECTORY, year)
-        count = 0
-        for filename in tqdm(os.listdir(aqua_year_directory)):
-            filepath = os.path.join(aqua_year_directory, filename)  # Full path to the file
-            # Check if it is a file (not a subdirectory)
-            if (not os.path.isfile(filepath)):
+            timestamp = nvd_feed.read_feed_metadata(feed_filepath)['CVE_data_timestamp']
+            applied_timestamp = applied_timestamps.get(feed, "")
+            if timestamp <= applied_timestamp:
+                print(f"{feed_filepath} of {timestamp} was already applied")
                 continue
 
-            cve_id = filename.split(".")[0]
-            cve_details_filename = os.path.join(year_directory, f"{cve_id}.json")
-            cve_details = read_json(cve_details_filename)
-
-            # read the HTML
-            try:
-                parsed_html = read_html_file_and_parse(filepath)
-                subtitle = extract_subtitle(parsed_html)
-                aqua_cve_details = extract_important_info(parsed_html)
-                aqua_cve_details['subtitle'] = subtitle
-            except Exception as e:
-                print(cve_id, e)
-                raise e
-
-            cve_details['aqua'] = aqua_cve_details
-            write_json(cve_details, cve_details_filename)
-            count += 1
-        print(f"finished {count} records for year {year}")
-            
+            items_by_year, oldest = select_delta_items(feed, applied_timestamp)
+            if applied_timestamp and oldest is not None and oldest > applied_timestamp:
+                # the feed only covers the last days, the changes in between are in the yearly feeds
+                print(f"{feed_filepath} starts at {oldest} but the last applied one is of {applied_timestamp}, "
+                      f"run aggregate_NVD to pick up the changes in between")
+            changed = sum(len(items) for items in items_by_year.values())
+            print(f"Applying {changed} changed records of {feed_filepath} of {timestamp}")
+            run = f"nvd_delta_{feed}"
+            pipeline.run_pipeline(NVDDeltaPlugin(items_by_year), open_output_store, sorted(items_by_year, reverse=True),
+                                  MERGE_BATCH_SIZE, run_metrics=run_metrics, journal=run_journal, run=run)
+            applied_timestamps[feed] = timestamp
+            mf.save_manifest(manifest, manifest_filepath)
+            run_journal.finish(run)
+        report_quarantine(run_journal, 'nvd')
+    finally:
+        write_metrics()
+
+
+# readers of the packs opened by this process, see get_pack_reader
+pack_readers = {}
+
+
+def get_pack_reader(pack_filepath):
+    if pack_filepath not in pack_readers:
+        pack_readers[pack_filepath] = pack_store.PackReader(pack_filepath)
+    return pack_readers[pack_filepath]
+
+
+def close_pack_readers():
+    # called when a run ends, the next run may see pages that were added to the packs in the meantime
+    for reader in pack_readers.values():
+        reader.close()
+    pack_readers.clear()
+
+
+def discover_html_pages(directory, year):
+    """List the (CVE ID, page) of the pages of a year saved by the collector of directory.
+
+    A page is either the path of a <CVE>.html file or a (pack path, CVE ID) pair when the
+    year was collected into, or converted to, a pack. Loose files win over the pack.
+    The pages of the pack come first and in the order of the pack, so that parsing them
+    in this order reads the pack sequentially, then the loose files sorted by CVE ID.
+    """
+    pack_cve_ids = []
+    pack_filepath = pack_store.pack_path(directory, year)
+    if os.path.exists(pack_filepath):
+        pack_cve_ids = get_pack_reader(pack_filepath).keys_in_pack_order()
+    source_files = {}
+    year_directory = os.path.join(directory, year)
+    if not pack_cve_ids or os.path.isdir(year_directory):
+        source_files = discover_source_files(year_directory)
+    pages = [(cve_id, (pack_filepath, cve_id)) for cve_id in pack_cve_ids if cve_id not in source_files]
+    return pages + sorted(source_files.items())
+
+
+def read_html_page(page):
+    if isinstance(page, tuple):
+        pack_filepath, cve_id = page
+        return get_pack_reader(pack_filepath).get(cve_id)
+    with open(page, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def read_measured_html_page(source, page):
+    start = time.perf_counter()
+    html_content = read_html_page(page)
+    pipeline.record_time(f"{source}.read", time.perf_counter() - start)
+    pipeline.record_count(f"{source}.bytes_read", len(html_content))
+    return html_content
+
+
+class HTMLPagePlugin(pipeline.SourcePlugin):
+    """The pages a collector saved in directory, parsed into the elements of parse_only and given to extract_details."""
+
+    # parsing the pages is pure Python work, only processes run it in parallel
+    workers = "process"
+
+    def __init__(self, name, directory, parse_only, extract_details, parser, worker_count):
+        self.name = name
+        self.directory = directory
+        self.parse_only = parse_only
+        self.extract_details = extract_details
+        self.parser = parser
+        self.worker_count = worker_count
+
+    def discover(self, year):
+        return discover_html_pages(self.directory, year)
+
+    def parse(self, cve_id, page):
+        import html_pages
+        return html_pages.parse_html(read_measured_html_page(self.name, page), self.parser, self.parse_only)
+
+    def extract(self, cve_id, parsed_html):
+        return self.extract_details(parsed_html)
+
+    def restore_input(self, page):
+        # a page of a pack is a (pack path, CVE ID) tuple, which the journal stored as a list
+        return tuple(page) if isinstance(page, list) else page
+
+
+def aqua_plugin(parser=AQUA_HTML_PARSER):
+    import html_pages
+    return HTMLPagePlugin('aqua', AQUA_INFO_DIRECTORY, html_pages.AQUA_PARSE_ONLY,
+                          html_pages.extract_aqua_details_from_soup, parser, AQUA_PARSE_WORKERS)
+
+
+def aggregate_aqua(workers=AQUA_PARSE_WORKERS, parser=AQUA_HTML_PARSER):
+    try:
+        run_aggregation(aqua_plugin(parser), workers)
+    finally:
+        close_pack_readers()
+
+
+def ibm_plugin(parser=IBM_HTML_PARSER):
+    """The rendered IBM X-Force pages, read and parsed like the Aqua pages."""
+    import html_pages
+    return HTMLPagePlugin('ibm', IBM_INFO_DIRECTORY, html_pages.IBM_PARSE_ONLY,
+                          html_pages.extract_ibm_details_from_soup, parser, IBM_PARSE_WORKERS)
+
+
+def aggregate_ibm(workers=IBM_PARSE_WORKERS, parser=IBM_HTML_PARSER):
+    try:
+        run_aggregation(ibm_plugin(parser), workers)
+    finally:
+        close_pack_readers()
+
+
+def read_source_json(source, filepath):
+    start = time.perf_counter()
+    record = read_json(filepath)
+    pipeline.record_time(f"{source}.read", time.perf_counter() - start)
+    pipeline.record_count(f"{source}.bytes_read", os.path.getsize(filepath))
+    return record
+
+
+def ubuntu_details_from_record(ubuntu_cve_record):
+    start = time.perf_counter()
+    # every field of an Ubuntu record is a string
+    description, ubuntu_description, priority = clean_strings(
+        [ubuntu_cve_record['Description'], ubuntu_cve_record['UbuntuDescription'], ubuntu_cve_record['Priority']])
+    pipeline.record_time("ubuntu.clean", time.perf_counter() - start)
+    ubuntu_cve_details = {
+        "description": description,
+        "ubuntu_description": ubuntu_description,
+        "priority": priority
+    }
+    return ubuntu_cve_details
+
+
+class UbuntuPlugin(pipeline.SourcePlugin):
+    name = 'ubuntu'
+
+    def discover(self, year):
+        return discover_source_files(os.path.join(UBUNTU_INFO_DIRECTORY, year))
+
+    def parse(self, cve_id, filepath):
+        return read_source_json(self.name, filepath)
+
+    def extract(self, cve_id, ubuntu_cve_record):
+        return ubuntu_details_from_record(ubuntu_cve_record)
+
 
 def aggregate_ubuntu():
-    ubuntu_INFO_DIRECTORY = "ubuntu"
-
-    for year in YEARS:
-        print(f"Starting ubuntu data aggregation for year {year}")
-        
-        # create directory for the specific year in the result folder
-        year_directory = os.path.join(AGGREGATED_CVES_FOLDER, year)
-        os.makedirs(year_directory, exist_ok=True)
-
-        ubuntu_year_directory = os.path.join(ubuntu_INFO_DIRECTORY, year)
-        count = 0
-        for filename in tqdm(os.listdir(ubuntu_year_directory)):
-            filepath = os.path.join(ubuntu_year_directory, filename)  # Full path to the file
-            # Check if it is a file (not a subdirectory)
-            if (not os.path.isfile(filepath)):
-                print("it wasn't a file")
-                continue
+    run_aggregation(UbuntuPlugin())
 
-            cve_id = filename.split(".")[0]
-            cve_details_filename = os.path.join(year_directory, f"{cve_id}.json")
-            cve_details = read_json(cve_details_filename)
 
-            ubuntu_cve_record = read_json(filepath)
-            ubuntu_cve_details = {
-                "description": ubuntu_cve_record['Description'],
-                "ubuntu_description": ubuntu_cve_record['UbuntuDescription'],
-                "priority": ubuntu_cve_record['Priority']
-            }
+def redhat_details_from_record(redhat_cve_record, cve_id):
+    if len(redhat_cve_record['details']) > 2:
+        print(f"It had more than {len(redhat_cve_record['details'])} elements for details ", cve_id)
+    redhat_cve_details = {
+        "mitigation": redhat_cve_record['mitigation'] if 'mitigation' in redhat_cve_record else "",
+        "severity": redhat_cve_record['threat_severity'],
+        "bugzilla_description": redhat_cve_record['bugzilla']['description'],
+        "cvss": redhat_cve_record['cvss'],
+        "cvss3": redhat_cve_record['cvss3'],
+        "first_description": redhat_cve_record['details'][0],
+        "second_description": redhat_cve_record['details'][1] if len(redhat_cve_record['details']) > 1 else "",
+        "redhat_statement":  redhat_cve_record['statement'],
+        "cwe": redhat_cve_record['cwe']
+    }
+    start = time.perf_counter()
+    clean_fields(redhat_cve_details)
+    pipeline.record_time("redhat.clean", time.perf_counter() - start)
+    return redhat_cve_details
 
-            for key in ubuntu_cve_details:
-                ubuntu_cve_details[key] = clean_string(ubuntu_cve_details[key])
 
-            cve_details['ubuntu'] = ubuntu_cve_details
-            write_json(cve_details, cve_details_filename)
-            count += 1
-        print(f"finished {count} records for year {year}")
+class RedhatPlugin(pipeline.SourcePlugin):
+    name = 'redhat'
+
+    def discover(self, year):
+        return discover_source_files(os.path.join(REDHAT_INFO_DIRECTORY, year))
+
+    def parse(self, cve_id, filepath):
+        return read_source_json(self.name, filepath)
+
+    def extract(self, cve_id, redhat_cve_record):
+        return redhat_details_from_record(redhat_cve_record, cve_id)
 
 
 def aggregate_redhat():
-    REDHAT_INFO_DIRECTORY = os.path.join("redhat", "api")
-
-    for year in YEARS:
-        print(f"Starting redhat data aggregation for year {year}")
-        
-        # create directory for the specific year in the result folder
-        year_directory = os.path.join(AGGREGATED_CVES_FOLDER, year)
-        os.makedirs(year_directory, exist_ok=True)
-
-        redhat_year_directory = os.path.join(REDHAT_INFO_DIRECTORY, year)
-        count = 0
-        for filename in tqdm(os.listdir(redhat_year_directory)):
-            filepath = os.path.join(redhat_year_directory, filename)  # Full path to the file
-            # Check if it is a file (not a subdirectory)
-            if (not os.path.isfile(filepath)):
-                print("it wasn't a file")
-                continue
+    run_aggregation(RedhatPlugin())
 
-            cve_id = filename.split(".")[0]
-            cve_details_filename = os.path.join(year_directory, f"{cve_id}.json")
-            cve_details = read_json(cve_details_filename)
-
-            redhat_cve_record = read_json(filepath)
-            if len(redhat_cve_record['details']) > 2:
-                print(f"It had more than {len(redhat_cve_record['details'])} elements for details ", cve_id)
-            redhat_cve_details = {
-                "mitigation": redhat_cve_record['mitigation'] if 'mitigation' in redhat_cve_record else "",
-                "severity": redhat_cve_record['threat_severity'],
-                "bugzilla_description": redhat_cve_record['bugzilla']['description'],
-                "cvss": redhat_cve_record['cvss'],
-                "cvss3": redhat_cve_record['cvss3'],
-                "first_description": redhat_cve_record['details'][0],
-                "second_description": redhat_cve_record['details'][1] if len(redhat_cve_record['details']) > 1 else "",
-                "redhat_statement":  redhat_cve_record['statement'],
-                "cwe": redhat_cve_record['cwe']
-            }
-
-            for key in redhat_cve_details:
-                if isinstance(redhat_cve_details[key], str):
-                    redhat_cve_details[key] = clean_string(redhat_cve_details[key])
-
-            cve_details['redhat'] = redhat_cve_details
-            write_json(cve_details, cve_details_filename)
-            count += 1
-        print(f"finished {count} records for year {year}")
-
-def aggregate_github_advisory():
-    pass
 
+class GithubAdvisoryPlugin(pipeline.SourcePlugin):
+    """Merges the sections looked up in the advisory index, {advisory ID: section} per CVE or None to remove it."""
 
-def main():
-    os.makedirs(AGGREGATED_CVES_FOLDER, exist_ok=True)
-    # aggregate_NVD()
-    # aggregate_aqua()
-    # aggregate_redhat()
-    aggregate_ubuntu()
+    name = 'github'
+    # the sections are already extracted, there is nothing left for workers to do
+    workers = None
+
+    def __init__(self, sections_by_year):
+        self.sections_by_year = sections_by_year
+
+    def discover(self, year):
+        return self.sections_by_year.get(year, {})
+
+    def extract(self, cve_id, section):
+        return section
+
+
+def aggregate_github_advisory(incremental=False):
+    """Merge the github section into every CVE that a GitHub advisory aliases.
 
+    The advisory-database checkout is indexed in github_advisories.sqlite, which maps every CVE to its
+    advisories. Only the advisories added or changed since the last run are read. With incremental=True
+    only the CVEs whose advisories changed are written, otherwise every CVE of the index is, to the year
+    of their CVE ID whether it is in YEARS or not.
+    """
+    index = github_advisories.AdvisoryIndex()
+    start_metrics("github")
+    try:
+        print(f"Indexing the GitHub advisories of {GITHUB_ADVISORY_DIRECTORY}")
+        with run_metrics.timer("github.refresh"):
+            affected_cve_ids, read, removed, failed = index.refresh(GITHUB_ADVISORY_DIRECTORY)
+        run_metrics.count("github.advisories_read", read)
+        run_metrics.count("github.advisories_removed", removed)
+        run_metrics.count("github.errors", failed)
+        print(f"read {read} new or changed advisories, {removed} were removed and {failed} could not be read")
+        cve_ids = affected_cve_ids if incremental else affected_cve_ids | index.cve_ids()
+
+        sections_by_year = {}
+        for cve_id, section in index.sections(sorted(cve_ids)).items():
+            sections_by_year.setdefault(output_store.year_of(cve_id), {})[cve_id] = section
+        # every year, committing the index below marks the advisories of all of them as applied
+        pipeline.run_pipeline(GithubAdvisoryPlugin(sections_by_year), open_output_store,
+                              sorted(sections_by_year, reverse=True), MERGE_BATCH_SIZE, run_metrics=run_metrics)
+        # only now the next run can skip these advisories
+        index.commit()
+    finally:
+        index.close()
+        write_metrics()
+
+
+def select_changed_files(manifest_files, source, year, source_files, incremental):
+    """Fingerprint the files of a source and return the ones to aggregate and the CVEs whose file is gone."""
+    changed_files = {}
+    for cve_id, filepath in source_files.items():
+        entry, changed = mf.fingerprint(filepath, manifest_files.get(filepath))
+        entry.update(source=source, year=year, cve_id=cve_id)
+        manifest_files[filepath] = entry
+        if changed or not incremental:
+            changed_files[cve_id] = filepath
+
+    current_filepaths = set(source_files.values())
+    removed_cve_ids = []
+    for filepath, entry in list(manifest_files.items()):
+        # feeds and packs hold several CVEs and are tracked record by record instead
+        if 'cve_id' not in entry:
+            continue
+        if entry['source'] == source and entry['year'] == year and filepath not in current_filepaths:
+            removed_cve_ids.append(entry['cve_id'])
+            del manifest_files[filepath]
+    return changed_files, removed_cve_ids
+
+
+def select_changed_aqua_pages(manifest_files, year, incremental):
+    """select_changed_files for the Aqua pages of a year, which can also come from a pack.
+
+    A pack is append-only, so a page stored again gets a new offset and comparing the
+    (offset, length) of the pages is enough to find the changed ones without hashing the pack.
+    """
+    aqua_year_directory = os.path.join(AQUA_INFO_DIRECTORY, year)
+    pack_filepath = pack_store.pack_path(AQUA_INFO_DIRECTORY, year)
+    source_files = {}
+    if os.path.isdir(aqua_year_directory) or not os.path.exists(pack_filepath):
+        source_files = discover_source_files(aqua_year_directory)
+    changed_pages, removed_cve_ids = select_changed_files(manifest_files, 'aqua', year, source_files, incremental)
+    removed_cve_ids = set(removed_cve_ids)
+
+    previous_records = manifest_files.pop(pack_filepath, {}).get('records', {})
+    records = {}
+    if os.path.exists(pack_filepath):
+        for cve_id, (offset, length) in get_pack_reader(pack_filepath).index.items():
+            # loose files win over the pack
+            if cve_id not in source_files:
+                records[cve_id] = f"{offset}:{length}"
+        manifest_files[pack_filepath] = {'source': 'aqua', 'year': year, 'records': records}
+
+    for cve_id, record in records.items():
+        # a CVE whose loose file was removed is aggregated again from the pack
+        if not incremental or previous_records.get(cve_id) != record or cve_id in removed_cve_ids:
+            changed_pages[cve_id] = (pack_filepath, cve_id)
+    removed_cve_ids = [cve_id for cve_id in removed_cve_ids if cve_id not in records]
+    removed_cve_ids += [cve_id for cve_id in previous_records if cve_id not in records and cve_id not in source_files]
+    return changed_pages, removed_cve_ids
+
+
+def select_changed_nvd_items(manifest_files, year, incremental):
+    """Return the NVD records of a year that have to be aggregated and the CVEs that left the feed.
+
+    The feed is only decoded when it changed, and then only the records that changed are returned.
+    """
+    feed_filepath = f'nvdcve-1.1-{year}.json'
+    previous_entry = manifest_files.get(feed_filepath)
+    entry, changed = mf.fingerprint(feed_filepath, previous_entry)
+    manifest_files[feed_filepath] = entry
+    if incremental and not changed:
+        return {}, []
+
+    nvd_items = {extract_cve_id(cve): cve for cve in iter_nvd_feed(year)}
+    previous_records = previous_entry.get('records', {}) if previous_entry is not None else {}
+    records = {cve_id: mf.hash_record(cve) for cve_id, cve in nvd_items.items()}
+    if incremental:
+        nvd_items = {cve_id: cve for cve_id, cve in nvd_items.items() if previous_records.get(cve_id) != records[cve_id]}
+    removed_cve_ids = [cve_id for cve_id in previous_records if cve_id not in records]
+    entry.update(source='nvd', year=year, records=records)
+    return nvd_items, removed_cve_ids
+
+
+class AllSourcesPlugin(pipeline.MergedSources):
+    """NVD, Aqua, Ubuntu and Red Hat merged in one pass, see aggregate_all.
+
+    discover compares the inputs of a year with the manifest, the entries of the year are only
+    replaced in the manifest once the writer handed every record of the year to the store.
+    """
+
+    def __init__(self, name, manifest, manifest_filepath, incremental, run_journal, parser=AQUA_HTML_PARSER):
+        super().__init__(name, [NVDPlugin(), aqua_plugin(parser), UbuntuPlugin(), RedhatPlugin()])
+        self.manifest = manifest
+        self.manifest_filepath = manifest_filepath
+        self.incremental = incremental
+        self.run_journal = run_journal
+        # {year: {path: entry}} of the years discovered but not written yet
+        self.year_files = {}
+
+    def discover(self, year):
+        select_start = time.perf_counter()
+        manifest_files = {filepath: dict(entry) for filepath, entry in list(self.manifest['files'].items())
+                          if entry.get('year') == year}
+        inputs = {}
+        removed = {}
+        inputs['nvd'], removed['nvd'] = select_changed_nvd_items(manifest_files, year, self.incremental)
+        inputs['aqua'], removed['aqua'] = select_changed_aqua_pages(manifest_files, year, self.incremental)
+        for source, directory in (('ubuntu', UBUNTU_INFO_DIRECTORY), ('redhat', REDHAT_INFO_DIRECTORY)):
+            source_files = discover_source_files(os.path.join(directory, year))
+            inputs[source], removed[source] = select_changed_files(manifest_files, source, year, source_files,
+                                                                   self.incremental)
+        self.year_files[year] = manifest_files
+        # fingerprinting the inputs, decoding the NVD feed is part of nvd.read
+        run_metrics.add_time("manifest.select", time.perf_counter() - select_start)
+
+        cve_inputs = {}
+        for source in self.plugins:
+            # None removes the section, unless the CVE still has an input for it
+            for cve_id in removed[source]:
+                cve_inputs.setdefault(cve_id, {})[source] = None
+            for cve_id, source_input in inputs[source].items():
+                cve_inputs.setdefault(cve_id, {})[source] = source_input
+        return cve_inputs
+
+    def year_written(self, year, store):
+        # the outputs of the year are written, so a crash from here on does not lose any change
+        with run_metrics.timer("manifest.save"):
+            store.flush()
+            manifest_files = self.year_files.pop(year)
+            feed_entry = manifest_files.get(f'nvdcve-1.1-{year}.json', {})
+            for cve_id in self.run_journal.quarantined('nvd'):
+                # not recorded, so that the next incremental run aggregates a quarantined record again
+                feed_entry.get('records', {}).pop(cve_id, None)
+            files = self.manifest['files']
+            for filepath in [filepath for filepath, entry in files.items() if entry.get('year') == year]:
+                del files[filepath]
+            files.update(manifest_files)
+            mf.save_manifest(self.manifest, self.manifest_filepath)
+
+
+def aggregate_all(batch_size=MERGE_BATCH_SIZE, workers=AQUA_PARSE_WORKERS, parser=AQUA_HTML_PARSER, incremental=False):
+    """Aggregate every source in a single pass, reading and writing each CVE record once.
+
+    The inputs of the sources are parsed on their own workers, see pipeline.MergedSources, and merged
+    into batches of at most batch_size records.
+    Every input is recorded in the manifest of the output store, with incremental=True only the CVEs whose
+    inputs were added or changed since the last run are aggregated again. In both modes
+    the sections of inputs that disappeared are removed from their records.
+    The inputs that fail are quarantined in the run journal and the run goes on without their sections.
+    A run that crashed is resumed from its last checkpoint.
+    """
+    run = "all_incremental" if incremental else "all"
+    start_metrics(run)
+    run_journal = jr.RunJournal(RUN_JOURNAL_FILE)
+    manifest_filepath = output_store.manifest_path(OUTPUT_BACKEND)
+    plugin = AllSourcesPlugin(run, mf.load_manifest(manifest_filepath), manifest_filepath, incremental, run_journal,
+                              parser)
+    try:
+        pipeline.run_pipeline(plugin, open_output_store, YEARS, batch_size, workers, run_metrics, run_journal, run)
+        run_journal.finish(run)
+        for source in run_journal.quarantined_sources():
+            report_quarantine(run_journal, source)
+    finally:
+        close_pack_readers()
+        write_metrics()
+
+
+# the plugins that can aggregate a quarantined input again, by source
+RETRY_PLUGINS = {
+    'nvd': NVDPlugin,
+    'aqua': aqua_plugin,
+    'ubuntu': UbuntuPlugin,
+    'redhat': RedhatPlugin,
+    'ibm': ibm_plugin,
+}
+
+
+def retry_quarantined(sources=None):
+    """Aggregate the quarantined inputs of the given sources again, all of them by default.
+
+    Meant to be run after fixing an extractor or an input file: the inputs that succeed leave the
+    quarantine, the ones that still fail stay in it with their new traceback.
+    """
+    run_journal = jr.RunJournal(RUN_JOURNAL_FILE)
+    for source in sources or run_journal.quarantined_sources():
+        if source not in RETRY_PLUGINS:
+            print(f"the quarantined inputs of {source} cannot be retried")
+            continue
+        plugin = RETRY_PLUGINS[source]()
+        inputs_by_year = {}
+        for cve_id, entry in run_journal.quarantined(source).items():
+            inputs_by_year.setdefault(entry['year'], {})[cve_id] = plugin.restore_input(entry['input'])
+        if not inputs_by_year:
+            print(f"no {source} input is quarantined")
+            continue
+        print(f"Retrying {sum(len(inputs) for inputs in inputs_by_year.values())} quarantined {source} inputs")
+        run = f"retry_{source}"
+        start_metrics(run)
+        try:
+            # the quarantine changes with every retry, so a retry always starts from scratch
+            run_journal.finish(run)
+            pipeline.run_pipeline(pipeline.QuarantinedInputs(plugin, inputs_by_year), open_output_store,
+                                  sorted(inputs_by_year, reverse=True), MERGE_BATCH_SIZE, run_metrics=run_metrics,
+                                  journal=run_journal, run=run)
+            run_journal.finish(run)
+            report_quarantine(run_journal, source)
+        finally:
+            close_pack_readers()
+            write_metrics()
+
+
+def build_search_index():
+    """Rebuild the full-text search index from every aggregated record."""
+    store = output_store.open_store(OUTPUT_BACKEND, dedup=OUTPUT_DEDUP_TEXTS)
+    index = search_index.SearchIndex(normalize=clean_string)
+    try:
+        count = search_index.build_index(store, index)
+        print(f"indexed {count} records")
+    finally:
+        store.close()
+        index.close()
+
+
+def export_columns():
+    """Export the aggregated records as columns for the analytics jobs, see columnar_export.py."""
+    store = output_store.open_store(OUTPUT_BACKEND, dedup=OUTPUT_DEDUP_TEXTS)
+    try:
+        rows = columnar_export.export_columns(store.iter_records(), COLUMNS_DIRECTORY)
+        print(f"exported {rows} records to {COLUMNS_DIRECTORY}")
+    finally:
+        store.close()
+
+
+def main():
+    # python data_aggregator.py [source ...] [options] is python cli.py aggregate, and retry [source ...] python cli.py retry
+    import cli
+    cli.main(sys.argv[1:] if sys.argv[1:2] == ["retry"] else ["aggregate"] + sys.argv[1:])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from normalize import clean_fields
+from sqlite_chunks import select_in_chunks
+
+
+ADVISORY_INDEX_FILE = "github_advisories.sqlite"
+READ_WORKERS = 8
+
+
+def iter_advisory_files(directory):
+    """Yield (path, size, mtime in ns) of every advisory of an advisory-database checkout, e.g. its advisories/ folder."""
+    for root, dirnames, filenames in os.walk(directory):
+        # deterministic order, and .git is not part of the database
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith("."))
+        for filename in sorted(filenames):
+            if filename.endswith(".json"):
+                filepath = os.path.join(root, filename)
+                stat = os.stat(filepath)
+                yield filepath, stat.st_size, stat.st_mtime_ns
+
+
+def advisory_cve_ids(advisory):
+    # GHSA advisories list their CVE as an alias, records of other OSV databases can be CVEs themselves
+    ids = [advisory.get("id", "")] + advisory.get("aliases", [])
+    return sorted({alias for alias in ids if alias.startswith("CVE-")})
+
+
+def advisory_section(advisory):
+    """The part of an OSV/GHSA advisory that goes into the github section of its CVEs."""
+    database_specific = advisory.get("database_specific", {})
+    scores = [severity["score"] for severity in advisory.get("severity", []) if severity.get("type", "").startswith("CVSS")]
+    packages = []
+    for affected in advisory.get("affected", []):
+        package = affected.get("package", {})
+        name = f"{package.get('ecosystem', '')}:{package.get('name', '')}"
+        if name not in packages:
+            packages.append(name)
+    section = {
+        "summary": advisory.get("summary", ""),
+        "details": advisory.get("details", ""),
+        "severity": database_specific.get("severity", ""),
+        "cvss": scores[-1] if scores else "",
+        "cwe_ids": database_specific.get("cwe_ids", []),
+        "packages": packages,
+        "reviewed": database_specific.get("github_reviewed", False),
+        "published": advisory.get("published", ""),
+        "modified": advisory.get("modified", ""),
+        "withdrawn": advisory.get("withdrawn", ""),
+    }
+    return clean_fields(section, ["summary", "details"])
+
+
+def read_advisory(filepath):
+    with open(filepath, 'r', encoding='utf-8') as file:
+        advisory = json.load(file)
+    return advisory.get("id", os.path.basename(filepath).split(".json")[0]), advisory_cve_ids(advisory), advisory_section(advisory)
+
+
+def read_advisory_or_error(filepath):
+    # one unreadable or malformed advisory must not stop the refresh of the others
+    try:
+        return read_advisory(filepath), None
+    except Exception as e:
+        return None, e
+
+
+class AdvisoryIndex:
+    """Persistent index of an advisory-database checkout: the extracted section of every advisory and the CVEs it aliases.
+
+    refresh only reads the advisories whose size or mtime changed since the last refresh, so after the
+    first run the github sections can be brought up to date without scanning the whole database again.
+    The changes of a refresh are only committed by commit, after they were merged into the records.
+    """
+
+    def __init__(self, filepath=ADVISORY_INDEX_FILE):
+        self.connection = sqlite3.connect(filepath)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS advisories (path TEXT PRIMARY KEY, advisory_id TEXT NOT NULL,"
+            " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, section TEXT NOT NULL)"
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS aliases (cve_id TEXT NOT NULL, path TEXT NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS aliases_cve_id ON aliases (cve_id)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS aliases_path ON aliases (path)")
+        self.connection.commit()
+
+    def cve_ids_of(self, filepaths):
+        rows = select_in_chunks(self.connection, "SELECT cve_id FROM aliases WHERE path IN ({placeholders})", filepaths)
+        return {row[0] for row in rows}
+
+    def remove(self, filepaths):
+        self.connection.executemany("DELETE FROM advisories WHERE path = ?", [(filepath,) for filepath in filepaths])
+        self.connection.executemany("DELETE FROM aliases WHERE path = ?", [(filepath,) for filepath in filepaths])
+
+    def refresh(self, directory, workers=READ_WORKERS):
+        """Bring the index up to date with the checkout in directory and return the CVEs whose advisories changed.
+
+        Returns (affected CVE IDs, number of advisories read, number of advisories removed, number of advisories
+        that could not be read). An advisory that could not be read is left out of the index and read again by the next refresh.
+        """
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self.connection.execute("SELECT path, size, mtime_ns FROM advisories")}
+        changed = {}
+        for filepath, size, mtime_ns in iter_advisory_files(directory):
+            if known.pop(filepath, None) != (size, mtime_ns):
+                changed[filepath] = (size, mtime_ns)
+        removed = list(known)
+
+        # the CVEs an advisory aliased before it changed or disappeared lose or update its section too
+        affected_cve_ids = self.cve_ids_of(list(changed) + removed)
+        self.remove(list(changed) + removed)
+        failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for filepath, (advisory, error) in zip(changed, executor.map(read_advisory_or_error, changed)):
+                if error is not None:
+                    print(f"Skipping the advisory {filepath}: {error!r}")
+                    failed += 1
+                    continue
+                advisory_id, cve_ids, section = advisory
+                size, mtime_ns = changed[filepath]
+                self.connection.execute(
+                    "INSERT INTO advisories (path, advisory_id, size, mtime_ns, section) VALUES (?, ?, ?, ?, ?)",
+                    (filepath, advisory_id, size, mtime_ns, json.dumps(section))
+                )
+                self.connection.executemany("INSERT INTO aliases (cve_id, path) VALUES (?, ?)", [(cve_id, filepath) for cve_id in cve_ids])
+                affected_cve_ids.update(cve_ids)
+        return affected_cve_ids, len(changed) - failed, len(removed), failed
+
+    def cve_ids(self):
+        return {row[0] for row in self.connection.execute("SELECT DISTINCT cve_id FROM aliases")}
+
+    def sections(self, cve_ids):
+        """Map every CVE of cve_ids to its github section, {advisory ID: advisory section}, or None when no advisory aliases it."""
+        cve_ids = list(cve_ids)
+        sections = {cve_id: None for cve_id in cve_ids}
+        rows = select_in_chunks(
+            self.connection,
+            "SELECT aliases.cve_id, advisories.advisory_id, advisories.section FROM aliases"
+            " JOIN advisories ON advisories.path = aliases.path"
+            " WHERE aliases.cve_id IN ({placeholders}) ORDER BY advisories.advisory_id",
+            cve_ids
+        )
+        for cve_id, advisory_id, section in rows:
+            if sections[cve_id] is None:
+                sections[cve_id] = {}
+            sections[cve_id][advisory_id] = json.loads(section)
+        return sections
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    # python github_advisories.py <CVE ID>, looks a CVE up in the index of the last aggregation
+    if len(sys.argv) != 2:
+        print("usage: python github_advisories.py <CVE ID>")
+        sys.exit(1)
+    index = AdvisoryIndex()
+    section = index.sections([sys.argv[1]])[sys.argv[1]]
+    index.close()
+    if section is None:
+        print(f"no advisory aliases {sys.argv[1]}")
+        sys.exit(1)
+    print(json.dumps(section, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import re
+from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
+from bs4 import Tag
+import soupsieve
+from normalize import clean_fields
+
+
+# the parsing of the Aqua and IBM X-Force pages saved by the collectors. data_aggregator imports it only when
+# it aggregates pages, the other sources do not wait for BeautifulSoup to be imported
+
+# only the two divs used by extract_subtitle and extract_important_info are built by the parser
+AQUA_PARSE_ONLY = SoupStrainer("div", class_=["header_title_wrap", "content vulnerability_content"])
+
+# the description and remedy paragraphs are the ones IBM_collector.save_html waits for, the severity and the
+# CVSS base score are shown in the score box of the rendered page. Compiled once instead of on every select
+IBM_DESCRIPTION_SELECTOR = soupsieve.compile("p.description:not([class*=' '])")
+IBM_REMEDY_SELECTOR = soupsieve.compile("p[class~='detailsline'][class~='description']")
+IBM_SEVERITY_SELECTOR = soupsieve.compile("span.severity")
+IBM_SCORE_SELECTOR = soupsieve.compile("span.scorenumber")
+# only the elements matched by the selectors above are built by the parser, keep both in sync. The strainer sees
+# the class attribute as one string, e.g. "detailsline description", so the classes are matched as words
+IBM_PARSE_ONLY = SoupStrainer(["p", "span"], class_=re.compile(r"(^|\s)(description|severity|scorenumber)(\s|$)"))
+
+
+def parse_html(html_content, parser='html.parser', parse_only=None):
+    # Parse the HTML content using BeautifulSoup
+    soup = BeautifulSoup(html_content, parser, parse_only=parse_only)
+    return soup
+
+
+def extract_subtitle(parsed_html):
+    headers = parsed_html.find_all("div", class_="header_title_wrap")
+    if len(headers) != 1:
+        print("There is a problem with finding the headers")
+        raise Exception
+    header = headers[0]
+    subtitles = header.find_all("h2", class_="subtitle page_subtitle fadeInUp animationDelay_2")
+    if len(subtitles) > 1:
+        print("There is a problem with finding the subtitle in headers")
+        raise Exception
+    elif len(subtitles) == 0:
+        return ""
+    subtitle_text = subtitles[0].text
+    return subtitle_text
+
+
+def extract_important_info(parsed_html):
+    vul_contents = parsed_html.find_all("div", class_="content vulnerability_content")
+    if len(vul_contents) != 1:
+        print("something wrong with finding vul_content")
+        raise Exception
+    vul_content_div = vul_contents[0]
+
+    important_info = {}
+    current_info = "Basic Description"
+    for child in vul_content_div.children:
+        if current_info not in important_info:
+            important_info[current_info] = []
+
+        if isinstance(child, Tag) and child.name == "h3":
+            current_info = child.text
+            continue
+
+        important_info[current_info].append(child.get_text())
+
+    for key in important_info:
+        important_info[key] = " ".join(important_info[key])
+    return clean_fields(important_info)
+
+
+def extract_aqua_details_from_soup(parsed_html):
+    subtitle = extract_subtitle(parsed_html)
+    aqua_cve_details = extract_important_info(parsed_html)
+    aqua_cve_details['subtitle'] = subtitle
+    return aqua_cve_details
+
+
+def select_text(selector, parsed_html):
+    # the first match, the collector only accepts pages with a single description anyway
+    element = selector.select_one(parsed_html)
+    return element.get_text() if element is not None else ""
+
+
+def has_text(selector, parsed_html):
+    # what IBM_collector.wait_for_content waits for: exactly one element, with text
+    elements = selector.select(parsed_html)
+    return len(elements) == 1 and elements[0].get_text().strip() != ""
+
+
+def ibm_page_content(html_content, parser='html.parser'):
+    """(has description, has remedy) of a saved IBM page, as IBM_collector.save_html found them when saving it."""
+    parsed_html = parse_html(html_content, parser, IBM_PARSE_ONLY)
+    return has_text(IBM_DESCRIPTION_SELECTOR, parsed_html), has_text(IBM_REMEDY_SELECTOR, parsed_html)
+
+
+def extract_ibm_details_from_soup(parsed_html):
+    ibm_cve_details = {
+        "description": select_text(IBM_DESCRIPTION_SELECTOR, parsed_html),
+        "remedy": select_text(IBM_REMEDY_SELECTOR, parsed_html),
+        "severity": select_text(IBM_SEVERITY_SELECTOR, parsed_html),
+        "score": select_text(IBM_SCORE_SELECTOR, parsed_html),
+    }
+    return clean_fields(ibm_cve_details)
@@ -0,0 +1,140 @@
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+HTTP_CACHE_FILE = "http_cache.sqlite"
+# the cache is committed after this many responses, and when it is closed
+COMMIT_EVERY = 200
+
+# what a refresh of a URL found
+NEW = "new"
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+NOT_MODIFIED = "not_modified"
+
+
+def content_hash(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+class HttpCache:
+    """ETag, Last-Modified and content hash of the last response of every URL a collector saved.
+
+    Refreshing a saved page sends the validators of its last response as If-None-Match and
+    If-Modified-Since. A 304, or a 200 whose body has the same hash, means the saved page is current
+    and does not have to be written again, so its file keeps its mtime and the incremental
+    aggregation does not look at it. What every refresh found is kept for the change report.
+    It can be shared by the threads of a collector.
+    """
+
+    def __init__(self, filepath=HTTP_CACHE_FILE):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT,"
+            " sha256 TEXT NOT NULL, size INTEGER NOT NULL, fetched_at REAL NOT NULL, changed_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+        self.uncommitted = 0
+        self.changes = {NEW: [], CHANGED: [], UNCHANGED: [], NOT_MODIFIED: []}
+
+    def request_headers(self, url):
+        """The conditional headers for a URL whose page is saved, empty when it was never fetched."""
+        with self.lock:
+            row = self.connection.execute("SELECT etag, last_modified FROM responses WHERE url = ?", (url,)).fetchone()
+        headers = {}
+        if row is not None and row[0]:
+            headers["If-None-Match"] = row[0]
+        if row is not None and row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def compare(self, url, sha256):
+        """NEW, CHANGED or UNCHANGED, for a body of the URL with the given content_hash."""
+        with self.lock:
+            row = self.connection.execute("SELECT sha256 FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return NEW
+        return UNCHANGED if row[0] == sha256 else CHANGED
+
+    def store(self, url, headers, sha256, size, status):
+        """Record a 200 response once its page is saved, status is what compare returned for it."""
+        now = time.time()
+        with self.lock:
+            if status == UNCHANGED:
+                # the validators can change without the content, e.g. a regenerated page
+                self.connection.execute(
+                    "UPDATE responses SET etag = ?, last_modified = ?, fetched_at = ? WHERE url = ?",
+                    (headers.get("ETag"), headers.get("Last-Modified"), now, url)
+                )
+            else:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO responses (url, etag, last_modified, sha256, size, fetched_at, changed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (url, headers.get("ETag"), headers.get("Last-Modified"), sha256, size, now, now)
+                )
+            self.changes[status].append(url)
+            self.committed_later()
+
+    def not_modified(self, url):
+        """Record a 304 response."""
+        with self.lock:
+            self.connection.execute("UPDATE responses SET fetched_at = ? WHERE url = ?", (time.time(), url))
+            self.changes[NOT_MODIFIED].append(url)
+            self.committed_later()
+
+    def committed_later(self):
+        # called with the lock held
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY:
+            self.connection.commit()
+            self.uncommitted = 0
+
+    def report(self, names=None):
+        """What the refreshes since the last report found and start a new one.
+
+        The new and changed URLs are listed, by their names in `names` ({URL: name}) when given,
+        the unchanged and not modified ones are only counted.
+        """
+        with self.lock:
+            changes = self.changes
+            self.changes = {NEW: [], CHANGED: [], UNCHANGED: [], NOT_MODIFIED: []}
+        names = names or {}
+        return {
+            NEW: sorted(names.get(url, url) for url in changes[NEW]),
+            CHANGED: sorted(names.get(url, url) for url in changes[CHANGED]),
+            UNCHANGED: len(changes[UNCHANGED]),
+            NOT_MODIFIED: len(changes[NOT_MODIFIED]),
+        }
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+def main():
+    # python http_cache.py [cache file], how many URLs are cached and when they last changed
+    cache = HttpCache(sys.argv[1] if len(sys.argv) > 1 else HTTP_CACHE_FILE)
+    with cache.lock:
+        count, size, with_validators, last_changed = cache.connection.execute(
+            "SELECT COUNT(*), SUM(size), SUM(etag IS NOT NULL OR last_modified IS NOT NULL), MAX(changed_at) FROM responses"
+        ).fetchone()
+    cache.close()
+    print(f"{count} URLs cached, {size or 0} bytes, {with_validators or 0} of them with an ETag or Last-Modified")
+    if last_changed is not None:
+        print(f"last change seen at {time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(last_changed))}")
+
+
+if __name__ == "__main__":
+    main()
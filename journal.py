@@ -0,0 +1,123 @@
+import sys
+import json
+import time
+import threading
+import traceback
+from atomic_file import write_atomically
+
+
+RUN_JOURNAL_FILE = "aggregation_journal.json"
+# a checkpoint is saved at most this often, every save first waits for the pending output to be written
+CHECKPOINT_INTERVAL = 30
+
+
+class Failure:
+    """Stands in for the section of an input that could not be aggregated, it can be sent back from a worker process."""
+
+    def __init__(self, error, traceback_text):
+        self.error = error
+        self.traceback = traceback_text
+
+    @classmethod
+    def from_exception(cls, exception):
+        return cls(repr(exception), "".join(traceback.format_exception(type(exception), exception, exception.__traceback__)))
+
+
+class RunJournal:
+    """Progress of the aggregation runs and the inputs they could not aggregate.
+
+    The progress of a run is kept per year: "done" or the CVE ID of the last input of the year whose
+    record is written. A run that was killed is resumed from there by the next run of
+    the same name. Failing inputs are quarantined with their traceback instead of stopping the run,
+    until they are aggregated successfully, e.g. by retrying them after a fix.
+    """
+
+    def __init__(self, filepath=RUN_JOURNAL_FILE):
+        self.filepath = filepath
+        self.lock = threading.RLock()
+        self.last_saved = 0
+        try:
+            with open(filepath, 'r') as file:
+                self.data = json.load(file)
+        except FileNotFoundError:
+            self.data = {"runs": {}, "quarantine": {}}
+
+    def save(self):
+        with self.lock:
+            write_atomically(self.filepath, json.dumps(self.data, indent=4))
+            self.last_saved = time.monotonic()
+
+    def progress(self, run):
+        """The progress of an unfinished run, {year: "done" or last CVE ID written}, empty to start from scratch."""
+        with self.lock:
+            return dict(self.data["runs"].get(run, {}))
+
+    def checkpoint(self, run, year, position, flush=None, force=False):
+        """Record that the inputs of the year up to the one of the CVE ID `position` are written.
+
+        The journal is saved when CHECKPOINT_INTERVAL passed since the last save, or with force, after
+        calling flush, which should make every output written so far durable.
+        """
+        with self.lock:
+            self.data["runs"].setdefault(run, {})[year] = position
+            if not force and time.monotonic() - self.last_saved < CHECKPOINT_INTERVAL:
+                return
+        if flush is not None:
+            flush()
+        self.save()
+
+    def complete_year(self, run, year, flush=None):
+        self.checkpoint(run, year, "done", flush, force=True)
+
+    def finish(self, run):
+        """Forget the progress of a run that went through every year, the next one starts from scratch."""
+        with self.lock:
+            self.data["runs"].pop(run, None)
+        self.save()
+
+    def quarantine(self, source, year, cve_id, source_input, failure):
+        with self.lock:
+            self.data["quarantine"].setdefault(source, {})[cve_id] = {
+                "year": year,
+                "input": source_input,
+                "error": failure.error,
+                "traceback": failure.traceback,
+                "quarantined_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+
+    def release(self, source, cve_id):
+        """Take an input out of the quarantine once it was aggregated, returns whether it was quarantined."""
+        with self.lock:
+            quarantined = self.data["quarantine"].get(source, {})
+            if cve_id not in quarantined:
+                return False
+            del quarantined[cve_id]
+            if not quarantined:
+                del self.data["quarantine"][source]
+            return True
+
+    def quarantined(self, source):
+        """{CVE ID: entry} of the quarantined inputs of a source."""
+        with self.lock:
+            return dict(self.data["quarantine"].get(source, {}))
+
+    def quarantined_sources(self):
+        with self.lock:
+            return sorted(self.data["quarantine"])
+
+
+def main():
+    # python journal.py [source], lists the quarantined inputs with their error, and their traceback for one source
+    journal = RunJournal()
+    sources = sys.argv[1:] or journal.quarantined_sources()
+    for run, progress in journal.data["runs"].items():
+        print(f"unfinished run {run}: {progress}")
+    for source in sources:
+        for cve_id, entry in sorted(journal.quarantined(source).items()):
+            print(f"{source}\t{entry['year']}\t{cve_id}\t{entry['error']}")
+            if sys.argv[1:]:
+                print(entry["traceback"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import os
+import json
+import hashlib
+from atomic_file import write_atomically
+
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def load_manifest(filepath):
+    try:
+        with open(filepath, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"files": {}}
+
+
+def save_manifest(manifest, filepath):
+    write_atomically(filepath, json.dumps(manifest))
+
+
+def hash_file(filepath):
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def hash_record(record):
+    serialized = json.dumps(record, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(serialized).hexdigest()
+
+
+def fingerprint(filepath, previous_entry=None):
+    """Return the manifest entry of a file and whether its content changed since previous_entry.
+
+    The content is only hashed when the size or the modification time differ from the previous entry.
+    """
+    stat = os.stat(filepath)
+    if previous_entry is not None and previous_entry['size'] == stat.st_size and previous_entry['mtime'] == stat.st_mtime_ns:
+        return previous_entry, False
+
+    entry = dict(previous_entry or {})
+    entry['size'] = stat.st_size
+    entry['mtime'] = stat.st_mtime_ns
+    entry['sha256'] = hash_file(filepath)
+    changed = previous_entry is None or previous_entry['sha256'] != entry['sha256']
+    return entry, changed
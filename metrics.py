@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from atomic_file import write_atomically
+
+
+METRIC_PREFIX = "cve_data"
+LATENCY_QUANTILES = [0.5, 0.9, 0.99]
+
+
+def quantile(sorted_values, q):
+    # nearest rank, the samples are already sorted
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class Metrics:
+    """Stage timers, counters and latency samples of one program run, they can be shared by several threads.
+
+    Stages and counters are named "<source>.<what>", e.g. the stage "aqua.parse" or the counter "nvd.bytes_read".
+    """
+
+    def __init__(self, program):
+        self.program = program
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.counters = {}
+        # stage name: [total seconds, calls]
+        self.stages = {}
+        self.latencies = {}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, stage, seconds, calls=1):
+        with self.lock:
+            totals = self.stages.setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += calls
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed_iter(self, stage, iterable):
+        """Yield from iterable, adding the time spent producing each item to stage."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start, calls=0)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def observe(self, name, seconds):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def merge(self, measurements):
+        """Add the {"stages": {stage: seconds}, "counters": {name: value}} measured in a worker process."""
+        for stage, seconds in measurements.get("stages", {}).items():
+            self.add_time(stage, seconds)
+        for name, value in measurements.get("counters", {}).items():
+            self.count(name, value)
+
+    def summary(self):
+        with self.lock:
+            latencies = {}
+            for name, samples in self.latencies.items():
+                samples = sorted(samples)
+                latencies[name] = {
+                    "count": len(samples),
+                    "sum": sum(samples),
+                    "max": samples[-1],
+                    "quantiles": {str(q): quantile(samples, q) for q in LATENCY_QUANTILES},
+                }
+            return {
+                "program": self.program,
+                "started_at": self.started_at,
+                "elapsed_seconds": time.time() - self.started_at,
+                "stages": {stage: {"seconds": seconds, "calls": calls} for stage, (seconds, calls) in sorted(self.stages.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "latencies": latencies,
+            }
+
+    def prometheus_text(self):
+        """The summary in the Prometheus text format, for the textfile collector of node_exporter."""
+        summary = self.summary()
+        program = summary["program"]
+        lines = [
+            f"# TYPE {METRIC_PREFIX}_run_elapsed_seconds gauge",
+            f'{METRIC_PREFIX}_run_elapsed_seconds{{program="{program}"}} {summary["elapsed_seconds"]}',
+            f"# TYPE {METRIC_PREFIX}_stage_seconds_total counter",
+        ]
+        for stage, totals in summary["stages"].items():
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_total{{program="{program}",stage="{stage}"}} {totals["seconds"]}')
+        lines.append(f"# TYPE {METRIC_PREFIX}_stage_calls_total counter")
+        for stage, totals in summary["stages"].items():
+            lines.append(f'{METRIC_PREFIX}_stage_calls_total{{program="{program}",stage="{stage}"}} {totals["calls"]}')
+        lines.append(f"# TYPE {METRIC_PREFIX}_events_total counter")
+        for name, value in summary["counters"].items():
+            lines.append(f'{METRIC_PREFIX}_events_total{{program="{program}",name="{name}"}} {value}')
+        lines.append(f"# TYPE {METRIC_PREFIX}_latency_seconds summary")
+        for name, latency in summary["latencies"].items():
+            labels = f'program="{program}",name="{name}"'
+            for q, value in latency["quantiles"].items():
+                lines.append(f'{METRIC_PREFIX}_latency_seconds{{{labels},quantile="{q}"}} {value}')
+            lines.append(f"{METRIC_PREFIX}_latency_seconds_sum{{{labels}}} {latency['sum']}")
+            lines.append(f"{METRIC_PREFIX}_latency_seconds_count{{{labels}}} {latency['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory):
+        """Write <program>.json and <program>.prom to directory, replacing the files of the previous run."""
+        os.makedirs(directory, exist_ok=True)
+        filepath = os.path.join(directory, self.program)
+        write_atomically(filepath + ".json", json.dumps(self.summary(), indent=4))
+        # the textfile collector may read the file at any time, so it is never seen half written
+        write_atomically(filepath + ".prom", self.prometheus_text())
+        return filepath + ".json", filepath + ".prom"
+
+
+def print_summary(summary, file=sys.stdout):
+    """Print the stages slowest first with their share of the run, and the counters."""
+    total = sum(totals["seconds"] for totals in summary["stages"].values()) or 1
+    print(f"{'stage':<24}{'seconds':>10}{'share':>8}{'calls':>10}", file=file)
+    for stage, totals in sorted(summary["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        print(f"{stage:<24}{totals['seconds']:>10.2f}{totals['seconds'] / total:>8.1%}{totals['calls']:>10}", file=file)
+    for name, value in summary["counters"].items():
+        print(f"{name:<24}{value:>10}", file=file)
+    for name, latency in summary["latencies"].items():
+        quantiles = ", ".join(f"p{float(q) * 100:g} {value * 1000:.0f} ms" for q, value in latency["quantiles"].items())
+        print(f"{name:<24}{latency['count']:>10} requests, {quantiles}, max {latency['max'] * 1000:.0f} ms", file=file)
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("usage: python metrics.py <summary json>")
+        sys.exit(1)
+    with open(sys.argv[1], 'r') as file:
+        print_summary(json.load(file))
+
+
+if __name__ == "__main__":
+    main()
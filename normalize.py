@@ -0,0 +1,39 @@
+# short values such as priorities and severities repeat in almost every record, they are cleaned once
+MEMO_MAX_LENGTH = 64
+MEMO_MAX_SIZE = 10000
+
+memo = {}
+
+
+def clean_string(input_string):
+    if len(input_string) <= MEMO_MAX_LENGTH:
+        cleaned = memo.get(input_string)
+        if cleaned is None:
+            if len(memo) >= MEMO_MAX_SIZE:
+                memo.clear()
+            cleaned = memo[input_string] = clean_uncached(input_string)
+        return cleaned
+    return clean_uncached(input_string)
+
+
+def clean_uncached(input_string):
+    # for an ASCII string, str.split() splits on exactly the characters matched by the regex \s, so this is
+    # re.sub(r'\s+', ' ', input_string).strip() without the regex engine
+    if not input_string.isascii():
+        input_string = input_string.encode("ascii", "ignore").decode("ascii")
+    return " ".join(input_string.split())
+
+
+def clean_strings(strings):
+    """Clean a list, or any other iterable, of strings in one call and return the cleaned list."""
+    return [clean_string(value) for value in strings]
+
+
+def clean_fields(details, keys=None):
+    """Clean the string values of a dict in place, only the given keys when keys is not None, and return it.
+
+    Values that are not strings, e.g. the nested CVSS dicts of Red Hat, are left as they are.
+    """
+    string_keys = [key for key in (details.keys() if keys is None else keys) if isinstance(details[key], str)]
+    details.update(zip(string_keys, clean_strings(details[key] for key in string_keys)))
+    return details
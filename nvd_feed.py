@@ -0,0 +1,91 @@
+import json
+import re
+
+
+# number of characters (or bytes for the ID only reader) read from the feed at once
+CHUNK_SIZE = 1 << 20
+
+CVE_ITEMS_PATTERN = re.compile(r'"CVE_Items"\s*:\s*\[')
+SEPARATORS_PATTERN = re.compile(r'[\s,]*')
+CVE_ID_PATTERN = re.compile(rb'"CVE_data_meta"\s*:\s*\{[^{}]*?"ID"\s*:\s*"([^"]+)"')
+# the ID of a record is always close to its CVE_data_meta key, this much is kept between two chunks
+CVE_ID_OVERLAP = 4096
+
+decoder = json.JSONDecoder()
+
+
+def seek_to_cve_items(file, chunk_size=CHUNK_SIZE):
+    """Read the feed until the opening bracket of CVE_Items.
+
+    Returns the text read so far and the position right after the bracket.
+    """
+    buffer = ""
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            raise ValueError(f"{file.name} does not have a CVE_Items list")
+        buffer += chunk
+        match = CVE_ITEMS_PATTERN.search(buffer)
+        if match is not None:
+            return buffer, match.end()
+
+
+def read_feed_metadata(filepath, chunk_size=CHUNK_SIZE):
+    """Return the header fields of a feed, e.g. CVE_data_timestamp, without decoding its records.
+
+    The fields come before CVE_Items in the feeds published by NVD.
+    """
+    with open(filepath, 'r', encoding='utf-8') as file:
+        buffer, position = seek_to_cve_items(file, chunk_size)
+    match = CVE_ITEMS_PATTERN.search(buffer)
+    header = buffer[:match.start()].rstrip().rstrip(",")
+    return json.loads(header + "}")
+
+
+def iter_cve_items(filepath, chunk_size=CHUNK_SIZE):
+    """Yield the records of CVE_Items one by one without loading the whole feed.
+
+    Only the record being decoded and one chunk of the file are kept in memory.
+    """
+    with open(filepath, 'r', encoding='utf-8') as file:
+        buffer, position = seek_to_cve_items(file, chunk_size)
+        end_of_file = False
+        while True:
+            position = SEPARATORS_PATTERN.match(buffer, position).end()
+            if position < len(buffer) and buffer[position] == ']':
+                return
+
+            try:
+                if position == len(buffer):
+                    raise json.JSONDecodeError("Expecting value", buffer, position)
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the record continues in the next chunk
+                if end_of_file:
+                    raise
+                chunk = file.read(chunk_size)
+                end_of_file = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+
+            yield item
+
+
+def iter_cve_ids(filepath, chunk_size=CHUNK_SIZE):
+    """Yield only the CVE IDs of a feed, in feed order.
+
+    The records are never decoded, the IDs are picked out of the raw bytes.
+    """
+    with open(filepath, 'rb') as file:
+        buffer = b""
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+            last_end = 0
+            for match in CVE_ID_PATTERN.finditer(buffer):
+                yield match.group(1).decode('ascii')
+                last_end = match.end()
+            buffer = buffer[max(last_end, len(buffer) - CVE_ID_OVERLAP):]
@@ -0,0 +1,603 @@
+import os
+import sys
+import copy
+import json
+import queue
+import zlib
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+from sqlite_chunks import SQLITE_QUERY_CHUNK, select_in_chunks
+
+
+AGGREGATED_CVES_FOLDER = "CVES"
+AGGREGATED_DB_FILE = "CVES.sqlite"
+# the distinct texts of a DedupStore, shared by both backends
+AGGREGATED_TEXTS_FILE = "CVES.texts.sqlite"
+# the manifest of the inputs aggregated into the output, next to it
+MANIFEST_FILENAME = "manifest.json"
+# batches handed to the background thread of WriteBehindStore before put_many blocks
+WRITE_BEHIND_BATCHES = 4
+COMPACT_SEPARATORS = (",", ":")
+# strings at least this long are stored once by DedupStore, a reference to a shorter one would not be smaller
+DEDUP_MIN_LENGTH = 48
+# a stored text is replaced by {"$text": <hash>} in the record
+TEXT_REFERENCE_KEY = "$text"
+# hex digits of the SHA-256 of a text kept as its hash, 80 bits
+TEXT_HASH_LENGTH = 20
+# the stored texts are zlib compressed at this level
+TEXT_COMPRESSION_LEVEL = 6
+
+
+def year_of(cve_id):
+    # CVE-<year>-<number>, which is also how the NVD feeds are split per year
+    return cve_id.split("-")[1]
+
+
+def fsync_directory(directory):
+    # makes the renames in the directory durable
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class JsonFileStore:
+    """The aggregated records as one <folder>/<year>/<CVE>.json file each.
+
+    A record is written to a temporary file that is renamed over the old one, so a crash never leaves
+    a truncated record behind. compact=True writes the JSON without indentation and spaces, which is
+    smaller and a lot faster to serialize. With fsync=True the records of a batch are flushed to disk
+    before they are renamed, followed by a single fsync of the directory per batch.
+    """
+
+    # separate files, so reads and writes can happen from different threads
+    thread_safe = True
+
+    def __init__(self, folder=AGGREGATED_CVES_FOLDER, indent=4, compact=False, fsync=False):
+        self.folder = folder
+        self.indent = None if compact else indent
+        self.separators = COMPACT_SEPARATORS if compact else None
+        self.fsync = fsync
+        self.manifest_filepath = os.path.join(folder, MANIFEST_FILENAME)
+        os.makedirs(folder, exist_ok=True)
+
+    def record_filepath(self, year, cve_id):
+        return os.path.join(self.folder, year, f"{cve_id}.json")
+
+    def get(self, year, cve_id):
+        try:
+            with open(self.record_filepath(year, cve_id), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def get_many(self, year, cve_ids):
+        return {cve_id: self.get(year, cve_id) for cve_id in cve_ids}
+
+    def put_many(self, year, records):
+        """Write the records and return the number of bytes written."""
+        year_directory = os.path.join(self.folder, year)
+        os.makedirs(year_directory, exist_ok=True)
+        written = 0
+        renames = []
+        for cve_id, record in records.items():
+            filepath = self.record_filepath(year, cve_id)
+            # ASCII only, so the length is also the size in bytes
+            content = json.dumps(record, indent=self.indent, separators=self.separators)
+            with open(filepath + ".tmp", 'w') as file:
+                file.write(content)
+                if self.fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            renames.append((filepath + ".tmp", filepath))
+            written += len(content)
+        for temp_filepath, filepath in renames:
+            os.replace(temp_filepath, filepath)
+        if self.fsync and renames:
+            fsync_directory(year_directory)
+        return written
+
+    def delete_many(self, year, cve_ids):
+        for cve_id in cve_ids:
+            try:
+                os.remove(self.record_filepath(year, cve_id))
+            except FileNotFoundError:
+                pass
+
+    def years(self):
+        return sorted(name for name in os.listdir(self.folder) if os.path.isdir(os.path.join(self.folder, name)))
+
+    def lookup(self, cve_id):
+        """Find a record without knowing its year, returns (year, record) or None."""
+        guessed_year = year_of(cve_id)
+        for year in [guessed_year] + [year for year in self.years() if year != guessed_year]:
+            if os.path.exists(self.record_filepath(year, cve_id)):
+                return year, self.get(year, cve_id)
+        return None
+
+    def iter_records(self, year=None):
+        """Yield (year, CVE ID, record) for every record, or only for the records of year."""
+        for record_year in ([year] if year is not None else self.years()):
+            year_directory = os.path.join(self.folder, record_year)
+            if not os.path.isdir(year_directory):
+                continue
+            for filename in sorted(os.listdir(year_directory)):
+                if filename.endswith(".json"):
+                    cve_id = filename[:-len(".json")]
+                    yield record_year, cve_id, self.get(record_year, cve_id)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteStore:
+    """The aggregated records in a single SQLite database, indexed by CVE ID and year.
+
+    Every batch is one transaction, with fsync=True it is synced to disk when it commits.
+    """
+
+    # one connection, WriteBehindStore serializes the calls made from its thread and from the caller's
+    thread_safe = False
+
+    def __init__(self, filepath=AGGREGATED_DB_FILE, compact=False, fsync=False):
+        self.filepath = filepath
+        self.manifest_filepath = f"{filepath}.{MANIFEST_FILENAME}"
+        self.separators = COMPACT_SEPARATORS if compact else None
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cves (cve_id TEXT PRIMARY KEY, year TEXT NOT NULL, record TEXT NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS cves_year ON cves (year)")
+        self.connection.commit()
+
+    def get(self, year, cve_id):
+        return self.get_many(year, [cve_id])[cve_id]
+
+    def get_many(self, year, cve_ids):
+        cve_ids = list(cve_ids)
+        records = {cve_id: {} for cve_id in cve_ids}
+        rows = select_in_chunks(self.connection, "SELECT cve_id, record FROM cves WHERE year = ? AND cve_id IN ({placeholders})",
+                                cve_ids, [year])
+        for cve_id, record in rows:
+            records[cve_id] = json.loads(record)
+        return records
+
+    def put_many(self, year, records):
+        """Write the records and return the number of bytes written."""
+        rows = [(cve_id, year, json.dumps(record, separators=self.separators)) for cve_id, record in records.items()]
+        # one transaction per batch
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO cves (cve_id, year, record) VALUES (?, ?, ?)", rows)
+        return sum(len(row[2]) for row in rows)
+
+    def delete_many(self, year, cve_ids):
+        with self.connection:
+            self.connection.executemany("DELETE FROM cves WHERE year = ? AND cve_id = ?", [(year, cve_id) for cve_id in cve_ids])
+
+    def years(self):
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT year FROM cves ORDER BY year")]
+
+    def lookup(self, cve_id):
+        """Find a record without knowing its year, returns (year, record) or None."""
+        row = self.connection.execute("SELECT year, record FROM cves WHERE cve_id = ?", (cve_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def iter_records(self, year=None):
+        """Yield (year, CVE ID, record) for every record, or only for the records of year."""
+        if year is None:
+            rows = self.connection.execute("SELECT year, cve_id, record FROM cves ORDER BY year, cve_id")
+        else:
+            rows = self.connection.execute("SELECT year, cve_id, record FROM cves WHERE year = ? ORDER BY cve_id", (year,))
+        for record_year, cve_id, record in rows:
+            yield record_year, cve_id, json.loads(record)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.connection.close()
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:TEXT_HASH_LENGTH]
+
+
+def find_references(value, references):
+    """Append the (container, key, hash) of every text reference in a record read from a DedupStore to references.
+
+    The short strings found on the way are interned in place, so the labels repeated in every record
+    such as the priorities, severities and CWEs are shared by all the records in memory.
+    """
+    for key, item in (value.items() if isinstance(value, dict) else enumerate(value)):
+        if isinstance(item, str):
+            if len(item) < DEDUP_MIN_LENGTH:
+                value[key] = sys.intern(item)
+        elif isinstance(item, dict):
+            if len(item) == 1 and TEXT_REFERENCE_KEY in item:
+                references.append((value, key, item[TEXT_REFERENCE_KEY]))
+            else:
+                find_references(item, references)
+        elif isinstance(item, list):
+            find_references(item, references)
+
+
+class DedupStore:
+    """Wraps an output store so that every distinct text is stored once, in a SQLite table keyed by its hash.
+
+    The NVD, Ubuntu, Red Hat and Aqua descriptions of a CVE are often the same text, and so are many
+    notes and statements across CVEs. Strings of at least DEDUP_MIN_LENGTH characters are replaced by
+    {"$text": <hash>} in the records handed to the wrapped store, and the references are expanded
+    again when records are read. The shorter strings, e.g. the priorities, severities and CWEs, stay
+    in the record since a reference would be longer than them, they are interned when they are read.
+    The stored texts are zlib compressed.
+    The texts of a batch are committed before its records are written, so a record never refers to a
+    missing text. A text that is not referred to any more stays until prune removes it.
+    """
+
+    # one connection, like SqliteStore
+    thread_safe = False
+
+    def __init__(self, store, filepath=AGGREGATED_TEXTS_FILE, fsync=False):
+        self.store = store
+        self.manifest_filepath = store.manifest_filepath
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        # size is the length of the text before it was compressed
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS texts (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, text BLOB NOT NULL) WITHOUT ROWID"
+        )
+        self.connection.commit()
+        # a text whose hash is known is not written again
+        self.known_hashes = {row[0] for row in self.connection.execute("SELECT hash FROM texts")}
+
+    def deduplicate(self, value, new_texts):
+        # returns a copy, the records given to put_many may still be used by the caller
+        if isinstance(value, str):
+            if len(value) < DEDUP_MIN_LENGTH:
+                return value
+            digest = text_hash(value)
+            if digest not in self.known_hashes and digest not in new_texts:
+                new_texts[digest] = value
+            return {TEXT_REFERENCE_KEY: digest}
+        if isinstance(value, dict):
+            return {key: self.deduplicate(item, new_texts) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.deduplicate(item, new_texts) for item in value]
+        return value
+
+    def load_texts(self, hashes):
+        texts = {}
+        for digest, text in select_in_chunks(self.connection, "SELECT hash, text FROM texts WHERE hash IN ({placeholders})", hashes):
+            texts[digest] = zlib.decompress(text).decode("utf-8")
+        return texts
+
+    def expand(self, records):
+        """Replace the text references of the records in place, with one query for all of them."""
+        references = []
+        for record in records:
+            find_references(record, references)
+        texts = self.load_texts({digest for _, _, digest in references})
+        for container, key, digest in references:
+            if digest not in texts:
+                raise KeyError(f"text {digest} referred to by a record is missing from the texts database")
+            container[key] = texts[digest]
+        return records
+
+    def get(self, year, cve_id):
+        return self.get_many(year, [cve_id])[cve_id]
+
+    def get_many(self, year, cve_ids):
+        records = self.store.get_many(year, cve_ids)
+        self.expand(records.values())
+        return records
+
+    def put_many(self, year, records):
+        """Write the records and return the number of bytes written, the new texts included."""
+        new_texts = {}
+        records = {cve_id: self.deduplicate(record, new_texts) for cve_id, record in records.items()}
+        rows = [(digest, len(text), zlib.compress(text.encode("utf-8"), TEXT_COMPRESSION_LEVEL))
+                for digest, text in new_texts.items()]
+        if rows:
+            with self.connection:
+                self.connection.executemany("INSERT OR IGNORE INTO texts (hash, size, text) VALUES (?, ?, ?)", rows)
+            self.known_hashes.update(new_texts)
+        written = self.store.put_many(year, records)
+        return (written or 0) + sum(len(row[2]) for row in rows)
+
+    def delete_many(self, year, cve_ids):
+        self.store.delete_many(year, cve_ids)
+
+    def years(self):
+        return self.store.years()
+
+    def lookup(self, cve_id):
+        found = self.store.lookup(cve_id)
+        if found is None:
+            return None
+        self.expand([found[1]])
+        return found
+
+    def iter_records(self, year=None, batch_size=SQLITE_QUERY_CHUNK):
+        """Yield (year, CVE ID, record) for every record, the references are expanded batch_size records at a time."""
+        batch = []
+        for item in self.store.iter_records(year):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                self.expand([record for _, _, record in batch])
+                yield from batch
+                batch = []
+        self.expand([record for _, _, record in batch])
+        yield from batch
+
+    def prune(self):
+        """Remove the texts that no record refers to any more, returns how many were removed."""
+        referenced = self.reference_counts()
+        unreferenced = [(digest,) for digest in self.known_hashes if digest not in referenced]
+        with self.connection:
+            self.connection.executemany("DELETE FROM texts WHERE hash = ?", unreferenced)
+        self.known_hashes.difference_update(digest for digest, in unreferenced)
+        return len(unreferenced)
+
+    def reference_counts(self):
+        """{hash: number of references} over every record of the wrapped store."""
+        counts = Counter()
+        for _, _, record in self.store.iter_records():
+            references = []
+            find_references(record, references)
+            counts.update(digest for _, _, digest in references)
+        return counts
+
+    def statistics(self):
+        """{"texts", "references", "referenced_characters", "distinct_characters", "stored_bytes"} over every record.
+
+        referenced_characters / distinct_characters is the dedup ratio, stored_bytes is their compressed size.
+        """
+        sizes = {digest: (size, stored) for digest, size, stored in self.connection.execute("SELECT hash, size, LENGTH(text) FROM texts")}
+        counts = self.reference_counts()
+        return {
+            "texts": len(sizes),
+            "references": sum(counts.values()),
+            "referenced_characters": sum(sizes[digest][0] * count for digest, count in counts.items() if digest in sizes),
+            "distinct_characters": sum(size for size, _ in sizes.values()),
+            "stored_bytes": sum(stored for _, stored in sizes.values()),
+        }
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.close()
+        self.connection.close()
+
+
+class WriteBehindStore:
+    """Wraps an output store so that put_many and delete_many return at once and a background thread writes them.
+
+    At most max_pending batches wait to be written, after that put_many blocks until the thread catches
+    up. Records that are not written yet are served from memory by get_many, so the caller always reads
+    its own writes. An error of the background thread is raised by the next call, and flush returns once
+    everything handed over so far is written.
+    put_many cannot return the number of bytes written, the background thread adds them to the
+    "output.bytes_written" counter of run_metrics instead.
+    """
+
+    def __init__(self, store, max_pending=WRITE_BEHIND_BATCHES, run_metrics=None):
+        self.store = store
+        self.run_metrics = run_metrics
+        self.manifest_filepath = store.manifest_filepath
+        self.batches = queue.Queue(max_pending)
+        # the written but not yet stored records, (year, CVE ID): record or None when it is deleted
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        # stores that are not thread safe are only used by one thread at a time
+        self.store_lock = threading.Lock() if not getattr(store, "thread_safe", False) else None
+        self.error = None
+        self.thread = threading.Thread(target=self.write_batches, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def call_store(self, method, *args):
+        if self.store_lock is None:
+            return getattr(self.store, method)(*args)
+        with self.store_lock:
+            return getattr(self.store, method)(*args)
+
+    def write_batches(self):
+        while True:
+            batch = self.batches.get()
+            try:
+                if batch is None:
+                    return
+                method, year, payload = batch
+                if self.error is None:
+                    written = self.call_store(method, year, payload)
+                    if method == "put_many" and self.run_metrics is not None:
+                        self.run_metrics.count("output.bytes_written", written or 0)
+                with self.pending_lock:
+                    cve_ids = payload.keys() if method == "put_many" else payload
+                    for cve_id in cve_ids:
+                        key = (year, cve_id)
+                        # a later batch may have replaced the record again in the meantime
+                        if key in self.pending and self.pending[key] is (payload[cve_id] if method == "put_many" else None):
+                            del self.pending[key]
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.batches.task_done()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise RuntimeError("writing the output in the background failed") from self.error
+
+    def get(self, year, cve_id):
+        return self.get_many(year, [cve_id])[cve_id]
+
+    def get_many(self, year, cve_ids):
+        self.raise_error()
+        cve_ids = list(cve_ids)
+        records = {}
+        with self.pending_lock:
+            for cve_id in cve_ids:
+                if (year, cve_id) in self.pending:
+                    # a copy, the pending one may be being serialized right now
+                    record = self.pending[(year, cve_id)]
+                    records[cve_id] = copy.deepcopy(record) if record is not None else {}
+        missing = [cve_id for cve_id in cve_ids if cve_id not in records]
+        if missing:
+            records.update(self.call_store("get_many", year, missing))
+        return {cve_id: records[cve_id] for cve_id in cve_ids}
+
+    def put_many(self, year, records):
+        self.raise_error()
+        records = dict(records)
+        with self.pending_lock:
+            for cve_id, record in records.items():
+                self.pending[(year, cve_id)] = record
+        self.batches.put(("put_many", year, records))
+
+    def delete_many(self, year, cve_ids):
+        self.raise_error()
+        cve_ids = list(cve_ids)
+        if not cve_ids:
+            return
+        with self.pending_lock:
+            for cve_id in cve_ids:
+                self.pending[(year, cve_id)] = None
+        self.batches.put(("delete_many", year, cve_ids))
+
+    def flush(self):
+        self.batches.join()
+        self.raise_error()
+        self.call_store("flush")
+
+    def years(self):
+        self.flush()
+        return self.call_store("years")
+
+    def lookup(self, cve_id):
+        self.flush()
+        return self.call_store("lookup", cve_id)
+
+    def iter_records(self, year=None):
+        self.flush()
+        return self.store.iter_records(year)
+
+    def close(self):
+        self.batches.put(None)
+        self.thread.join()
+        self.store.close()
+        self.raise_error()
+
+
+def manifest_path(backend="files"):
+    """The manifest_filepath of the store of backend, to read the manifest without opening the store."""
+    if backend == "files":
+        return os.path.join(AGGREGATED_CVES_FOLDER, MANIFEST_FILENAME)
+    if backend == "sqlite":
+        return f"{AGGREGATED_DB_FILE}.{MANIFEST_FILENAME}"
+    raise ValueError(f"Unknown output backend {backend}, it should be files or sqlite")
+
+
+def open_store(backend="files", compact=False, fsync=False, dedup=None):
+    """The output store of backend, wrapped in a DedupStore when its texts are stored once.
+
+    dedup=None follows the output, which is deduplicated once AGGREGATED_TEXTS_FILE exists, and dedup=True
+    turns it on. dedup=False is refused for a deduplicated output, its records would be read with the
+    references instead of their texts and merged with them.
+    """
+    deduplicated = os.path.exists(AGGREGATED_TEXTS_FILE)
+    if dedup is None:
+        dedup = deduplicated
+    elif not dedup and deduplicated:
+        raise ValueError(f"The output is deduplicated, {AGGREGATED_TEXTS_FILE} exists, it cannot be opened without dedup")
+    if backend == "files":
+        store = JsonFileStore(compact=compact, fsync=fsync)
+    elif backend == "sqlite":
+        store = SqliteStore(compact=compact, fsync=fsync)
+    else:
+        raise ValueError(f"Unknown output backend {backend}, it should be files or sqlite")
+    return DedupStore(store, fsync=fsync) if dedup else store
+
+
+def copy_records(source_store, target_store, batch_size=1000):
+    """Copy every record of source_store to target_store, e.g. to move the existing CVES folder to SQLite."""
+    count = 0
+    batch_year, batch = None, {}
+    for year, cve_id, record in source_store.iter_records():
+        if year != batch_year or len(batch) >= batch_size:
+            if batch:
+                target_store.put_many(batch_year, batch)
+            batch_year, batch = year, {}
+        batch[cve_id] = record
+        count += 1
+    if batch:
+        target_store.put_many(batch_year, batch)
+    return count
+
+
+def deduplicate_store(store, batch_size=1000):
+    """Rewrite every record of the store wrapped by a DedupStore through it, e.g. when dedup is turned on for an existing output."""
+    count = 0
+    for year in store.years():
+        # listed first, the SQLite backend cannot be written while a query over it is still being read
+        cve_ids = [cve_id for _, cve_id, _ in store.store.iter_records(year)]
+        for start in range(0, len(cve_ids), batch_size):
+            store.put_many(year, store.store.get_many(year, cve_ids[start:start + batch_size]))
+        count += len(cve_ids)
+    return count
+
+
+def print_dedup_statistics(store):
+    statistics = store.statistics()
+    distinct_characters = statistics["distinct_characters"] or 1
+    print(f"{statistics['texts']} texts stored, {statistics['references']} references to them")
+    print(f"{statistics['referenced_characters'] / 1e6:.1f}M characters of texts in the records, "
+          f"{statistics['distinct_characters'] / 1e6:.1f}M distinct, dedup ratio "
+          f"{statistics['referenced_characters'] / distinct_characters:.2f}")
+    print(f"{statistics['stored_bytes'] / 1e6:.1f}MB stored compressed, "
+          f"{statistics['referenced_characters'] / (statistics['stored_bytes'] or 1):.2f} times smaller than the texts in the records")
+
+
+def main():
+    # python output_store.py <CVE ID> [files|sqlite]  or  python output_store.py --copy <from> <to>
+    # or  python output_store.py --dedup <files|sqlite> [prune], to deduplicate an output and report the ratio
+    # once CVES.texts.sqlite exists the stores are opened with dedup
+    if len(sys.argv) == 4 and sys.argv[1] == "--copy":
+        source_store, target_store = open_store(sys.argv[2]), open_store(sys.argv[3])
+        print(f"copied {copy_records(source_store, target_store)} records")
+        source_store.close()
+        target_store.close()
+        return
+    if len(sys.argv) in (3, 4) and sys.argv[1] == "--dedup":
+        store = open_store(sys.argv[2], dedup=True)
+        print(f"deduplicated {deduplicate_store(store)} records")
+        if sys.argv[3:4] == ["prune"]:
+            print(f"removed {store.prune()} texts no record refers to")
+        print_dedup_statistics(store)
+        store.close()
+        return
+    if len(sys.argv) < 2:
+        print("usage: python output_store.py <CVE ID> [files|sqlite] | --copy <files|sqlite> <files|sqlite>"
+              " | --dedup <files|sqlite> [prune]")
+        sys.exit(1)
+    store = open_store(sys.argv[2] if len(sys.argv) > 2 else "files")
+    found = store.lookup(sys.argv[1])
+    store.close()
+    if found is None:
+        print(f"{sys.argv[1]} not found")
+        sys.exit(1)
+    print(json.dumps(found[1], indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import os
+import sys
+import mmap
+import zlib
+import threading
+
+
+PACK_EXTENSION = ".pack"
+INDEX_EXTENSION = ".idx"
+COMPRESSION_LEVEL = 6
+
+
+def pack_path(directory, year):
+    return os.path.join(directory, f"{year}{PACK_EXTENSION}")
+
+
+def index_path(pack_filepath):
+    return pack_filepath[:-len(PACK_EXTENSION)] + INDEX_EXTENSION
+
+
+def load_index(pack_filepath):
+    """Read the index of a pack as a dict of CVE ID to (offset, length).
+
+    The index has one "<CVE>\\t<offset>\\t<length>" line per stored page, a page stored again
+    later overrides the previous one and an incomplete last line left by a crash is ignored.
+    """
+    index = {}
+    try:
+        with open(index_path(pack_filepath), 'r') as file:
+            for line in file:
+                fields = line.rstrip("\n").split("\t")
+                if not line.endswith("\n") or len(fields) != 3:
+                    continue
+                index[fields[0]] = (int(fields[1]), int(fields[2]))
+    except FileNotFoundError:
+        pass
+    return index
+
+
+def truncate_incomplete_line(index_filepath):
+    # an entry appended after the incomplete last line left by a crash would be joined to it and lost
+    try:
+        with open(index_filepath, 'rb+') as file:
+            content = file.read()
+            if content and not content.endswith(b"\n"):
+                file.truncate(content.rfind(b"\n") + 1)
+    except FileNotFoundError:
+        pass
+
+
+class PackWriter:
+    """Appends compressed pages to a pack, it can be shared by several threads."""
+
+    def __init__(self, pack_filepath):
+        self.pack_filepath = pack_filepath
+        self.index = load_index(pack_filepath)
+        self.lock = threading.Lock()
+        self.pack_file = open(pack_filepath, 'ab')
+        truncate_incomplete_line(index_path(pack_filepath))
+        self.index_file = open(index_path(pack_filepath), 'a')
+
+    def __contains__(self, cve_id):
+        return cve_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, cve_id, html_content):
+        data = zlib.compress(html_content.encode("utf-8"), COMPRESSION_LEVEL)
+        with self.lock:
+            offset = self.pack_file.seek(0, os.SEEK_END)
+            self.pack_file.write(data)
+            # the page has to be on disk before the index points to it
+            self.pack_file.flush()
+            self.index_file.write(f"{cve_id}\t{offset}\t{len(data)}\n")
+            self.index_file.flush()
+            self.index[cve_id] = (offset, len(data))
+
+    def close(self):
+        self.pack_file.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PackReader:
+    """Random and sequential access to the pages of a pack through mmap."""
+
+    def __init__(self, pack_filepath):
+        self.pack_filepath = pack_filepath
+        self.index = load_index(pack_filepath)
+        self.file = open(pack_filepath, 'rb')
+        # mmap cannot map an empty file
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __contains__(self, cve_id):
+        return cve_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, cve_id):
+        offset, length = self.index[cve_id]
+        return zlib.decompress(self.data[offset:offset + length]).decode("utf-8")
+
+    def keys_in_pack_order(self):
+        # getting the pages in this order reads the pack sequentially
+        return sorted(self.index, key=lambda cve_id: self.index[cve_id][0])
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def convert_directory(directory, pack_filepath, remove_files=False):
+    """Store every <CVE>.html of directory that is not in the pack yet, returns how many were added.
+
+    With remove_files every file is stored and removed, a file of a CVE that is already in the pack
+    is the newer page, which overrides the one of the pack, so it is appended as its newer version.
+    """
+    added = 0
+    with PackWriter(pack_filepath) as writer:
+        for filename in sorted(os.listdir(directory)):
+            filepath = os.path.join(directory, filename)
+            if not filename.endswith(".html") or not os.path.isfile(filepath):
+                continue
+            cve_id = filename.split(".")[0]
+            if cve_id not in writer or remove_files:
+                with open(filepath, 'r', encoding='utf-8') as file:
+                    writer.add(cve_id, file.read())
+                added += 1
+            if remove_files:
+                os.remove(filepath)
+    return added
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("usage: python pack_store.py <html directory> <pack file> [--remove]")
+        sys.exit(1)
+    added = convert_directory(sys.argv[1], sys.argv[2], "--remove" in sys.argv[3:])
+    print(f"added {added} pages to {sys.argv[2]}")
+
+
+if __name__ == "__main__":
+    main()
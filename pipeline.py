@@ -0,0 +1,409 @@
+import os
+import time
+import queue
+import threading
+import functools
+from contextlib import contextmanager
+# imported as a package, its executors are only imported once they are used
+import concurrent.futures
+
+import metrics
+from journal import Failure
+
+
+# batches waiting between two stages, it bounds the memory used when one stage is slower than the others
+PIPELINE_QUEUE_SIZE = 4
+PROCESS_CHUNKSIZE = 16
+
+
+# the measurements of the input this thread is processing, see measuring
+local_measurements = threading.local()
+
+
+@contextmanager
+def measuring():
+    """Collect what record_time and record_count are given in this thread, as the measurements of Metrics.merge.
+
+    parse and extract may run in a worker process, which cannot update the run metrics, so what they
+    measure is sent back with their result and merged by the pipeline.
+    """
+    measurements = {"stages": {}, "counters": {}}
+    previous = getattr(local_measurements, "current", None)
+    local_measurements.current = measurements
+    try:
+        yield measurements
+    finally:
+        local_measurements.current = previous
+
+
+def record_time(stage, seconds):
+    # nothing collects outside of measuring
+    measurements = getattr(local_measurements, "current", None)
+    if measurements is not None:
+        measurements["stages"][stage] = measurements["stages"].get(stage, 0) + seconds
+
+
+def record_count(name, value=1):
+    measurements = getattr(local_measurements, "current", None)
+    if measurements is not None:
+        measurements["counters"][name] = measurements["counters"].get(name, 0) + value
+
+
+class SourcePlugin:
+    """An input of the aggregator, written to the `name` section of every CVE record it has data for.
+
+    discover gives the inputs of a year, either as a dict of CVE ID to input or as an iterable of
+    (CVE ID, input) pairs. parse reads and decodes an input, extract turns the parsed input into the
+    section and merge puts the section into the aggregated record.
+    parse and extract run on `workers`: "process", "thread" or None for the main thread of the
+    pipeline. With "process" the plugin and its inputs are sent to the worker processes, so they have
+    to be picklable, and parse should do the heavy work since its result stays in the worker.
+    An input that fails is quarantined as JSON, restore_input turns it back into an input to retry it.
+    An input of None is not parsed, it removes the section of the plugin from the record.
+    parse and extract can add their own stages and counters with record_time and record_count, the
+    time parse records as "<name>.read" is not counted again in the "<name>.parse" stage.
+    """
+
+    name = None
+    workers = "thread"
+    worker_count = os.cpu_count() or 1
+
+    def discover(self, year):
+        raise NotImplementedError
+
+    def parse(self, cve_id, source_input):
+        return source_input
+
+    def extract(self, cve_id, parsed_input):
+        raise NotImplementedError
+
+    def restore_input(self, source_input):
+        return source_input
+
+    def source_plugins(self):
+        """{name: plugin} of the plugins that parse and extract what discover gives, see MergedSources."""
+        return {self.name: self}
+
+    def source_inputs(self, source_input):
+        # {name: input} of one discovered input
+        return {self.name: source_input}
+
+    def merge(self, record, section):
+        # a plugin can return None to remove its section, e.g. when the input of a CVE is gone
+        if section is None:
+            record.pop(self.name, None)
+        else:
+            record[self.name] = section
+
+    def year_written(self, year, store):
+        """Called by the writer once every record of the year was handed to store, which it can flush first."""
+
+
+class MergedSources(SourcePlugin):
+    """Several plugins in one pass, every CVE record is read and written once with the sections of all of them.
+
+    discover gives {plugin name: input} as the input of a CVE. The inputs of every plugin are parsed and
+    extracted on its own workers, an input that fails is quarantined under the name of its plugin and
+    the other sections of the CVE are still written. The sections are merged in the order of plugins.
+    """
+
+    def __init__(self, name, plugins):
+        self.name = name
+        self.plugins = {plugin.name: plugin for plugin in plugins}
+
+    def source_plugins(self):
+        return self.plugins
+
+    def source_inputs(self, source_input):
+        return source_input
+
+
+class QuarantinedInputs(SourcePlugin):
+    """Runs a plugin on the inputs it quarantined, {year: {CVE ID: input}}, instead of the inputs it discovers."""
+
+    def __init__(self, plugin, inputs_by_year):
+        self.plugin = plugin
+        self.inputs_by_year = inputs_by_year
+        self.name = plugin.name
+        self.workers = plugin.workers
+        self.worker_count = plugin.worker_count
+
+    def discover(self, year):
+        return self.inputs_by_year.get(year, {})
+
+    def parse(self, cve_id, source_input):
+        return self.plugin.parse(cve_id, source_input)
+
+    def extract(self, cve_id, parsed_input):
+        return self.plugin.extract(cve_id, parsed_input)
+
+    def merge(self, record, section):
+        self.plugin.merge(record, section)
+
+
+def process_input(plugin, item):
+    # module level so that it can be sent to the worker processes, which cannot update the run metrics themselves
+    cve_id, source_input = item
+    with measuring() as measurements:
+        try:
+            start = time.perf_counter()
+            parsed_input = plugin.parse(cve_id, source_input)
+            parsed = time.perf_counter()
+            section = plugin.extract(cve_id, parsed_input)
+            extracted = time.perf_counter()
+        except Exception as e:
+            print(cve_id, e)
+            return Failure.from_exception(e), 0, 0, measurements
+    read_seconds = measurements["stages"].get(f"{plugin.name}.read", 0)
+    return section, parsed - start - read_seconds, extracted - parsed, measurements
+
+
+def create_executor(plugin, workers):
+    workers = plugin.worker_count if workers is None else workers
+    if plugin.workers is None or workers <= 1:
+        return None
+    if plugin.workers == "process":
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        # fork the workers now, forking after the reader and writer threads started could copy a held lock
+        executor.submit(int).result()
+        return executor
+    if plugin.workers == "thread":
+        return concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    raise ValueError(f"Unknown workers {plugin.workers} for {plugin.name}, it should be process, thread or None")
+
+
+class StageThread(threading.Thread):
+    """A pipeline stage that stops the whole pipeline when it fails, the error is raised again by run_pipeline."""
+
+    def __init__(self, name, target, stop, *args):
+        super().__init__(name=name, daemon=True)
+        self.stage = target
+        self.stage_args = args
+        self.stop = stop
+        self.error = None
+
+    def run(self):
+        try:
+            self.stage(*self.stage_args)
+        except BaseException as e:
+            self.error = e
+            self.stop.set()
+
+
+def put(stage_queue, message, stop):
+    while not stop.is_set():
+        try:
+            stage_queue.put(message, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def get(stage_queue, stop):
+    """The next message of the queue, None once it is finished or the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            return stage_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
+
+
+def inputs_after(inputs, last_cve_id):
+    """The (CVE ID, input) items after the one of last_cve_id, all of them when it is gone, writing a record again is harmless."""
+    cve_ids = [cve_id for cve_id, _ in inputs]
+    if last_cve_id not in cve_ids:
+        return inputs
+    return inputs[cve_ids.index(last_cve_id) + 1:]
+
+
+def read_inputs(plugin, years, batch_size, progress, discovered, stop):
+    for year in years:
+        if progress.get(year) == "done":
+            print(f"{plugin.name} was already aggregated for year {year}, skipping it")
+            continue
+        inputs = plugin.discover(year)
+        # the last CVE written before the previous run of the year stopped
+        last_cve_id = progress.get(year)
+        if isinstance(inputs, dict):
+            # sorted, so that a resumed run goes on after the last CVE written even when inputs were added since
+            inputs = sorted(inputs.items())
+            if last_cve_id is not None:
+                inputs = [item for item in inputs if item[0] > last_cve_id]
+        elif last_cve_id is not None:
+            inputs = inputs_after(list(inputs), last_cve_id)
+        total = len(inputs) if isinstance(inputs, list) else None
+        put(discovered, ("start", year, total), stop)
+        batch = []
+        for item in inputs:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                put(discovered, ("batch", year, (batch, batch[-1][0])), stop)
+                batch = []
+            if stop.is_set():
+                return
+        if batch:
+            put(discovered, ("batch", year, (batch, batch[-1][0])), stop)
+        put(discovered, ("end", year, None), stop)
+    put(discovered, None, stop)
+
+
+def map_inputs(plugin, executor, items):
+    """The results of process_input for the (CVE ID, input) items, computed on executor when there is one."""
+    process = functools.partial(process_input, plugin)
+    if executor is None:
+        return map(process, items)
+    if plugin.workers == "process":
+        return executor.map(process, items, chunksize=PROCESS_CHUNKSIZE)
+    return executor.map(process, items)
+
+
+def process_batch(plugin, executors, year, items, run_metrics, journal):
+    """Parse and extract the (CVE ID, input) items of a batch, returns {CVE ID: {plugin name: section}}.
+
+    The plugins of a MergedSources process their inputs at the same time, each on its executor in
+    executors. An input that fails is quarantined in journal, without a journal it stops the pipeline.
+    """
+    sources = plugin.source_plugins()
+    items_by_source = {name: [] for name in sources}
+    sections = {}
+    for cve_id, source_input in items:
+        sections[cve_id] = {}
+        for name, item_input in plugin.source_inputs(source_input).items():
+            if item_input is None:
+                sections[cve_id][name] = None
+            else:
+                items_by_source[name].append((cve_id, item_input))
+    # every executor is given its inputs before any result is waited for
+    results_by_source = {name: map_inputs(sources[name], executors.get(name), source_items)
+                         for name, source_items in items_by_source.items() if source_items}
+
+    for name, results in results_by_source.items():
+        records = 0
+        for (cve_id, source_input), (section, parse_seconds, extract_seconds, measurements) in zip(items_by_source[name], results):
+            run_metrics.merge(measurements)
+            if isinstance(section, Failure):
+                run_metrics.count(f"{name}.errors")
+                if journal is None:
+                    raise RuntimeError(f"{name} failed on {cve_id}: {section.error}\n{section.traceback}")
+                journal.quarantine(name, year, cve_id, source_input, section)
+                continue
+            if journal is not None:
+                journal.release(name, cve_id)
+            sections[cve_id][name] = section
+            records += 1
+            run_metrics.add_time(f"{name}.parse", parse_seconds)
+            run_metrics.add_time(f"{name}.extract", extract_seconds)
+        run_metrics.count(f"{name}.records", records)
+    # in the order of the plugins, and without the CVEs whose every input failed, their records stay as they are
+    return {cve_id: {name: cve_sections[name] for name in sources if name in cve_sections}
+            for cve_id, cve_sections in sections.items() if cve_sections}
+
+
+def write_batch(store, plugin, year, sections, run_metrics):
+    """Merge the {plugin name: section} of every CVE of sections into its record, reading and writing the records as one batch."""
+    sources = plugin.source_plugins()
+    with run_metrics.timer("output.read"):
+        records = store.get_many(year, sections.keys())
+    for cve_id, cve_sections in sections.items():
+        for name, section in cve_sections.items():
+            sources[name].merge(records[cve_id], section)
+    # records left without any section are removed
+    deleted_cve_ids = [cve_id for cve_id, record in records.items() if not record]
+    for cve_id in deleted_cve_ids:
+        del records[cve_id]
+    with run_metrics.timer("output.write"):
+        written = store.put_many(year, records)
+        store.delete_many(year, deleted_cve_ids)
+    run_metrics.count("output.records_written", len(records))
+    run_metrics.count("output.records_deleted", len(deleted_cve_ids))
+    run_metrics.count("output.bytes_written", written or 0)
+
+
+def write_sections(open_store, plugin, extracted, run_metrics, journal, run, stop):
+    # the store is opened here, SQLite connections can only be used by the thread that created them
+    store = open_store()
+    try:
+        while True:
+            message = get(extracted, stop)
+            if message is None:
+                return
+            kind, year, payload = message
+            if kind == "batch":
+                sections, last_cve_id = payload
+                write_batch(store, plugin, year, sections, run_metrics)
+                if journal is not None:
+                    journal.checkpoint(run, year, last_cve_id, flush=store.flush)
+            else:
+                plugin.year_written(year, store)
+                if journal is not None:
+                    journal.complete_year(run, year, flush=store.flush)
+                print(f"finished {payload} records for year {year}")
+    finally:
+        store.close()
+
+
+def run_pipeline(plugin, open_store, years, batch_size, workers=None, run_metrics=None, journal=None, run=None):
+    """Aggregate the inputs of plugin for every year into the store returned by open_store.
+
+    Discovering and reading the inputs, parsing and extracting them and writing the records run at the
+    same time: a reader thread, the workers of the plugin and a writer thread pass batches of at most
+    batch_size CVEs through bounded queues.
+    Without a journal the first failing input stops the pipeline. With a RunJournal failing inputs are
+    quarantined, the progress is checkpointed under `run` (the plugin name by default) and an unfinished
+    run of the same name is resumed. The caller finishes the run in the journal once it returns.
+    """
+    from tqdm import tqdm
+    run_metrics = run_metrics if run_metrics is not None else metrics.Metrics(plugin.name)
+    run = run or plugin.name
+    progress = journal.progress(run) if journal is not None else {}
+    discovered = queue.Queue(PIPELINE_QUEUE_SIZE)
+    extracted = queue.Queue(PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    # forked before the reader and writer threads start
+    executors = {name: create_executor(source, workers) for name, source in plugin.source_plugins().items()}
+    reader = StageThread(f"{plugin.name}-reader", read_inputs, stop, plugin, years, batch_size, progress, discovered, stop)
+    writer = StageThread(f"{plugin.name}-writer", write_sections, stop, open_store, plugin, extracted, run_metrics,
+                         journal, run, stop)
+
+    progress_bar = None
+    count = 0
+    try:
+        reader.start()
+        writer.start()
+        while True:
+            message = get(discovered, stop)
+            if message is None:
+                break
+            kind, year, payload = message
+            if kind == "start":
+                print(f"Starting {plugin.name} data aggregation for year {year}")
+                progress_bar = tqdm(total=payload)
+                count = 0
+                continue
+            if kind == "end":
+                progress_bar.close()
+                put(extracted, ("end", year, count), stop)
+                continue
+
+            items, last_cve_id = payload
+            sections = process_batch(plugin, executors, year, items, run_metrics, journal)
+            put(extracted, ("batch", year, (sections, last_cve_id)), stop)
+            progress_bar.update(len(items))
+            count += len(sections)
+        put(extracted, None, stop)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        reader.join()
+        writer.join()
+        if progress_bar is not None:
+            progress_bar.close()
+        for executor in executors.values():
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    for stage in (reader, writer):
+        if stage.error is not None:
+            raise stage.error
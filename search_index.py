@@ -0,0 +1,179 @@
+import time
+import sqlite3
+import argparse
+from normalize import clean_string
+from sqlite_chunks import select_in_chunks
+
+
+SEARCH_INDEX_FILE = "CVES.search.sqlite"
+# fields of each section that are searchable, None means every text field of the section
+SEARCHABLE_FIELDS = {
+    'nvd': ['description'],
+    'aqua': None,
+    'ubuntu': ['description', 'ubuntu_description'],
+    'redhat': ['bugzilla_description', 'first_description', 'second_description', 'redhat_statement'],
+    'ibm': ['description', 'remedy'],
+    'github': ['summary', 'details'],
+}
+# sections made of one section per advisory, {advisory ID: section}, whose fields are searched in every advisory
+NESTED_SECTIONS = {'github'}
+
+
+def section_text(section, fields, normalize, nested=False):
+    parts = [value for value in section.values() if isinstance(value, dict)] if nested else [section]
+    texts = []
+    for part in parts:
+        part_fields = fields if fields is not None else [key for key, value in part.items() if isinstance(value, str)]
+        texts += [part[field] for field in part_fields if isinstance(part.get(field), str) and part[field]]
+    return normalize(" ".join(texts))
+
+
+class SearchIndex:
+    """Inverted index over the text of the aggregated records, one document per CVE and source.
+
+    The documents live in an SQLite FTS5 table ranked with BM25, their CVE ID, year and
+    source are kept in a plain table so a record can be replaced without scanning the index.
+    """
+
+    def __init__(self, filepath=SEARCH_INDEX_FILE, normalize=str.strip):
+        self.normalize = normalize
+        # IndexedStore can be written from the thread of a WriteBehindStore
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents_meta (id INTEGER PRIMARY KEY, cve_id TEXT NOT NULL, year TEXT NOT NULL, source TEXT NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS documents_meta_cve_id ON documents_meta (cve_id)")
+        self.connection.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS documents USING fts5(text, tokenize='porter unicode61')"
+        )
+        self.connection.commit()
+
+    def delete_many(self, cve_ids):
+        cve_ids = list(cve_ids)
+        with self.connection:
+            ids = [row[0] for row in select_in_chunks(
+                self.connection, "SELECT id FROM documents_meta WHERE cve_id IN ({placeholders})", cve_ids
+            )]
+            self.connection.executemany("DELETE FROM documents WHERE rowid = ?", [(id,) for id in ids])
+            self.connection.executemany("DELETE FROM documents_meta WHERE id = ?", [(id,) for id in ids])
+
+    def update_many(self, year, records):
+        """Replace the documents of every CVE in records, a dict of CVE ID to aggregated record."""
+        self.delete_many(records.keys())
+        with self.connection:
+            for cve_id, record in records.items():
+                for source, fields in SEARCHABLE_FIELDS.items():
+                    if not isinstance(record.get(source), dict):
+                        continue
+                    text = section_text(record[source], fields, self.normalize, source in NESTED_SECTIONS)
+                    if not text:
+                        continue
+                    cursor = self.connection.execute(
+                        "INSERT INTO documents_meta (cve_id, year, source) VALUES (?, ?, ?)", (cve_id, year, source)
+                    )
+                    self.connection.execute("INSERT INTO documents (rowid, text) VALUES (?, ?)", (cursor.lastrowid, text))
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM documents")
+            self.connection.execute("DELETE FROM documents_meta")
+
+    def search(self, query, sources=None, years=None, limit=20):
+        """Return [(CVE ID, year, score, matched sources)] best first, the score is the summed BM25 of the sources."""
+        conditions = ["documents MATCH ?"]
+        parameters = [self.normalize(query)]
+        if sources:
+            conditions.append(f"documents_meta.source IN ({','.join('?' * len(sources))})")
+            parameters += list(sources)
+        if years:
+            conditions.append(f"documents_meta.year IN ({','.join('?' * len(years))})")
+            parameters += list(years)
+        # bm25 can only be evaluated in the FTS query itself, so the matches are materialized before grouping them
+        rows = self.connection.execute(
+            "WITH matches AS MATERIALIZED ("
+            " SELECT documents_meta.cve_id AS cve_id, documents_meta.year AS year, documents_meta.source AS source,"
+            " bm25(documents) AS score FROM documents JOIN documents_meta ON documents_meta.id = documents.rowid"
+            f" WHERE {' AND '.join(conditions)}"
+            ") SELECT cve_id, year, SUM(score) AS total, GROUP_CONCAT(source) FROM matches"
+            " GROUP BY cve_id ORDER BY total LIMIT ?",
+            parameters + [limit]
+        )
+        # bm25 is negative in SQLite, the lower the better
+        return [(cve_id, year, -total, sources.split(",")) for cve_id, year, total, sources in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+class IndexedStore:
+    """Wraps an output store so that every record written or deleted also updates the search index."""
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def put_many(self, year, records):
+        written = self.store.put_many(year, records)
+        self.index.update_many(year, records)
+        return written
+
+    def delete_many(self, year, cve_ids):
+        cve_ids = list(cve_ids)
+        self.store.delete_many(year, cve_ids)
+        self.index.delete_many(cve_ids)
+
+    @property
+    def thread_safe(self):
+        # the index has a single connection
+        return False
+
+    def close(self):
+        self.store.close()
+        self.index.close()
+
+
+def build_index(store, index, batch_size=1000):
+    """Index every record of an output store from scratch, returns the number of records."""
+    index.clear()
+    count = 0
+    batch_year, batch = None, {}
+    for year, cve_id, record in store.iter_records():
+        if year != batch_year or len(batch) >= batch_size:
+            if batch:
+                index.update_many(batch_year, batch)
+            batch_year, batch = year, {}
+        batch[cve_id] = record
+        count += 1
+    if batch:
+        index.update_many(batch_year, batch)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the aggregated CVE descriptions")
+    parser.add_argument("query", help="FTS5 query, e.g. 'heap overflow' or '\"use after free\" NOT kernel', "
+                                      "terms with dashes such as CVE IDs have to be quoted")
+    parser.add_argument("--source", action="append", choices=sorted(SEARCHABLE_FIELDS), help="only match these sources")
+    parser.add_argument("--year", action="append", help="only match these years")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--index", default=SEARCH_INDEX_FILE)
+    args = parser.parse_args()
+
+    # the query goes through the same normalization as the indexed text
+    index = SearchIndex(args.index, normalize=clean_string)
+    start = time.perf_counter()
+    results = index.search(args.query, args.source, args.year, args.limit)
+    elapsed = time.perf_counter() - start
+    for cve_id, year, score, sources in results:
+        print(f"{cve_id}\t{year}\t{score:.3f}\t{','.join(sources)}")
+    print(f"{len(results)} results in {elapsed * 1000:.1f} ms")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+# maximum number of parameters used in one "IN (...)" query
+SQLITE_QUERY_CHUNK = 500
+
+
+def select_in_chunks(connection, query, values, params=()):
+    """Yield the rows of a query whose IN ({placeholders}) takes values, SQLITE_QUERY_CHUNK values at a time.
+
+    params are the parameters of the query that come before the IN list.
+    """
+    values = list(values)
+    for start in range(0, len(values), SQLITE_QUERY_CHUNK):
+        chunk = values[start:start + SQLITE_QUERY_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        yield from connection.execute(query.format(placeholders=placeholders), list(params) + chunk)
@@ -0,0 +1,198 @@
+import os
+import sys
+import time
+import zlib
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+WORK_QUEUE_FILE = "work_queue.sqlite"
+# a leased CVE goes back to the other collectors when its lease is not renewed for this long
+LEASE_SECONDS = 300
+# the CVEs are spread over this many buckets, a collector takes the buckets whose number % shard count is its shard
+SHARD_BUCKETS = 1024
+# seconds a collector waits for another one to release the database
+BUSY_TIMEOUT = 60
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+def shard_bucket(cve_id):
+    # crc32 rather than hash(), which is salted differently in every process
+    return zlib.crc32(cve_id.encode("utf-8")) % SHARD_BUCKETS
+
+
+def default_owner():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """URLs to collect shared by collector processes on one or several hosts, in a SQLite file on a shared volume.
+
+    A collector leases the CVEs it works on, the lease expires after lease_seconds unless it is renewed by
+    heartbeat, and an expired lease is taken over by the next collector that asks for work, so the CVEs of a
+    collector that died are not lost. With shard=(index, count) a collector only leases the CVEs of its
+    shard, collectors with different shards never compete for the same CVEs.
+    Every collector process opens its own WorkQueue, the database is the only thing they share, and
+    the threads of a process can share it.
+    """
+
+    def __init__(self, filepath=WORK_QUEUE_FILE, owner=None, lease_seconds=LEASE_SECONDS):
+        self.owner = owner or default_owner()
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        # autocommit, the transactions that lease work are started explicitly with BEGIN IMMEDIATE.
+        # The rollback journal is kept, WAL needs shared memory that network file systems do not provide
+        self.connection = sqlite3.connect(filepath, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks (cve_id TEXT PRIMARY KEY, year TEXT NOT NULL, url TEXT NOT NULL,"
+            " bucket INTEGER NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, owner TEXT,"
+            " lease_expires REAL, updated_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (year, state, bucket)")
+
+    @contextmanager
+    def transaction(self):
+        # IMMEDIATE takes the write lock before reading, so two collectors cannot lease the same CVE
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def execute(self, query, parameters=()):
+        with self.lock:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def add(self, year, urls, requeue=False):
+        """Queue the {CVE ID: URL} of a year and return how many were added or requeued.
+
+        The CVEs that are already queued keep their state, unless requeue is set: then the done and failed
+        ones are pending again, e.g. because their page turned out to be incomplete. Leased ones are left alone.
+        """
+        now = time.time()
+        with self.transaction():
+            before = self.connection.total_changes
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO tasks (cve_id, year, url, bucket, state, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(cve_id, year, url, shard_bucket(cve_id), PENDING, now) for cve_id, url in urls.items()]
+            )
+            if requeue:
+                self.connection.executemany(
+                    "UPDATE tasks SET state = ?, updated_at = ? WHERE cve_id = ? AND state IN (?, ?)",
+                    [(PENDING, now, cve_id, DONE, FAILED) for cve_id in urls]
+                )
+            added = self.connection.total_changes - before
+        return added
+
+    def lease(self, year, count=1, shard=None):
+        """Lease up to count pending CVEs of the year, or CVEs whose lease expired, and return their (CVE ID, URL)."""
+        now = time.time()
+        query = "SELECT cve_id, url FROM tasks WHERE year = ? AND (state = ? OR (state = ? AND lease_expires < ?))"
+        parameters = [year, PENDING, LEASED, now]
+        if shard is not None:
+            index, shard_count = shard
+            query += " AND bucket % ? = ?"
+            parameters += [shard_count, index]
+        query += " ORDER BY cve_id LIMIT ?"
+        parameters.append(count)
+
+        with self.transaction():
+            items = self.connection.execute(query, parameters).fetchall()
+            self.connection.executemany(
+                "UPDATE tasks SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE cve_id = ?",
+                [(LEASED, self.owner, now + self.lease_seconds, now, cve_id) for cve_id, _ in items]
+            )
+        return items
+
+    def heartbeat(self, cve_ids):
+        """Renew the leases this collector holds on cve_ids, returns how many it renewed.
+
+        Only the CVEs that are still worked on are given, the lease left behind by a worker that died
+        expires and is taken over like the one of a collector that died.
+        """
+        expires = time.time() + self.lease_seconds
+        with self.lock:
+            cursor = self.connection.executemany(
+                "UPDATE tasks SET lease_expires = ? WHERE cve_id = ? AND state = ? AND owner = ?",
+                [(expires, cve_id, LEASED, self.owner) for cve_id in cve_ids]
+            )
+            return cursor.rowcount
+
+    def set_state(self, cve_id, state):
+        # only while this collector still holds the lease, an expired one may already be worked on by another collector
+        self.execute(
+            "UPDATE tasks SET state = ?, owner = NULL, lease_expires = NULL, updated_at = ? WHERE cve_id = ? AND state = ? AND owner = ?",
+            (state, time.time(), cve_id, LEASED, self.owner)
+        )
+
+    def complete(self, cve_id):
+        self.set_state(cve_id, DONE)
+
+    def release(self, cve_id):
+        """Hand a leased CVE back, e.g. after a rate limit, the next collector that asks for work can take it."""
+        self.set_state(cve_id, PENDING)
+
+    def fail(self, cve_id):
+        """Give up on a leased CVE, no collector leases it again until it is requeued."""
+        self.set_state(cve_id, FAILED)
+
+    def requeue_failed(self, year=None):
+        query = "UPDATE tasks SET state = ?, updated_at = ? WHERE state = ?"
+        parameters = [PENDING, time.time(), FAILED]
+        if year is not None:
+            query += " AND year = ?"
+            parameters.append(year)
+        with self.lock:
+            return self.connection.execute(query, parameters).rowcount
+
+    def unfinished(self, year, shard=None):
+        """Number of CVEs of the year, in the shard, that are pending or leased by any collector."""
+        query = "SELECT COUNT(*) FROM tasks WHERE year = ? AND state IN (?, ?)"
+        parameters = [year, PENDING, LEASED]
+        if shard is not None:
+            query += " AND bucket % ? = ?"
+            parameters += [shard[1], shard[0]]
+        return self.execute(query, parameters)[0][0]
+
+    def counts(self):
+        """{year: {state: number of CVEs}}"""
+        counts = {}
+        for year, state, count in self.execute("SELECT year, state, COUNT(*) FROM tasks GROUP BY year, state"):
+            counts.setdefault(year, {})[state] = count
+        return counts
+
+    def leases(self):
+        """{owner: (number of leased CVEs, latest expiry)}"""
+        rows = self.execute("SELECT owner, COUNT(*), MAX(lease_expires) FROM tasks WHERE state = ? GROUP BY owner", (LEASED,))
+        return {owner: (count, expires) for owner, count, expires in rows}
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    # python work_queue.py [queue file] [requeue], shows the progress of the collectors sharing the queue
+    filepath = sys.argv[1] if len(sys.argv) > 1 else WORK_QUEUE_FILE
+    work_queue = WorkQueue(filepath)
+    if sys.argv[2:3] == ["requeue"]:
+        print(f"requeued {work_queue.requeue_failed()} failed CVEs")
+    for year, counts in sorted(work_queue.counts().items()):
+        print(year, ", ".join(f"{counts.get(state, 0)} {state}" for state in (PENDING, LEASED, DONE, FAILED)))
+    now = time.time()
+    for owner, (count, expires) in sorted(work_queue.leases().items()):
+        status = "expired" if expires < now else f"expires in {expires - now:.0f}s"
+        print(f"{owner}: {count} leased, {status}")
+    work_queue.close()
+
+
+if __name__ == "__main__":
+    main()